@@ -0,0 +1,95 @@
+import threading
+from collections import Counter
+from typing import Optional
+
+
+class RunCancelled(Exception):
+    pass
+
+
+class CancellationToken:
+    def __init__(self, project_id: int, state: Optional[str] = None):
+        self.project_id = project_id
+        self.state = state
+        self._event = threading.Event()
+        self._finished = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RunCancelled(
+                f"The calculation for the project ID={self.project_id} was cancelled by a newer request"
+            )
+
+
+_tokens = {}
+_lock = threading.Lock()
+_counters = Counter()  # the contention between the runs, see `get_report`
+
+
+def record(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def get_report() -> dict:
+    """The runs cancelled by a newer request, the requests that joined the run in flight
+    ("same_state"), the background runs skipped or waited for, and the waits for the
+    active request of a project (`lock_waits`, `lock_wait_seconds`)."""
+    with _lock:
+        report = {name: 0 for name in ("cancelled", "same_state", "skipped", "waited", "lock_waits")}
+        report.update(_counters)
+        report["lock_wait_seconds"] = round(report.get("lock_wait_seconds", 0), 3)
+        report["runs_in_flight"] = len(_tokens)
+    return report
+
+
+def start_run(
+    project_id: int, on_busy: str = "cancel", state: Optional[str] = None
+) -> Optional[CancellationToken]:
+    """Returns the token of a new run of the project. If a run of the project is in flight,
+    `on_busy` decides: "cancel" cancels the obsolete run (a user request), "wait" waits
+    until it finishes and "skip" returns None (the background refreshes).
+
+    `state` is the state of the project the run calculates (f.e. the fingerprint hash).
+    A run in flight with the same state is not obsolete: "cancel" returns None for it.
+    """
+    token = CancellationToken(project_id, state)
+    while True:
+        with _lock:
+            previous = _tokens.get(project_id)
+            if previous is not None and on_busy == "cancel":
+                if state is not None and previous.state == state:
+                    _counters["same_state"] += 1
+                    return None
+            if previous is None or on_busy == "cancel":
+                _tokens[project_id] = token
+                break
+            if on_busy == "skip":
+                _counters["skipped"] += 1
+                return None
+            _counters["waited"] += 1
+        previous._finished.wait()
+    if previous is not None:
+        previous.cancel()
+        record("cancelled")
+    return token
+
+
+def finish_run(token: CancellationToken):
+    """Forgets the token of a finished run, unless a newer run has replaced it."""
+    with _lock:
+        if _tokens.get(token.project_id) is token:
+            del _tokens[token.project_id]
+    token._finished.set()
+
+
+def is_running(project_id: int) -> bool:
+    with _lock:
+        return project_id in _tokens
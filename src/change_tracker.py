@@ -0,0 +1,77 @@
+import threading
+import time
+from typing import Callable, Iterable, Optional, Set
+
+import supervisely as sly
+
+
+EVENT_TYPES = ("image", "figure", "meta")
+
+
+class ChangeTracker:
+    """Collects per-project dirty sets from change notifications and, after a debounce
+    window, triggers an incremental recalculation of the affected images only.
+
+    Meta events can not be resolved to images, so they turn the recalculation into a
+    regular run with the full listing of project images.
+    """
+
+    def __init__(
+        self,
+        refresh_func: Callable[[int, Optional[Set[int]]], None],
+        debounce: float,
+        max_delay: float,
+    ):
+        self.refresh_func = refresh_func
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._dirty = {}  # project_id -> {"image_ids": set, "meta": bool, "since": float}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def notify(self, project_id: int, image_ids: Iterable[int], meta_changed: bool = False):
+        with self._lock:
+            entry = self._dirty.setdefault(
+                project_id, {"image_ids": set(), "meta": False, "since": time.monotonic()}
+            )
+            entry["image_ids"].update(image_ids)
+            entry["meta"] = entry["meta"] or meta_changed
+
+            delay = self.debounce
+            elapsed = time.monotonic() - entry["since"]
+            if elapsed + delay > self.max_delay:
+                delay = max(self.max_delay - elapsed, 0)
+
+            timer = self._timers.pop(project_id, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(delay, self._flush, args=(project_id,))
+            timer.daemon = True
+            self._timers[project_id] = timer
+            timer.start()
+
+    def pending(self, project_id: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._dirty.get(project_id)
+            if entry is None:
+                return None
+            return {"images": len(entry["image_ids"]), "meta": entry["meta"]}
+
+    def _flush(self, project_id: int):
+        with self._lock:
+            self._timers.pop(project_id, None)
+            entry = self._dirty.pop(project_id, None)
+        if entry is None:
+            return
+
+        image_ids = None if entry["meta"] else entry["image_ids"]
+        sly.logger.info(
+            f"Recalculating stats for the project ID={project_id} after change notifications "
+            f"(images: {len(entry['image_ids'])}, meta changed: {entry['meta']})"
+        )
+        try:
+            self.refresh_func(project_id, image_ids)
+        except Exception as e:
+            sly.logger.warning(
+                f"Recalculation of the project ID={project_id} failed: {e.__class__.__name__}: {e}"
+            )
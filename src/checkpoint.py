@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import supervisely as sly
+import src.globals as g
+
+
+class Checkpointer:
+    """Periodically uploads the completed chunks of a run to team files, so a restarted
+    run of the same project resumes from the last checkpoint instead of starting over.
+
+    A checkpoint is valid only for the same fingerprint (chunk size, project meta and
+    `dataset-tools` version); a chunk is reused only if its images digest is unchanged.
+    """
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(
+        self,
+        team_id: int,
+        tf_project_dir: str,
+        project_fs_dir: str,
+        fingerprint: dict,
+        interval: float,
+    ):
+        self.team_id = team_id
+        self.project_fs_dir = project_fs_dir
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self.tf_dir = f"{tf_project_dir}/_cache/checkpoint"
+        self.local_dir = f"{project_fs_dir}/_checkpoint"
+        self._chunks = {}  # chunk -> {"digest": str, "dt": str, "files": [relative paths]}
+        self._restored = {}
+        self._pending = []
+        self._flushed_at = time.monotonic()
+
+    def restore(self) -> int:
+        """Downloads the checkpointed chunks into the project dir. Returns their number."""
+        tf_manifest = f"{self.tf_dir}/{self.MANIFEST_NAME}"
+        if not g.api.file.exists(self.team_id, tf_manifest):
+            return 0
+
+        sly.fs.mkdir(self.local_dir, remove_content_if_exists=True)
+        g.api.file.download_directory(self.team_id, self.tf_dir, self.local_dir)
+        with open(f"{self.local_dir}/{self.MANIFEST_NAME}", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        if manifest.get("fingerprint") != self.fingerprint:
+            sly.logger.log(g._INFO, "The checkpoint is outdated and will be discarded.")
+            sly.fs.remove_dir(self.local_dir)
+            self.clear()
+            return 0
+
+        for chunk, entry in manifest.get("chunks", {}).items():
+            for relpath in entry["files"]:
+                dst = f"{self.project_fs_dir}/{relpath}"
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.move(f"{self.local_dir}/{relpath}", dst)
+            self._restored[chunk] = entry
+        self._chunks.update(self._restored)
+        sly.fs.remove_dir(self.local_dir)
+
+        sly.logger.log(g._INFO, f"{len(self._restored)} chunks were restored from the checkpoint.")
+        return len(self._restored)
+
+    def get_completed(self, chunk: str, digest: str) -> Optional[datetime]:
+        """Returns the latest datetime of the chunk if it was restored with the same images."""
+        entry = self._restored.get(chunk)
+        if entry is None or entry["digest"] != digest:
+            return None
+        return datetime.fromisoformat(entry["dt"])
+
+    def add(self, chunk: str, digest: str, latest_datetime: datetime, paths: List[str]):
+        relpaths = [os.path.relpath(p, self.project_fs_dir) for p in paths]
+        self._chunks[chunk] = {"digest": digest, "dt": latest_datetime.isoformat(), "files": relpaths}
+        self._pending.extend(relpaths)
+        if time.monotonic() - self._flushed_at > self.interval:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if len(self._pending) == 0:
+            return
+
+        src_paths = [f"{self.project_fs_dir}/{p}" for p in self._pending]
+        dst_paths = [f"{self.tf_dir}/{p}" for p in self._pending]
+        g.api.file.upload_bulk(self.team_id, src_paths, dst_paths)
+
+        manifest_path = f"{self.project_fs_dir}/_cache/{self.MANIFEST_NAME}"
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "chunks": self._chunks}, f)
+        g.api.file.upload(self.team_id, manifest_path, f"{self.tf_dir}/{self.MANIFEST_NAME}")
+
+        sly.logger.log(
+            g._INFO, f"The checkpoint was saved: {len(self._chunks)} chunks are completed."
+        )
+        self._pending = []
+
+    def clear(self):
+        g.api.file.remove_dir(self.team_id, f"{self.tf_dir}/", silent=True)
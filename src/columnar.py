@@ -0,0 +1,134 @@
+import json
+import numbers
+from typing import Iterator, Optional
+
+import numpy as np
+import ujson
+
+
+# the kinds of the value cells of a mixed table
+FLOAT, INT, NULL = 0, 1, 2
+
+
+def _is_number(value) -> bool:
+    # bool is an Integral, but it has to stay `true`/`false` in JSON
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def get_label_columns_count(res: dict) -> Optional[int]:
+    """Returns the number of leading non-numeric columns if `res` is a matrix-shaped table
+    (`columns` + rectangular `data` rows with numeric values after the label columns).
+    """
+    columns, data = res.get("columns"), res.get("data")
+    if not isinstance(columns, list) or not isinstance(data, list) or len(data) == 0:
+        return None
+    width = len(columns)
+    if any(not isinstance(row, list) or len(row) != width for row in data):
+        return None
+
+    count = 0
+    for row in data:
+        for idx in range(width - 1, count - 1, -1):
+            value = row[idx]
+            if value is not None and not _is_number(value):
+                count = idx + 1
+                break
+    if count >= width:
+        return None
+    return count
+
+
+def save_columnar(res: dict, path: str, label_columns: int):
+    """Saves the table as `.npz`: `columns`, `labels` (leading columns, every cell as JSON),
+    `values` (numeric matrix) and `meta` (the key order and the rest of the keys as JSON).
+
+    The table is rendered back to the same JSON: an all-int matrix is saved as int64, any
+    other as float64 + `ints` (int64) + `kinds` (FLOAT / INT / NULL of every cell).
+    """
+    data = res["data"]
+    values = [row[label_columns:] for row in data]
+    arrays = {}
+    if all(isinstance(v, numbers.Integral) for row in values for v in row):
+        arrays["values"] = np.array(values, dtype=np.int64)
+    else:
+        kinds = [
+            [NULL if v is None else INT if isinstance(v, numbers.Integral) else FLOAT for v in row] for row in values
+        ]
+        arrays["kinds"] = np.array(kinds, dtype=np.int8)
+        arrays["ints"] = np.array(
+            [[v if k == INT else 0 for v, k in zip(row, kinds_row)] for row, kinds_row in zip(values, kinds)],
+            dtype=np.int64,
+        )
+        arrays["values"] = np.array(
+            [[v if k == FLOAT else 0.0 for v, k in zip(row, kinds_row)] for row, kinds_row in zip(values, kinds)],
+            dtype=np.float64,
+        )
+
+    labels = [[ujson.dumps(v) for v in row[:label_columns]] for row in data]
+    meta = {"keys": list(res.keys()), "extra": {k: v for k, v in res.items() if k not in ("columns", "data")}}
+    np.savez_compressed(
+        path,
+        columns=np.array(ujson.dumps(res["columns"])),
+        labels=np.array(labels, dtype=str).reshape(len(data), label_columns),
+        meta=np.array(ujson.dumps(meta)),
+        **arrays,
+    )
+
+
+def iter_json(res: dict, rows_per_chunk: int = 1000) -> Iterator[str]:
+    """Renders `res` to JSON text piece by piece, without building the whole string."""
+    yield "{"
+    first = True
+    for key, value in res.items():
+        if key == "data":
+            continue
+        yield ("" if first else ",") + ujson.dumps(key) + ":" + ujson.dumps(value)
+        first = False
+    if "data" in res:
+        yield ("" if first else ",") + '"data":['
+        data = res["data"]
+        for start in range(0, len(data), rows_per_chunk):
+            rows = ",".join(ujson.dumps(row) for row in data[start : start + rows_per_chunk])
+            yield ("," if start > 0 else "") + rows
+        yield "]"
+    yield "}"
+
+
+def iter_json_from_columnar(path: str, rows_per_chunk: int = 1000) -> Iterator[str]:
+    """Renders the `.npz` table saved by `save_columnar` back to JSON, chunk by chunk.
+    The text is the same as `ujson.dumps` of the saved table.
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        columns, labels, values = str(npz["columns"]), npz["labels"], npz["values"]
+        kinds = npz["kinds"] if "kinds" in npz.files else None
+        ints = npz["ints"] if "ints" in npz.files else None
+        meta = json.loads(str(npz["meta"]))
+
+    first = True
+    for key in meta["keys"]:
+        prefix = ("{" if first else ",") + ujson.dumps(key) + ":"
+        first = False
+        if key == "columns":
+            yield prefix + columns
+            continue
+        if key != "data":
+            yield prefix + ujson.dumps(meta["extra"][key])
+            continue
+
+        yield prefix + "["
+        for start in range(0, len(labels), rows_per_chunk):
+            stop = start + rows_per_chunk
+            rows = []
+            for idx, label_row in enumerate(labels[start:stop].tolist(), start):
+                if kinds is None:
+                    value_row = values[idx].tolist()
+                else:
+                    value_row = [
+                        None if k == NULL else i if k == INT else v
+                        for k, i, v in zip(kinds[idx].tolist(), ints[idx].tolist(), values[idx].tolist())
+                    ]
+                cells = label_row + ([ujson.dumps(value_row)[1:-1]] if len(value_row) > 0 else [])
+                rows.append("[" + ",".join(cells) + "]")
+            yield ("," if start > 0 else "") + ",".join(rows)
+        yield "]"
+    yield "}"
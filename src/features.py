@@ -0,0 +1,172 @@
+import functools
+from typing import TYPE_CHECKING, Callable, Dict, List
+
+import numpy as np
+import supervisely as sly
+from supervisely import FigureInfo, ImageInfo
+
+if TYPE_CHECKING:
+    from dataset_tools.image.stats.basestats import BaseStats
+
+
+# the updaters below write the private state of the dataset-tools stats, it was verified
+# against these versions (the stats are equal to the ones of `update2`)
+VERIFIED_DTOOLS_VERSIONS = ("0.1.4",)
+
+
+@functools.lru_cache(maxsize=1)
+def has_verified_internals() -> bool:
+    """Whether the installed dataset-tools is verified for the vectorized updaters,
+    the stats are updated with `update2` per image otherwise."""
+    try:
+        import dataset_tools as dtools
+
+        version = dtools.__version__
+    except Exception:
+        return False
+    if version not in VERIFIED_DTOOLS_VERSIONS:
+        sly.logger.warning(
+            f"The vectorized stats are not verified for dataset-tools {version}, "
+            f"updating the stats per image (verified: {', '.join(VERIFIED_DTOOLS_VERSIONS)})"
+        )
+        return False
+    return True
+
+
+class BatchFeatures:
+    """The figures of a batch of labeled images as flat arrays, extracted once and shared
+    by the vectorized stat updaters.
+
+    Per figure: `fig_image` (row in `image_ids`), `fig_class` (column in `class_ids`),
+    `fig_ids` and `fig_area`. Per image × class of the batch: `counts` and `areas`
+    (the summed figure area).
+    """
+
+    def __init__(self, images: List[ImageInfo], figures: Dict[int, List[FigureInfo]]):
+        self.images = images
+        self.image_ids = np.array([image.id for image in images], dtype=np.int64)
+        self.image_area = np.array([image.width * image.height for image in images], dtype=np.float64)
+
+        fig_image, fig_class_ids, fig_ids, fig_area = [], [], [], []
+        for idx, image in enumerate(images):
+            for fig in figures.get(image.id, []):
+                fig_image.append(idx)
+                fig_class_ids.append(fig.class_id)
+                fig_ids.append(fig.id)
+                fig_area.append(float(fig.area))
+
+        self.fig_image = np.array(fig_image, dtype=np.int64)
+        self.fig_ids = np.array(fig_ids, dtype=np.int64)
+        self.fig_area = np.array(fig_area, dtype=np.float64)
+        self.class_ids, self.fig_class = np.unique(
+            np.array(fig_class_ids, dtype=np.int64), return_inverse=True
+        )
+
+        shape = (len(images), len(self.class_ids))
+        self.counts = np.zeros(shape, dtype=np.int64)
+        np.add.at(self.counts, (self.fig_image, self.fig_class), 1)
+        self.areas = np.zeros(shape, dtype=np.float64)
+        np.add.at(self.areas, (self.fig_image, self.fig_class), self.fig_area)
+
+    def known_columns(self, class_ids) -> List[int]:
+        """Columns of the classes present in the stat (the others are not in its meta)."""
+        return [col for col, class_id in enumerate(self.class_ids.tolist()) if class_id in class_ids]
+
+
+def update_class_balance(stat: "BaseStats", features: BatchFeatures):
+    stat.is_unlabeled = False
+    area_percent = np.trunc(features.fig_area) / features.image_area[features.fig_image]
+    area_sums = np.bincount(features.fig_class, weights=area_percent, minlength=len(features.class_ids))
+    for col in features.known_columns(stat._class_ids):
+        class_id = int(features.class_ids[col])
+        stat._images_set[class_id].update(features.image_ids[features.counts[:, col] > 0].tolist())
+        stat._objects_set[class_id].update(features.fig_ids[features.fig_class == col].tolist())
+        stat._area_images_percent_sum[class_id] += float(area_sums[col])
+
+
+def update_class_cooccurrence(stat: "BaseStats", features: BatchFeatures):
+    if stat._num_classes == 0:
+        return
+    columns = features.known_columns(stat._class_ids)
+    presence = (features.counts[:, columns] > 0).astype(np.int64)
+    pairs = presence.T @ presence  # images with both classes
+    for i, j in zip(*np.nonzero(pairs)):
+        ids = features.image_ids[(presence[:, i] & presence[:, j]).astype(bool)].tolist()
+        stat.co_occurrence_dict[int(features.class_ids[columns[i]])][
+            int(features.class_ids[columns[j]])
+        ].update(ids)
+
+
+def update_objects_distribution(stat: "BaseStats", features: BatchFeatures):
+    columns = {int(features.class_ids[col]): col for col in features.known_columns(stat._class_ids)}
+    all_ids = features.image_ids.tolist()
+    for class_id in stat._class_ids:
+        col = columns.get(class_id)
+        if col is None:
+            stat._distribution_dict[class_id][0].update(all_ids)
+            continue
+        counts = features.counts[:, col]
+        for count in np.unique(counts).tolist():
+            ids = features.image_ids[counts == count].tolist()
+            stat._distribution_dict[class_id].setdefault(count, set()).update(ids)
+            stat._max_count = max(stat._max_count, count)
+
+
+def update_classes_per_image(stat: "BaseStats", features: BatchFeatures):
+    columns = {int(features.class_ids[col]): col for col in features.known_columns(stat._class_ids)}
+    area_percent = features.areas / features.image_area[:, None] * 100
+    class_ids = list(stat._class_ids)
+    for idx, image in enumerate(features.images):
+        counts_row = features.counts[idx].tolist()
+        areas_row = area_percent[idx].tolist()
+        classes = {}
+        for class_id in class_ids:
+            col = columns.get(class_id)
+            if col is None:
+                classes[class_id] = [0, 0]
+            else:
+                classes[class_id] = [counts_row[col], round(areas_row[col], 2)]
+        stat._data_dict[image.id] = {
+            "image": image.name,
+            "dataset": stat._splits[image.dataset_id],
+            "height": image.height,
+            "width": image.width,
+            "classes": classes,
+        }
+
+
+VECTORIZED_UPDATERS: Dict[str, Callable[["BaseStats", BatchFeatures], None]] = {
+    "ClassBalance": update_class_balance,
+    "ClassCooccurrence": update_class_cooccurrence,
+    "ObjectsDistribution": update_objects_distribution,
+    "ClassesPerImage": update_classes_per_image,
+}
+
+
+def update_stats_with_batch(
+    stats: List["BaseStats"], images: List[ImageInfo], figures: Dict[int, List[FigureInfo]]
+):
+    """Updates the stats with a batch of images: the stats with a vectorized updater share
+    one `BatchFeatures`, the rest are updated with `update2` per image.
+
+    The vectorized updaters are used only with a verified dataset-tools version and for
+    the batches without figures of the classes missing in the stat: `update2` raises on
+    them, so it is left to do that.
+    """
+    if len(images) == 0:
+        return
+    vectorized = []
+    if has_verified_internals():
+        vectorized = [stat for stat in stats if type(stat).__name__ in VECTORIZED_UPDATERS]
+    if len(vectorized) > 0:
+        features = BatchFeatures(images, figures)
+        class_ids = set(features.class_ids.tolist())
+        vectorized = [stat for stat in vectorized if class_ids <= set(stat._class_ids)]
+        for stat in vectorized:
+            VECTORIZED_UPDATERS[type(stat).__name__](stat, features)
+
+    per_image = [stat for stat in stats if stat not in vectorized]
+    for image in images:
+        figs = figures.get(image.id, [])
+        for stat in per_image:
+            stat.update2(image, figs)
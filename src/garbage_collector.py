@@ -0,0 +1,191 @@
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Iterable, List, Optional
+
+import supervisely as sly
+import src.globals as g
+
+
+class GarbageCollector:
+    """Removes stale local and remote artifacts in batches on a background thread.
+
+    Local files are first moved to a trash dir (a cheap rename), so they disappear from
+    the chunk dirs immediately. Paths under a pinned prefix (f.e. an archive being
+    uploaded or downloaded) are kept until they are unpinned.
+    """
+
+    def __init__(self, batch_size: int, interval: float):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._local = []  # [(path, sizeb)]
+        self._remote = defaultdict(list)  # team_id -> [(path, sizeb)]
+        self._remote_dirs = []  # [(team_id, path)]
+        self._sweeps = []  # [(team_id, tf_dir, archive name to keep)]
+        self._seen_remote_dirs = set()
+        self._pinned = Counter()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.reclaimed_bytes = 0
+        self.removed_local = 0
+        self.removed_remote = 0
+
+    def discard_local(self, paths: Iterable[str], trash_dir: str) -> int:
+        """Moves the files to the trash dir and schedules their removal."""
+        os.makedirs(trash_dir, exist_ok=True)
+        moved = []
+        for path in paths:
+            try:
+                sizeb = os.path.getsize(path)
+                dst = f"{trash_dir}/{uuid.uuid4().hex}_{os.path.basename(path)}"
+                os.replace(path, dst)
+            except FileNotFoundError:
+                continue
+            moved.append((dst, sizeb))
+        with self._lock:
+            self._local.extend(moved)
+        self._start()
+        return len(moved)
+
+    def collect_remote(self, team_id: int, paths: Iterable[str], sizeb: Optional[List[int]] = None):
+        paths = list(paths)
+        sizeb = sizeb or [0] * len(paths)
+        with self._lock:
+            self._remote[team_id].extend(zip(paths, sizeb))
+        self._start()
+
+    def collect_remote_dir(self, team_id: int, path: str):
+        """Schedules the removal of the remote dir once per app session."""
+        with self._lock:
+            if (team_id, path) in self._seen_remote_dirs:
+                return
+            self._seen_remote_dirs.add((team_id, path))
+            self._remote_dirs.append((team_id, path))
+        self._start()
+
+    def sweep_archives(self, team_id: int, tf_project_dir: str, keep: str):
+        """Schedules the removal of all chunks archives in the dir except `keep`."""
+        with self._lock:
+            self._sweeps.append((team_id, tf_project_dir, keep))
+        self._start()
+
+    @contextmanager
+    def pinned(self, path: str):
+        with self._lock:
+            self._pinned[path] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pinned[path] -= 1
+                if self._pinned[path] <= 0:
+                    del self._pinned[path]
+            self._wakeup.set()
+
+    def get_report(self) -> dict:
+        with self._lock:
+            pending = len(self._local) + sum(len(x) for x in self._remote.values())
+            return {
+                "reclaimed_bytes": self.reclaimed_bytes,
+                "removed_local": self.removed_local,
+                "removed_remote": self.removed_remote,
+                "pending": pending + len(self._remote_dirs) + len(self._sweeps),
+            }
+
+    def _start(self):
+        self._wakeup.set()
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="garbage-collector", daemon=True)
+        self._thread.start()
+
+    def _is_pinned(self, path: str) -> bool:
+        return any(path == p or path.startswith(p.rstrip("/") + "/") for p in self._pinned)
+
+    def _take(self, items: list) -> list:
+        batch, rest = [], []
+        for item in items:
+            if len(batch) < self.batch_size and not self._is_pinned(item[0]):
+                batch.append(item)
+            else:
+                rest.append(item)
+        items[:] = rest
+        return batch
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self._collect()
+            except Exception as e:
+                sly.logger.warning(f"Garbage collection failed: {e.__class__.__name__}: {e}")
+
+    def _collect(self):
+        with self._lock:
+            sweeps, self._sweeps = self._sweeps, []
+        for team_id, tf_dir, keep in sweeps:
+            self._sweep(team_id, tf_dir, keep)
+
+        reclaimed, removed_local, removed_remote = 0, 0, 0
+        while True:
+            with self._lock:
+                local = self._take(self._local)
+                remote = {team_id: self._take(items) for team_id, items in self._remote.items()}
+                remote_dirs, self._remote_dirs = self._remote_dirs, []
+            if len(local) == 0 and all(len(x) == 0 for x in remote.values()) and len(remote_dirs) == 0:
+                break
+
+            for path, sizeb in local:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.exists(path):
+                    os.remove(path)
+                else:
+                    continue
+                reclaimed += sizeb
+                removed_local += 1
+
+            for team_id, items in remote.items():
+                if len(items) == 0:
+                    continue
+                paths = [path for path, _ in items]
+                if hasattr(g.api.file, "remove_batch"):
+                    g.api.file.remove_batch(team_id, paths)
+                else:
+                    for path in paths:
+                        g.api.file.remove_file(team_id, path)
+                reclaimed += sum(sizeb for _, sizeb in items)
+                removed_remote += len(items)
+
+            for team_id, path in remote_dirs:
+                g.api.file.remove_dir(team_id, path, silent=True)
+                removed_remote += 1
+
+        with self._lock:
+            self.reclaimed_bytes += reclaimed
+            self.removed_local += removed_local
+            self.removed_remote += removed_remote
+        if removed_local > 0 or removed_remote > 0:
+            sly.logger.info(
+                f"Garbage collection: {removed_local} local and {removed_remote} remote artifacts "
+                f"were removed, {reclaimed} bytes reclaimed"
+            )
+
+    def _sweep(self, team_id: int, tf_dir: str, keep: str):
+        archives = [
+            info
+            for info in g.api.file.list2(team_id, tf_dir, recursive=False)
+            if info.path.endswith(".tar.gz") and os.path.basename(info.path) != keep
+        ]
+        if len(archives) > 0:
+            sly.logger.info(f"{len(archives)} old chunks archives were scheduled for removal from team files")
+            self.collect_remote(team_id, [x.path for x in archives], [x.sizeb or 0 for x in archives])
+
+
+garbage_collector = GarbageCollector(g.GC_BATCH_SIZE, g.GC_INTERVAL)
@@ -1,4 +1,6 @@
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import supervisely as sly
 from supervisely.sly_logger import LOGGING_LEVELS
@@ -9,7 +11,20 @@ if sly.is_development():
     load_dotenv(os.path.expanduser("~/supervisely.env"))
     # load_dotenv(os.path.expanduser("~/ninja.env"))
 
-api = sly.Api.from_env()
+STARTED_AT = time.perf_counter()
+
+_api_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # the API client is created on the first use to keep the import of the app cheap
+    if name == "api":
+        with _api_lock:
+            if "api" not in globals():
+                globals()["api"] = sly.Api.from_env()
+        return globals()["api"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 STORAGE_DIR = sly.app.get_data_dir()
 TF_STATS_DIR = "/stats"
@@ -17,15 +32,65 @@ TF_STATS_DIR = "/stats"
 
 CHUNKS_LATEST_DATETIME = None
 ACTIVE_REQUESTS_DIR = f"{STORAGE_DIR}/_active_requests"
-sly.fs.mkdir(ACTIVE_REQUESTS_DIR, remove_content_if_exists=True)
 TF_ACTIVE_REQUESTS_DIR = f"{TF_STATS_DIR}/_active_requests"
 
 CHUNK_SIZE: int = 1000
+POSTPROCESS_WORKERS: int = int(os.environ.get("POSTPROCESS_WORKERS", 2))
+POSTPROCESS_MAX_PENDING: int = int(os.environ.get("POSTPROCESS_MAX_PENDING", 8))
+POSTPROCESS_WAIT_TIMEOUT: float = 3600  # seconds
+
+PREVIEW_FRACTION: float = float(os.environ.get("PREVIEW_FRACTION", 0.02))
+PREVIEW_REFINEMENT_STEPS: int = 2  # each step samples 4 times more images
+PREVIEW_WORKERS: int = 1
+
+SHARD_ROLE: str = os.environ.get("SHARD_ROLE", "off")  # off | coordinator | worker
+SHARD_BACKEND: str = os.environ.get("SHARD_BACKEND", "teamfiles")  # teamfiles | local | memory
+SHARD_LOCAL_DIR: str = os.environ.get("SHARD_LOCAL_DIR", f"{STORAGE_DIR}/_shards/local")
+SHARD_SIZE: int = int(os.environ.get("SHARD_SIZE", 5))  # chunks per shard
+SHARD_MIN_CHUNKS: int = int(os.environ.get("SHARD_MIN_CHUNKS", 20))  # shard bigger runs only
+SHARD_LEASE: float = 600  # seconds, a shard of a silent worker is stolen after it
+SHARD_MAX_ATTEMPTS: int = 3
+SHARD_POLL_INTERVAL: float = 5  # seconds
+
+GC_BATCH_SIZE: int = 500
+GC_INTERVAL: float = 30  # seconds
+
+MEMORY_BUDGET_BYTES: int = int(os.environ.get("MEMORY_BUDGET_BYTES", 0))  # 0 - the cgroup limit
+MEMORY_BUDGET_SHARE: float = float(os.environ.get("MEMORY_BUDGET_SHARE", 0.9))
+MEMORY_HIGH_SHARE: float = 0.7  # of the budget, throttle above it
+MEMORY_CRITICAL_SHARE: float = 0.85  # of the budget, spill to disk above it
+GOVERNOR_INTERVAL: float = 1  # seconds between the RSS samples
+GOVERNOR_MAX_WAIT: float = 600  # seconds, a heavy task runs anyway after it
+
+ANNOTATIONS_CHECK_MAX_SHARE: float = 0.5  # compare annotations if fewer images were updated
+
+COLUMNAR_MIN_CELLS: int = 10000  # save matrix-shaped stats to .npz starting from this size
+CHECKPOINT_INTERVAL: int = int(os.environ.get("CHECKPOINT_INTERVAL", 300))  # seconds
 MINIMUM_DTOOLS_VERSION: str = (
     "0.1.4"  # force stats to fully recalculate (f.e. when edit statistics)
 )
 HEALTHCHECK_PROJECT_ID = 10387
 
+PREWARM_ENABLED: bool = os.environ.get("PREWARM_ENABLED", "false").lower() in ("1", "true")
+PREWARM_WORKERS: int = int(os.environ.get("PREWARM_WORKERS", 1))
+PREWARM_INTERVAL: int = int(os.environ.get("PREWARM_INTERVAL", 300))  # seconds
+PREWARM_CPU_BUDGET: float = float(os.environ.get("PREWARM_CPU_BUDGET", 0.5))  # load per cpu
+
+NOTIFY_DEBOUNCE: float = float(os.environ.get("NOTIFY_DEBOUNCE", 10))  # seconds
+NOTIFY_MAX_DELAY: float = float(os.environ.get("NOTIFY_MAX_DELAY", 120))  # seconds
+
+STATS_CACHE_MAX_BYTES: int = int(os.environ.get("STATS_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+def init_active_requests_dir():
+    sly.fs.mkdir(ACTIVE_REQUESTS_DIR, remove_content_if_exists=True)
+
+
+# the defaults for the code running outside of `main_func` (f.e. the shard worker)
+_INFO = LOGGING_LEVELS["INFO"].int
+_DEBUG = LOGGING_LEVELS["DEBUG"].int
+_WARNING = LOGGING_LEVELS["WARN"].int
+
 
 def initialize_log_levels(project_id):
     global _INFO
@@ -0,0 +1,57 @@
+"""Reports the import time of the app modules (based on `python -X importtime`).
+
+Usage: python -m src.importtime_report [--module src.main] [--top 30] [--json]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from typing import List
+
+
+def measure(module: str) -> List[dict]:
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Failed to import {module!r}:\n{proc.stderr}")
+
+    records = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        records.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+            }
+        )
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument("--top", type=int, default=30)
+    parser.add_argument("--json", action="store_true", help="print machine-readable report")
+    args = parser.parse_args()
+
+    records = measure(args.module)
+    total_us = max((r["cumulative_us"] for r in records if r["depth"] == 0), default=0)
+    top = sorted(records, key=lambda r: r["cumulative_us"], reverse=True)[: args.top]
+
+    if args.json:
+        print(json.dumps({"module": args.module, "total_us": total_us, "top": top}, indent=2))
+        return
+
+    print(f"Import of {args.module!r} took {total_us / 1e6:.3f}s")
+    print(f"{'cumulative [ms]':>16} {'self [ms]':>10}  module")
+    for r in top:
+        print(f"{r['cumulative_us'] / 1e3:>16.1f} {r['self_us'] / 1e3:>10.1f}  {r['module']}")
+
+
+if __name__ == "__main__":
+    main()
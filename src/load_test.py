@@ -0,0 +1,496 @@
+"""Load test of the `/get-stats` endpoint against a fake API and local team files.
+
+Starts the app in-process with a fake `g.api` (projects with generated images and
+figures, team files kept in a temp dir), fires concurrent requests and prints a JSON
+report: latency percentiles, throughput, errors, contention (cancelled runs, waits for
+the active request lock), peak threads and RSS, and duplicated work (figures of the
+same image downloaded more than once).
+
+Usage: python -m src.load_test [--projects 4] [--images 2000] [--concurrency 16]
+    [--requests 64] [--same-project 0.5] [--latency-ms 5] [--output report.json]
+
+The report of the defaults is kept in `docs/load_test_baseline.json`.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import List, Optional
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _make(cls, **kwargs):
+    return cls(**{field: kwargs.get(field) for field in cls._fields})
+
+
+class FakeFileApi:
+    """Team files kept in a local dir, one subdir per team."""
+
+    def __init__(self, root_dir: str, latency: float):
+        self.root_dir = root_dir
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _path(self, team_id: int, path: str) -> str:
+        return os.path.join(self.root_dir, str(team_id), path.lstrip("/"))
+
+    def _call(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+        time.sleep(self.latency)
+
+    def _info(self, team_id: int, local_path: str):
+        stat = os.stat(local_path)
+        updated_at = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        return SimpleNamespace(
+            path="/" + os.path.relpath(local_path, os.path.join(self.root_dir, str(team_id))),
+            sizeb=stat.st_size,
+            updated_at=updated_at.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+        )
+
+    def exists(self, team_id, path):
+        self._call("exists")
+        return os.path.isfile(self._path(team_id, path))
+
+    def dir_exists(self, team_id, path):
+        self._call("dir_exists")
+        return os.path.isdir(self._path(team_id, path))
+
+    def get_info_by_path(self, team_id, path):
+        self._call("get_info_by_path")
+        local_path = self._path(team_id, path)
+        return self._info(team_id, local_path) if os.path.isfile(local_path) else None
+
+    def list2(self, team_id, path, recursive=True):
+        self._call("list2")
+        root = self._path(team_id, path)
+        infos = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            infos.extend(self._info(team_id, os.path.join(dirpath, name)) for name in filenames)
+            if not recursive:
+                break
+        return infos
+
+    def upload(self, team_id, src, dst, progress_cb=None):
+        self._call("upload")
+        local_path = self._path(team_id, dst)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        shutil.copyfile(src, local_path)
+
+    def upload_bulk(self, team_id, src_paths, dst_paths, progress_cb=None):
+        self._call("upload_bulk")
+        for src, dst in zip(src_paths, dst_paths):
+            local_path = self._path(team_id, dst)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            shutil.copyfile(src, local_path)
+
+    def download(self, team_id, remote_path, local_save_path, progress_cb=None):
+        self._call("download")
+        src = self._path(team_id, remote_path)
+        if not os.path.isfile(src):
+            raise FileNotFoundError(remote_path)
+        os.makedirs(os.path.dirname(local_save_path), exist_ok=True)
+        shutil.copyfile(src, local_save_path)
+
+    def download_directory(self, team_id, remote_path, local_save_path, progress_cb=None):
+        self._call("download_directory")
+        shutil.copytree(self._path(team_id, remote_path), local_save_path, dirs_exist_ok=True)
+
+    def remove(self, team_id, path):
+        self._call("remove")
+        local_path = self._path(team_id, path)
+        if os.path.isdir(local_path):
+            shutil.rmtree(local_path, ignore_errors=True)
+        elif os.path.exists(local_path):
+            os.remove(local_path)
+
+    def remove_file(self, team_id, path):
+        self.remove(team_id, path)
+
+    def remove_batch(self, team_id, paths):
+        for path in paths:
+            self.remove(team_id, path)
+
+    def remove_dir(self, team_id, path, silent=False):
+        self._call("remove_dir")
+        shutil.rmtree(self._path(team_id, path), ignore_errors=True)
+
+
+class FakeApi:
+    """The subset of `sly.Api` used by the app, backed by generated projects."""
+
+    TEAM_ID = 1
+    WORKSPACE_ID = 1
+
+    def __init__(self, files_dir: str, projects: int, images: int, classes: int, latency: float):
+        import supervisely as sly
+
+        self.latency = latency
+        self.calls = Counter()
+        self.figure_downloads = Counter()  # image id -> times its figures were downloaded
+        self._lock = threading.Lock()
+        self.file = FakeFileApi(files_dir, latency)
+        self.project = SimpleNamespace(
+            get_info_by_id=self._get_project, get_meta=self._get_meta, get_stats=self._get_stats
+        )
+        self.team = SimpleNamespace(get_info_by_id=lambda id, raise_error=False: self._team)
+        self.workspace = SimpleNamespace(get_info_by_id=lambda id, raise_error=False: self._workspace)
+        self.dataset = SimpleNamespace(get_list=self._get_datasets)
+        self.image = SimpleNamespace(
+            get_list=self._get_images,
+            get_list_generator=self._get_images_pages,
+            get_info_by_id_batch=self._get_images_by_ids,
+            figure=SimpleNamespace(download=self._download_figures),
+        )
+
+        self._team = _make(sly.TeamInfo, id=self.TEAM_ID, name="load-test")
+        self._workspace = _make(sly.WorkspaceInfo, id=self.WORKSPACE_ID, team_id=self.TEAM_ID)
+        self._projects, self._metas, self._datasets = {}, {}, defaultdict(list)
+        self._images, self._figures = {}, {}
+        rng = random.Random(0)
+        next_id = 1000
+        updated_at = _now_iso()
+        for p_idx in range(projects):
+            project_id = 100 + p_idx
+            class_ids = list(range(next_id, next_id + classes))
+            next_id += classes
+            self._metas[project_id] = {
+                "classes": [
+                    {"id": cid, "title": f"class_{cid}", "shape": "rectangle", "color": "#FF0000"}
+                    for cid in class_ids
+                ],
+                "tags": [],
+            }
+            for d_idx in range(2):
+                dataset_id = project_id * 10 + d_idx
+                dataset_images = []
+                for _ in range(images // 2):
+                    image_id, next_id = next_id, next_id + 1
+                    figs = []
+                    for _ in range(rng.choice([0, 0, 1, 2, 3])):
+                        figure_id, next_id = next_id, next_id + 1
+                        top, left = rng.randint(0, 400), rng.randint(0, 400)
+                        figs.append(
+                            _make(
+                                sly.FigureInfo,
+                                id=figure_id,
+                                class_id=rng.choice(class_ids),
+                                entity_id=image_id,
+                                dataset_id=dataset_id,
+                                project_id=project_id,
+                                geometry_type="rectangle",
+                                geometry={"points": {"exterior": [[left, top], [left + 50, top + 50]], "interior": []}},
+                                geometry_meta={"bbox": [top, left, top + 50, left + 50]},
+                                area="2601",
+                                tags=[],
+                                updated_at=updated_at,
+                                created_at=updated_at,
+                            )
+                        )
+                    self._figures[image_id] = figs
+                    dataset_images.append(
+                        _make(
+                            sly.ImageInfo,
+                            id=image_id,
+                            name=f"{image_id}.jpg",
+                            width=640,
+                            height=480,
+                            dataset_id=dataset_id,
+                            project_id=project_id,
+                            labels_count=len(figs),
+                            tags=[],
+                            updated_at=updated_at,
+                            created_at=updated_at,
+                        )
+                    )
+                self._images[dataset_id] = dataset_images
+                self._datasets[project_id].append(
+                    _make(
+                        sly.DatasetInfo,
+                        id=dataset_id,
+                        name=f"ds_{d_idx}",
+                        project_id=project_id,
+                        items_count=len(dataset_images),
+                        updated_at=updated_at,
+                    )
+                )
+            self._projects[project_id] = _make(
+                sly.ProjectInfo,
+                id=project_id,
+                name=f"project_{project_id}",
+                team_id=self.TEAM_ID,
+                workspace_id=self.WORKSPACE_ID,
+                items_count=sum(d.items_count for d in self._datasets[project_id]),
+                datasets_count=2,
+                size="1000000",
+                updated_at=updated_at,
+            )
+
+    @property
+    def project_ids(self) -> List[int]:
+        return list(self._projects.keys())
+
+    def _call(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+        time.sleep(self.latency)
+
+    def _get_project(self, id, raise_error=False):
+        self._call("project.get_info_by_id")
+        return self._projects[id]
+
+    def _get_meta(self, id, with_settings=False):
+        self._call("project.get_meta")
+        return self._metas[id]
+
+    def _get_stats(self, id):
+        self._call("project.get_stats")
+        figures = [
+            fig for ds in self._datasets[id] for image in self._images[ds.id] for fig in self._figures[image.id]
+        ]
+        per_class = Counter(fig.class_id for fig in figures)
+        images = [image for ds in self._datasets[id] for image in self._images[ds.id]]
+        marked = sum(1 for image in images if image.labels_count > 0)
+        return {
+            "images": {
+                "total": {
+                    "imagesInDataset": len(images),
+                    "imagesMarked": marked,
+                    "imagesNotMarked": len(images) - marked,
+                },
+                "objectClasses": [
+                    {"objectClass": {"id": c["id"], "name": c["title"]}, "total": per_class[c["id"]]}
+                    for c in self._metas[id]["classes"]
+                ],
+                "datasets": [],
+            },
+            "objects": {"total": {"objectsInDataset": len(figures)}},
+            "imageTags": {"datasets": []},
+            "objectTags": {"datasets": []},
+        }
+
+    def _get_datasets(self, project_id, filters=None):
+        self._call("dataset.get_list")
+        return self._datasets[project_id]
+
+    def _get_images(self, dataset_id, filters=None, limit=None, **kwargs):
+        self._call("image.get_list")
+        images = self._images[dataset_id]
+        for flt in filters or []:
+            if flt["field"] == "id" and flt["operator"] == "in":
+                ids = set(flt["value"])
+                images = [x for x in images if x.id in ids]
+            elif flt["field"] == "updatedAt" and flt["operator"] == ">":
+                images = [x for x in images if x.updated_at > flt["value"]]
+        return images[:limit] if limit is not None else images
+
+    def _get_images_pages(self, dataset_id, filters=None, batch_size=None, **kwargs):
+        images = self._get_images(dataset_id, filters)
+        batch_size = batch_size or 500
+        for start in range(0, len(images), batch_size):
+            yield images[start : start + batch_size]
+
+    def _get_images_by_ids(self, ids, **kwargs):
+        self._call("image.get_info_by_id_batch")
+        by_id = {x.id: x for images in self._images.values() for x in images}
+        return [by_id.get(id) for id in ids]
+
+    def _download_figures(self, dataset_id, image_ids, skip_geometry=False):
+        self._call("image.figure.download")
+        with self._lock:
+            self.figure_downloads.update(image_ids)
+        return {image_id: self._figures[image_id] for image_id in image_ids if image_id in self._figures}
+
+
+class ResourceSampler:
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss_bytes = max(self.peak_rss_bytes, get_rss_bytes())
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    idx = max(0, math.ceil(q / 100 * len(values)) - 1)  # nearest rank
+    return round(values[idx], 4)
+
+
+def start_server(port: int):
+    import uvicorn
+    import src.main
+
+    config = uvicorn.Config(src.main.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, name="load-test-server", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 60
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("The app did not start in 60 seconds")
+        time.sleep(0.1)
+    return server, thread
+
+
+def request(url: str, timeout: float) -> dict:
+    started_at = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            status, body = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except Exception as e:
+        status, body = None, str(e).encode()
+    return {
+        "latency": time.perf_counter() - started_at,
+        "status": status,
+        "body": body.decode("utf-8", errors="replace")[:500],
+    }
+
+
+def run(args) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="qa-load-test-")
+    os.environ.setdefault("SLY_APP_DATA_DIR", f"{work_dir}/data")
+    os.makedirs(os.environ["SLY_APP_DATA_DIR"], exist_ok=True)
+
+    import src.cancellation as cancellation
+    import src.globals as g
+
+    api = FakeApi(f"{work_dir}/team_files", args.projects, args.images, args.classes, args.latency_ms / 1000)
+    g.api = api
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    threads_before = threading.active_count()
+    server, _ = start_server(port)
+
+    rng = random.Random(1)
+    hot_project = api.project_ids[0]
+    urls = []
+    for _ in range(args.requests):
+        if rng.random() < args.same_project:
+            project_id = hot_project
+        else:
+            project_id = rng.choice(api.project_ids)
+        urls.append(f"http://127.0.0.1:{port}/get-stats?project_id={project_id}")
+
+    started_at = time.perf_counter()
+    with ResourceSampler() as sampler:
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(executor.map(lambda url: request(url, args.timeout), urls))
+    elapsed = time.perf_counter() - started_at
+
+    # the heatmaps and the archives are calculated after the responses
+    from src.main import post_processor
+
+    post_failed = 0
+    for project_id in api.project_ids:
+        post_failed += len(post_processor.wait(project_id, timeout=args.timeout))
+    server.should_exit = True
+
+    latencies = [r["latency"] for r in results]
+    statuses = Counter(str(r["status"]) for r in results)
+    duplicated = sum(n - 1 for n in api.figure_downloads.values() if n > 1)
+    report = {
+        "config": vars(args),
+        "requests": len(results),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 3) if elapsed > 0 else None,
+        "latency_seconds": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": round(max(latencies), 4) if latencies else None,
+        },
+        "statuses": dict(statuses),
+        "contention": cancellation.get_report(),
+        "postprocessing_failed": post_failed,
+        "threads": {"before": threads_before, "peak": sampler.peak_threads, "after": threading.active_count()},
+        "peak_rss_bytes": sampler.peak_rss_bytes,
+        "duplicated_work": {
+            "images_downloaded": len(api.figure_downloads),
+            "duplicated_image_downloads": duplicated,
+        },
+        "api_calls": dict(api.calls),
+        "team_files_calls": dict(api.file.calls),
+    }
+    if not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--projects", type=int, default=4)
+    parser.add_argument("--images", type=int, default=2000, help="images per project")
+    parser.add_argument("--classes", type=int, default=5, help="classes per project")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument(
+        "--same-project", type=float, default=0.5, help="share of the requests to the same project"
+    )
+    parser.add_argument("--latency-ms", type=float, default=5, help="latency of every fake API call")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per request")
+    parser.add_argument("--output", help="save the JSON report to the file")
+    parser.add_argument("--keep", action="store_true", help="keep the temp dir with team files")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    sys.exit(0 if set(report["statuses"]) <= {"200"} else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,7 @@ from collections import defaultdict
 import src.globals as g
 import src.utils as u
 import supervisely as sly
-from supervisely import ProjectInfo, TeamInfo, WorkspaceInfo
-import dataset_tools as dtools
+from supervisely import DatasetInfo, ProjectInfo, TeamInfo, WorkspaceInfo
 from supervisely.io.fs import (
     get_file_name_with_ext,
     get_file_name,
@@ -18,10 +17,23 @@ from datetime import datetime, timezone
 import time
 import threading
 from pathlib import Path
-from fastapi import HTTPException
-from fastapi.responses import JSONResponse
+from typing import List, Optional, Set
+from fastapi import Body, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from supervisely.app.widgets import Container
 from src.ui.input import card_1
+from src.image_table import ImageTable
+from src.stats_cache import stats_cache, STAT_NAME_PATTERN
+from src.scheduler import PrewarmScheduler
+from src.change_tracker import ChangeTracker, EVENT_TYPES
+import src.cancellation as cancellation
+from src.cancellation import CancellationToken, RunCancelled, finish_run, start_run
+from src.checkpoint import Checkpointer
+from src.garbage_collector import garbage_collector
+from src.postprocessing import PostProcessor
+from src.resources import governor
+import src.preview as preview_mode
+import src.sharding as sharding
 
 
 layout = Container(widgets=[card_1], direction="vertical")
@@ -30,6 +42,31 @@ app = sly.Application(layout=layout, static_dir=static_dir)
 # app = sly.Application()
 server = app.get_server()
 
+_ready_at = None
+
+
+def _warm_up_heavy_imports():
+    import dataset_tools  # noqa: F401
+
+    sly.logger.debug(f"Heavy modules were imported in {time.perf_counter() - g.STARTED_AT:.2f}s")
+
+
+@server.on_event("startup")
+def startup_event():
+    global _ready_at
+    g.init_active_requests_dir()
+    governor.start()
+    _ready_at = time.perf_counter()
+    sly.logger.info(f"The app is ready to accept requests in {_ready_at - g.STARTED_AT:.2f}s")
+    threading.Thread(target=_warm_up_heavy_imports, daemon=True).start()
+
+
+@server.get("/ready")
+def ready_endpoint():
+    if _ready_at is None:
+        raise HTTPException(status_code=503, detail={"message": "The app is starting"})
+    return JSONResponse({"ready": True, "startup_seconds": round(_ready_at - g.STARTED_AT, 3)})
+
 
 TIMELOCK_LIMIT = 60  # seconds
 
@@ -50,18 +87,52 @@ def _get_extra(user_id, team, workspace, project) -> dict:
 
 
 @server.get("/get-stats")
-def stats_endpoint(project_id: int, user_id: int = None):
+def stats_endpoint(
+    project_id: int,
+    user_id: int = None,
+    preview: bool = False,
+    fraction: float = None,
+    profile: bool = False,
+    profile_upload: bool = False,
+):
 
     project = None
     team = None
     workspace = None
 
+    prewarm_scheduler.register(project_id)
+
     try:
         project = g.api.project.get_info_by_id(project_id, raise_error=True)
         team = g.api.team.get_info_by_id(project.team_id, raise_error=True)
         workspace = g.api.workspace.get_info_by_id(project.workspace_id, raise_error=True)
 
-        result = main_func(user_id, team, workspace, project)
+        tf_project_dir = f"{g.TF_STATS_DIR}/{project.id}_{project.name}"
+        if preview and not preview_mode.has_exact_stats(team.id, tf_project_dir, project.id):
+            g.initialize_log_levels(project.id)
+            fraction = min(max(fraction or g.PREVIEW_FRACTION, 0.001), 1.0)
+            result = JSONResponse(
+                preview_mode.start(user_id, team, workspace, project, fraction, main_func)
+            )
+        elif profile:
+            from src.profiling import RunProfiler
+
+            project_fs_dir = f"{g.STORAGE_DIR}/{project.id}_{project.name}"
+            profiler = RunProfiler(project_fs_dir)
+            try:
+                with profiler:
+                    result = main_func(user_id, team, workspace, project)
+            finally:
+                if profile_upload:
+                    profiler.upload(team.id, tf_project_dir)
+        else:
+            result = main_func(user_id, team, workspace, project)
+
+    except RunCancelled as e:
+        sly.logger.log(g._INFO, str(e), extra=_get_extra(user_id, team, workspace, project))
+        sly.fs.silent_remove(f"{g.ACTIVE_REQUESTS_DIR}/{project_id}")
+        g.api.file.remove(team.id, f"{g.TF_ACTIVE_REQUESTS_DIR}/{project_id}")
+        return JSONResponse({"message": str(e)})
 
     except Exception as e:
         msg = e.__class__.__name__ + ": " + str(e)
@@ -89,6 +160,116 @@ def stats_endpoint(project_id: int, user_id: int = None):
     return result
 
 
+def _refresh_project(
+    project_id: int, dirty_image_ids: Optional[Set[int]] = None, on_busy: str = "wait"
+):
+    """The background refresh: it never cancels the run in flight, the changed images wait
+    for it and the prewarm skips the project."""
+    project = g.api.project.get_info_by_id(project_id, raise_error=True)
+    team = g.api.team.get_info_by_id(project.team_id, raise_error=True)
+    workspace = g.api.workspace.get_info_by_id(project.workspace_id, raise_error=True)
+    try:
+        main_func(None, team, workspace, project, dirty_image_ids, on_busy)
+    except Exception:
+        sly.fs.silent_remove(f"{g.ACTIVE_REQUESTS_DIR}/{project_id}")
+        g.api.file.remove(team.id, f"{g.TF_ACTIVE_REQUESTS_DIR}/{project_id}")
+        raise
+
+
+prewarm_scheduler = PrewarmScheduler(
+    lambda project_id: _refresh_project(project_id, on_busy="skip"),
+    g.PREWARM_WORKERS,
+    g.PREWARM_INTERVAL,
+    g.PREWARM_CPU_BUDGET,
+)
+if g.PREWARM_ENABLED:
+    prewarm_scheduler.start()
+
+shard_worker = sharding.ShardWorker(lambda: sharding.get_backend(sly.env.team_id()))
+if g.SHARD_ROLE == "worker":
+    shard_worker.start()
+
+change_tracker = ChangeTracker(_refresh_project, g.NOTIFY_DEBOUNCE, g.NOTIFY_MAX_DELAY)
+
+
+@server.post("/notify-changes")
+def notify_changes_endpoint(payload: dict = Body(...)):
+    """Accepts change events: {"project_id": 1, "events": [{"type": "image", "image_id": 2}]}.
+    Figure events are resolved by their "image_id", meta events need no ids.
+    """
+    project_id = payload.get("project_id")
+    if not isinstance(project_id, int):
+        raise HTTPException(status_code=400, detail={"message": "The 'project_id' is required"})
+
+    image_ids, meta_changed = set(), False
+    for event in payload.get("events", []):
+        event_type = event.get("type")
+        if event_type not in EVENT_TYPES:
+            raise HTTPException(
+                status_code=400, detail={"message": f"Unknown event type: {event_type!r}"}
+            )
+        if event_type == "meta":
+            meta_changed = True
+            continue
+        image_id = event.get("image_id", event.get("id"))
+        if not isinstance(image_id, int):
+            raise HTTPException(
+                status_code=400, detail={"message": f"The {event_type!r} event has no 'image_id'"}
+            )
+        image_ids.add(image_id)
+
+    change_tracker.notify(project_id, image_ids, meta_changed)
+    return JSONResponse({"message": "Accepted", "pending": change_tracker.pending(project_id)})
+
+
+@server.get("/stats/{project_id}/{stat_name}")
+def stats_file_endpoint(project_id: int, stat_name: str, request: Request):
+    stat_name, ext = os.path.splitext(stat_name)
+    ext = ext or ".json"
+    if STAT_NAME_PATTERN.match(stat_name) is None or ext not in (".json", ".npz"):
+        raise HTTPException(status_code=400, detail={"message": f"Invalid stat name: {stat_name!r}"})
+
+    gzipped = ext == ".json" and "gzip" in request.headers.get("accept-encoding", "")
+    cached = stats_cache.get(project_id, f"{stat_name}{ext}", gzipped)
+    if cached is None:
+        raise HTTPException(
+            status_code=404,
+            detail={"message": f"The stat {stat_name!r} is not calculated for the project ID={project_id}"},
+        )
+    etag, body = cached
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    media_type = "application/json" if ext == ".json" else "application/octet-stream"
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+post_processor = PostProcessor(g.POSTPROCESS_WORKERS, g.POSTPROCESS_MAX_PENDING)
+
+
+@server.get("/postprocessing-status")
+def postprocessing_status_endpoint(project_id: int):
+    return JSONResponse({"project_id": project_id, "tasks": post_processor.get_status(project_id)})
+
+
+@server.get("/gc-stats")
+def gc_stats_endpoint():
+    return JSONResponse(garbage_collector.get_report())
+
+
+@server.get("/resource-stats")
+def resource_stats_endpoint():
+    return JSONResponse(governor.get_report())
+
+
+@server.get("/run-stats")
+def run_stats_endpoint():
+    return JSONResponse(cancellation.get_report())
+
+
 def _remove_old_active_project_request(now, team, file):
     if sly.is_development():
         g.api.file.remove(team.id, file.path)
@@ -114,6 +295,7 @@ def check_if_QA_tab_is_active(team: TeamInfo, project: ProjectInfo) -> str:
         if g.api.file.exists(team.id, file.path) is True:
             msg = f"Request for the project with ID={project.id} is busy. Wait until the previous one will be finished..."
             sly.logger.log(g._INFO, msg)
+            wait_started_at = time.perf_counter()
             while True:
                 if g.api.file.exists(team.id, active_project_path_tf):
                     now = datetime.now(timezone.utc)
@@ -121,6 +303,8 @@ def check_if_QA_tab_is_active(team: TeamInfo, project: ProjectInfo) -> str:
                     time.sleep(5)
                 else:
                     break
+            cancellation.record("lock_waits")
+            cancellation.record("lock_wait_seconds", time.perf_counter() - wait_started_at)
             return JSONResponse({"message": msg})
 
     # Path(active_project_path_local).touch()
@@ -135,28 +319,87 @@ def check_if_QA_tab_is_active(team: TeamInfo, project: ProjectInfo) -> str:
     return active_project_path_tf
 
 
-def main_func(user_id: int, team: TeamInfo, workspace: WorkspaceInfo, project: ProjectInfo):
+def main_func(
+    user_id: int,
+    team: TeamInfo,
+    workspace: WorkspaceInfo,
+    project: ProjectInfo,
+    dirty_image_ids: Optional[Set[int]] = None,
+    on_busy: str = "cancel",
+):
 
     g.initialize_log_levels(project.id)
 
-    active_project_path_tf = check_if_QA_tab_is_active(team, project)
+    tf_project_dir = f"{g.TF_STATS_DIR}/{project.id}_{project.name}"
+    project_fs_dir = f"{g.STORAGE_DIR}/{project.id}_{project.name}"
 
-    sly.logger.log(g._INFO, "Start Quality Assurance.")
+    project_meta = u.get_project_meta(project.id)
+    datasets = g.api.dataset.get_list(project.id)
+    project_stats = g.api.project.get_stats(project.id)
+    fingerprint = u.get_project_fingerprint(project, datasets, project_stats, project_meta)
+    has_post_tasks = any(
+        task["status"] in ("pending", "running") for task in post_processor.get_status(project.id)
+    )
+    if dirty_image_ids is None and not has_post_tasks:
+        if u.is_project_unchanged(
+            team.id, project, tf_project_dir, project_fs_dir, datasets, fingerprint
+        ):
+            sly.logger.log(g._INFO, "The project fingerprint is unchanged. Skipping stats calculation...")
+            return JSONResponse({"message": "Nothing to update. Skipping stats calculation..."})
+
+    # the repeated requests for the project (f.e. the polling QA tab) must not restart its run
+    fingerprint_hash = u.get_fingerprint_hash(fingerprint)
+    cancel_token = start_run(project.id, on_busy, fingerprint_hash)
+    if cancel_token is None:
+        sly.logger.log(g._INFO, "The stats of the project are being calculated. Skipping...")
+        return JSONResponse({"message": "The stats of the project are being calculated. Skipping..."})
+    try:
+        return _calculate_project_stats(
+            user_id,
+            team,
+            workspace,
+            project,
+            dirty_image_ids,
+            project_meta,
+            datasets,
+            project_stats,
+            fingerprint,
+            cancel_token,
+        )
+    finally:
+        finish_run(cancel_token)
+
+
+def _calculate_project_stats(
+    user_id: int,
+    team: TeamInfo,
+    workspace: WorkspaceInfo,
+    project: ProjectInfo,
+    dirty_image_ids: Optional[Set[int]],
+    project_meta: sly.ProjectMeta,
+    datasets: List[DatasetInfo],
+    project_stats: dict,
+    fingerprint: dict,
+    cancel_token: CancellationToken,
+):
+
+    import dataset_tools as dtools
 
     tf_project_dir = f"{g.TF_STATS_DIR}/{project.id}_{project.name}"
     project_fs_dir = f"{g.STORAGE_DIR}/{project.id}_{project.name}"
+    active_project_path_tf = check_if_QA_tab_is_active(team, project)
+
+    failed_tasks = post_processor.wait(project.id, timeout=g.POSTPROCESS_WAIT_TIMEOUT)
+    for task in failed_tasks:
+        sly.logger.log(
+            g._WARNING, f"The previous post-processing task {task.name!r} failed: {task.error}"
+        )
+
+    sly.logger.log(g._INFO, "Start Quality Assurance.")
 
     force_stats_recalc = False
     force_stats_recalc, _cache = u.pull_cache(team.id, project.id, tf_project_dir, project_fs_dir)
-
-    json_project_meta = g.api.project.get_meta(project.id)
-    try:
-        project_meta = sly.ProjectMeta.from_json(json_project_meta)
-    except Exception:
-        json_project_meta = u.handle_broken_project_meta(json_project_meta)
-        project_meta = sly.ProjectMeta.from_json(json_project_meta)
-    datasets = g.api.dataset.get_list(project.id)
-    project_stats = g.api.project.get_stats(project.id)
+    cached_chunks_datetime = g.CHUNKS_LATEST_DATETIME
 
     sly.logger.log(g._INFO, f"Processing for the '{project.name}' project")
     sly.logger.log(
@@ -169,20 +412,7 @@ def main_func(user_id: int, team: TeamInfo, workspace: WorkspaceInfo, project: P
         f"The project consists of {project.items_count} images and has {project.datasets_count} datasets",
     )
 
-    stats = [
-        dtools.ClassBalance(project_meta, project_stats),
-        dtools.ClassCooccurrence(project_meta),
-        dtools.ClassesPerImage(project_meta, project_stats, datasets),
-        dtools.ObjectsDistribution(project_meta),
-        dtools.ObjectSizes(project_meta, project_stats),
-        dtools.ClassSizes(project_meta),
-        dtools.ClassesTreemap(project_meta),
-        dtools.TagsImagesCooccurrence(project_meta),
-        dtools.TagsObjectsCooccurrence(project_meta),
-        dtools.ClassToTagCooccurrence(project_meta),
-        dtools.TagsImagesOneOfDistribution(project_meta),
-        dtools.TagsObjectsOneOfDistribution(project_meta),
-    ]
+    stats = u.create_stats(project_meta, project_stats, datasets)
 
     heatmaps = dtools.ClassesHeatmaps(project_meta, project_stats)
 
@@ -191,15 +421,6 @@ def main_func(user_id: int, team: TeamInfo, workspace: WorkspaceInfo, project: P
     os.makedirs(project_fs_dir, exist_ok=True)
 
     if g.api.file.dir_exists(team.id, tf_project_dir):
-        mandatory_class_stats = (
-            dtools.ClassBalance,
-            dtools.ClassCooccurrence,
-            dtools.ClassesPerImage,
-            dtools.ObjectsDistribution,
-            dtools.ObjectSizes,
-            dtools.ClassSizes,
-            dtools.ClassesTreemap,
-        )
         optional_tag_stats = (
             dtools.TagsImagesCooccurrence,
             dtools.TagsObjectsCooccurrence,
@@ -209,7 +430,7 @@ def main_func(user_id: int, team: TeamInfo, workspace: WorkspaceInfo, project: P
         )
         for stat in stats:
             path = f"{tf_project_dir}/{stat.basename_stem}.json"
-            if isinstance(stat, mandatory_class_stats):
+            if type(stat).__name__ in u.MANDATORY_STATS:
                 if not g.api.file.exists(team.id, path):
                     force_stats_recalc = True
                     sly.logger.log(
@@ -218,7 +439,11 @@ def main_func(user_id: int, team: TeamInfo, workspace: WorkspaceInfo, project: P
                     )
             if isinstance(stat, optional_tag_stats):
                 if g.api.file.exists(team.id, path) and u.applicability_test(stat) is False:
-                    g.api.file.remove_file(team.id, path)
+                    tf_npz_path = f"{tf_project_dir}/{stat.basename_stem}.npz"
+                    stale_paths = [path]
+                    if g.api.file.exists(team.id, tf_npz_path):
+                        stale_paths.append(tf_npz_path)
+                    garbage_collector.collect_remote(team.id, stale_paths)
                     sly.logger.log(
                         g._INFO,
                         f"The applicability of tag stat {stat.basename_stem!r} has been changed. Deleting the old stat from team files.",
@@ -231,17 +456,37 @@ def main_func(user_id: int, team: TeamInfo, workspace: WorkspaceInfo, project: P
                 f"The calcuated stat {heatmaps.basename_stem!r} not exists. Forcing full stats recalculation...",
             )
 
-    images_all_dct = u.get_project_images_all(datasets)
-    updated_images, updated_classes, _cache, is_meta_changed = u.get_updated_images_and_classes(
-        project, project_meta, datasets, images_all_dct, force_stats_recalc, _cache
+    stats = u.get_applicable_stats(stats)
+
+    images_all_dct = None
+    if dirty_image_ids is not None and not force_stats_recalc:
+        images_all_dct = u.get_dirty_images_all(datasets, dirty_image_ids, _cache)
+    is_partial = images_all_dct is not None
+    if not is_partial:
+        images_all_dct = u.get_project_images_all(datasets)
+    updated_images, updated_classes, _cache, meta_diff = u.get_updated_images_and_classes(
+        project, project_meta, datasets, images_all_dct, force_stats_recalc, _cache, is_partial
     )
+    is_meta_changed = bool(meta_diff)
     total_updated = sum(len(lst) for lst in updated_images.values())
     if total_updated == 0 and not is_meta_changed:
         sly.logger.log(g._INFO, "Nothing to update. Skipping stats calculation...")
         if isinstance(active_project_path_tf, str):
             g.api.file.remove(team.id, active_project_path_tf)
         u.add_heatmaps_status_ok(team, tf_project_dir, project_fs_dir)
-        return JSONResponse({"message": "Nothing to update. Skipping stats calculation..."})
+        u.push_project_fingerprint(
+            team.id, project.id, tf_project_dir, project_fs_dir, fingerprint, _cache.get("images")
+        )
+        if _cache.get("last_run", {}).get("metadata_only_skipped", 0) > 0:
+            u.push_cache(
+                team.id, project.id, tf_project_dir, project_fs_dir, _cache, cached_chunks_datetime
+            )
+        return JSONResponse(
+            {
+                "message": "Nothing to update. Skipping stats calculation...",
+                **_cache.get("last_run", {}),
+            }
+        )
 
     if getattr(project, "items_count", None) is None:
         force_stats_recalc = True
@@ -260,7 +505,8 @@ def main_func(user_id: int, team: TeamInfo, workspace: WorkspaceInfo, project: P
         tf_status_path = f"{tf_project_dir}/_cache/heatmaps/status_ok"
         g.api.file.remove(team.id, tf_status_path)
 
-    idx_to_infos, infos_to_idx = u.get_indexes_dct(project.id, datasets, images_all_dct)
+    listed_datasets = [d for d in datasets if d.id in images_all_dct]
+    idx_to_infos, infos_to_idx = u.get_indexes_dct(project.id, listed_datasets, images_all_dct)
     updated_images = u.check_idxs_integrity(
         project,
         datasets,
@@ -270,50 +516,126 @@ def main_func(user_id: int, team: TeamInfo, workspace: WorkspaceInfo, project: P
         updated_images,
         images_all_dct,
         force_stats_recalc,
+        is_partial,
     )
+    if is_partial and updated_images is images_all_dct:
+        sly.logger.log(g._WARNING, "The partial recalculation is not possible. Listing all images...")
+        images_all_dct = u.get_project_images_all(datasets)
+        _cache["images"] = ImageTable.concat(images_all_dct.values())
+        idx_to_infos, infos_to_idx = u.get_indexes_dct(project.id, datasets, images_all_dct)
+        updated_images = images_all_dct
+
+    if is_meta_changed and not force_stats_recalc:
+        u.remap_chunks_by_meta_diff(stats, project_fs_dir, meta_diff)
 
     tf_all_paths = [info.path for info in g.api.file.list2(team.id, tf_project_dir, recursive=True)]
 
-    heatmaps_image_ids, heatmaps_figure_ids = u.calculate_stats_and_save_chunks(
-        updated_images,
-        stats,
-        tf_all_paths,
+    checkpointer = Checkpointer(
+        team.id,
+        tf_project_dir,
         project_fs_dir,
-        idx_to_infos,
-        infos_to_idx,
-        project_stats,
-        project,
+        {
+            "chunk_size": g.CHUNK_SIZE,
+            "meta": u.get_meta_hash(project_meta),
+            "dataset-tools": getattr(dtools, "__version__", None),
+        },
+        g.CHECKPOINT_INTERVAL,
     )
-    sly.logger.log(g._INFO, "Stats calculation finished.")
-    u.remove_junk(team.id, tf_project_dir, project, datasets, project_fs_dir)
-    u.sew_chunks_to_json(stats, project_fs_dir, updated_classes, is_meta_changed)
+    checkpointer.restore()
 
-    sly.logger.log(g._INFO, "Start threading of 'calculate_and_save_heatmaps'")
-    thread1 = threading.Thread(
-        target=u.calculate_and_upload_heatmaps,
-        args=(
+    updated_chunks_count = sum(
+        len(u.get_chunks_of_images(project.id, ds_id, infos_to_idx[ds_id], images.ids))
+        for ds_id, images in updated_images.items()
+        if len(images) > 0
+    )
+    if g.SHARD_ROLE == "coordinator" and updated_chunks_count >= g.SHARD_MIN_CHUNKS:
+        sly.logger.log(g._INFO, f"{updated_chunks_count} chunks will be calculated by the shard workers")
+        heatmaps_image_ids, heatmaps_figure_ids, updated_stems = sharding.calculate_sharded(
+            sharding.get_backend(team.id),
             team,
-            tf_project_dir,
+            project,
+            project_meta,
+            updated_images,
+            idx_to_infos,
+            infos_to_idx,
+            project_fs_dir,
+            checkpointer,
+            cancel_token,
+        )
+    else:
+        heatmaps_image_ids, heatmaps_figure_ids, updated_stems = u.calculate_stats_and_save_chunks(
+            updated_images,
+            stats,
+            tf_all_paths,
             project_fs_dir,
-            heatmaps,
-            heatmaps_image_ids,
-            heatmaps_figure_ids,
-        ),
+            idx_to_infos,
+            infos_to_idx,
+            project_stats,
+            project,
+            checkpointer,
+            cancel_token,
+        )
+    sly.logger.log(g._INFO, "Stats calculation finished.")
+    cancel_token.raise_if_cancelled()
+    # the global is shared by the runs of all projects, the archive task runs later
+    chunks_datetime = g.CHUNKS_LATEST_DATETIME
+    u.remove_junk(team.id, tf_project_dir, project, datasets, project_fs_dir)
+    if is_meta_changed or force_stats_recalc:
+        stats_to_sew = stats
+    else:
+        stats_to_sew = [
+            stat
+            for stat in stats
+            if stat.basename_stem in updated_stems
+            or f"{tf_project_dir}/{stat.basename_stem}.json" not in tf_all_paths
+        ]
+    with governor.heavy_task("sew_chunks_to_json"):
+        u.sew_chunks_to_json(stats_to_sew, project_fs_dir, updated_classes, is_meta_changed)
+
+    sly.logger.log(g._INFO, "Submit 'calculate_and_upload_heatmaps' to post-processing")
+    post_processor.submit(
+        project.id,
+        "calculate_and_upload_heatmaps",
+        u.calculate_and_upload_heatmaps,
+        team,
+        tf_project_dir,
+        project_fs_dir,
+        heatmaps,
+        heatmaps_image_ids,
+        heatmaps_figure_ids,
     )
-    thread1.start()
 
-    sly.logger.log(g._INFO, "Start threading of 'archive_chunks_and_upload'")
-    thread2 = threading.Thread(
-        target=u.archive_chunks_and_upload,
-        args=(team, project, stats, tf_project_dir, project_fs_dir, datasets),
+    sly.logger.log(g._INFO, "Submit 'archive_chunks_and_upload' to post-processing")
+    post_processor.submit(
+        project.id,
+        "archive_chunks_and_upload",
+        u.archive_chunks_and_upload,
+        team,
+        project,
+        stats,
+        tf_project_dir,
+        project_fs_dir,
+        datasets,
+        chunks_datetime,
     )
-    thread2.start()
 
     u.upload_sewed_stats(team.id, project_fs_dir, tf_project_dir)
-    u.push_cache(team.id, project.id, tf_project_dir, project_fs_dir, _cache)
+    _cache["annotations"] = {
+        **_cache.get("annotations", {}),
+        **u.collect_annotation_fingerprints(project_fs_dir, idx_to_infos.keys()),
+    }
+    u.push_cache(team.id, project.id, tf_project_dir, project_fs_dir, _cache, chunks_datetime)
+    u.push_project_fingerprint(
+        team.id, project.id, tf_project_dir, project_fs_dir, fingerprint, _cache.get("images")
+    )
+    stats_cache.invalidate(project.id)
+    checkpointer.clear()
     # sly.fs.silent_remove(active_project_path)
     if isinstance(active_project_path_tf, str):
         g.api.file.remove(team.id, active_project_path_tf)
     return JSONResponse(
-        {"message": f"The statistics were updated: {total_updated} images were calculated"}
+        {
+            "message": f"The statistics were updated: {total_updated} images were calculated",
+            **_cache.get("last_run", {}),
+        }
     )
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import supervisely as sly
+from src.resources import governor
+
+
+class PostTask:
+    def __init__(self, project_id: int, name: str, func: Callable, args: tuple):
+        self.project_id = project_id
+        self.name = name
+        self.func = func
+        self.args = args
+        self.status = "pending"
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class PostProcessor:
+    """Bounded executor for the background work of a run (heatmaps, chunks archive).
+
+    Tasks of one project run one after another in the submission order, tasks of
+    different projects run in parallel. `submit` blocks when `max_pending` tasks are
+    queued, and the next run of a project waits for its previous tasks with `wait`,
+    which reports every failed task once.
+    The tasks are memory-heavy, so they also take a slot of the resource governor.
+    """
+
+    HISTORY_SIZE = 10
+
+    def __init__(self, workers: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="postprocessing")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queues = defaultdict(deque)
+        self._running = set()
+        self._history = defaultdict(lambda: deque(maxlen=self.HISTORY_SIZE))
+        self._unwaited = defaultdict(list)  # the tasks submitted after the last `wait`
+        self._lock = threading.Lock()
+
+    def submit(self, project_id: int, name: str, func: Callable, *args) -> PostTask:
+        if not self._slots.acquire(blocking=False):
+            sly.logger.info(f"The post-processing queue is full. Waiting to submit {name!r}...")
+            self._slots.acquire()
+
+        task = PostTask(project_id, name, func, args)
+        with self._lock:
+            self._queues[project_id].append(task)
+            self._history[project_id].append(task)
+            self._unwaited[project_id].append(task)
+            if project_id not in self._running:
+                self._dispatch(project_id)
+        return task
+
+    def wait(self, project_id: int, timeout: Optional[float] = None) -> List[PostTask]:
+        """Waits for all submitted tasks of the project. Returns the ones failed since
+        the previous `wait` of the project: the earlier failures were already returned."""
+        with self._lock:
+            tasks = list(self._unwaited.get(project_id, []))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for task in tasks:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not task.done.wait(remaining):
+                raise TimeoutError(
+                    f"The post-processing task {task.name!r} of the project ID={project_id} is not finished"
+                )
+        with self._lock:
+            unwaited = self._unwaited.pop(project_id, [])
+            if len(unwaited) > len(tasks):  # submitted while waiting
+                self._unwaited[project_id] = unwaited[len(tasks) :]
+        return [task for task in tasks if task.status == "failed"]
+
+    def get_status(self, project_id: int) -> List[dict]:
+        with self._lock:
+            return [task.to_json() for task in self._history[project_id]]
+
+    def _dispatch(self, project_id: int):
+        task = self._queues[project_id].popleft()
+        self._running.add(project_id)
+        self._executor.submit(self._run, task)
+
+    def _run(self, task: PostTask):
+        task.status = "running"
+        try:
+            with governor.heavy_task(task.name):
+                task.func(*task.args)
+            task.status = "done"
+        except Exception as e:
+            task.status = "failed"
+            task.error = f"{e.__class__.__name__}: {e}"
+            sly.logger.error(
+                f"The post-processing task {task.name!r} failed: {task.error}",
+                extra={"PROJECT_ID": task.project_id},
+            )
+        finally:
+            task.finished_at = time.time()
+            task.done.set()
+            self._slots.release()
+            with self._lock:
+                if len(self._queues[task.project_id]) > 0:
+                    self._dispatch(task.project_id)
+                else:
+                    self._running.discard(task.project_id)
+                    del self._queues[task.project_id]
@@ -0,0 +1,196 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import numpy as np
+import ujson
+import supervisely as sly
+from supervisely import DatasetInfo, ProjectInfo, TeamInfo, WorkspaceInfo
+
+import src.globals as g
+import src.utils as u
+from src.image_table import ImageTable, infos_by_ids
+
+
+_executor = ThreadPoolExecutor(g.PREVIEW_WORKERS, thread_name_prefix="preview")
+_in_progress = set()
+_lock = threading.Lock()
+
+
+def has_exact_stats(team_id: int, tf_project_dir: str, project_id: int) -> bool:
+    return g.api.file.exists(team_id, f"{tf_project_dir}/_cache/{project_id}_cache.json")
+
+
+@contextmanager
+def _active_request(team_id: int, project_id: int, preview_fs_dir: str):
+    """Holds the active request of the project (the lock of `check_if_QA_tab_is_active`)
+    without waiting for it. Yields False if an exact run holds it.
+    """
+    active_project_path_tf = f"{g.TF_ACTIVE_REQUESTS_DIR}/{project_id}"
+    if g.api.file.exists(team_id, active_project_path_tf):
+        yield False
+        return
+    local_path = f"{preview_fs_dir}/_active_request"
+    with open(local_path, "w"):
+        pass
+    g.api.file.upload(team_id, local_path, active_project_path_tf)
+    try:
+        yield True
+    finally:
+        g.api.file.remove(team_id, active_project_path_tf)
+
+
+def sample_images(
+    project_id: int,
+    datasets: List[DatasetInfo],
+    images_all_dct: Dict[int, ImageTable],
+    fraction: float,
+    seed: int = 42,
+) -> Dict[int, ImageTable]:
+    """Stratified sample: the same fraction of images (at least one) from every chunk of
+    every dataset, so the sample follows the per-dataset chunk structure of the full run.
+    """
+    rng = np.random.default_rng(seed)
+    chunk_to_images, _ = u.get_indexes_dct(project_id, datasets, images_all_dct)
+    sampled = {d.id: [] for d in datasets}
+    for chunk, table in chunk_to_images.items():
+        size = min(len(table), max(1, math.ceil(len(table) * fraction)))
+        idxs = np.sort(rng.choice(len(table), size=size, replace=False))
+        dataset_id = int(chunk.split("_")[2])
+        sampled[dataset_id].append(table[idxs])
+    return {ds_id: ImageTable.concat(tables) for ds_id, tables in sampled.items()}
+
+
+def get_confidence(sampled: int, total: int) -> dict:
+    """95% margin of error of a proportion estimated on the sample (worst case p=0.5),
+    with the finite population correction. The counts of the preview stats are the counts
+    of the sampled images, `count_scale` estimates the counts of the whole project."""
+    if sampled == 0 or total == 0:
+        return {"margin_of_error_95": None, "count_scale": None}
+    fpc = math.sqrt((total - sampled) / (total - 1)) if total > 1 else 0
+    return {
+        "margin_of_error_95": round(0.98 / math.sqrt(sampled) * fpc, 4),
+        "count_scale": total / sampled,
+    }
+
+
+@sly.timeit
+def calculate_preview(team: TeamInfo, project: ProjectInfo, fraction: float) -> int:
+    """Calculates all stats on a sample of images and uploads them marked as approximate.
+    Returns the number of sampled images."""
+    tf_project_dir = f"{g.TF_STATS_DIR}/{project.id}_{project.name}"
+    preview_fs_dir = f"{g.STORAGE_DIR}/{project.id}_{project.name}_preview"
+    sly.fs.mkdir(preview_fs_dir, remove_content_if_exists=True)
+
+    project_meta = u.get_project_meta(project.id)
+    datasets = g.api.dataset.get_list(project.id)
+    project_stats = g.api.project.get_stats(project.id)
+    stats = u.create_stats(project_meta, project_stats, datasets)
+
+    images_all_dct = u.get_project_images_all(datasets)
+    sampled_dct = sample_images(project.id, datasets, images_all_dct, fraction)
+    total = sum(len(t) for t in images_all_dct.values())
+    sampled = sum(len(t) for t in sampled_dct.values())
+    sly.logger.log(
+        g._INFO, f"Calculating preview stats on {sampled} of {total} images ({fraction:.1%})"
+    )
+
+    for dataset_id, table in sampled_dct.items():
+        for group in table.batched(g.CHUNK_SIZE):
+            infos = infos_by_ids(g.api, dataset_id, group.ids.tolist())
+            for start in range(0, len(infos), 100):
+                batch_infos = infos[start : start + 100]
+                batch_ids = [image.id for image in batch_infos]
+                figures = g.api.image.figure.download(dataset_id, batch_ids, skip_geometry=True)
+                for image in batch_infos:
+                    for stat in stats:
+                        stat.update2(image, figures.get(image.id, []))
+
+    approximate = {
+        "fraction": fraction,
+        "sampled_images": sampled,
+        "total_images": total,
+        "counts": "sampled",
+        **get_confidence(sampled, total),
+    }
+    src_paths, dst_paths = [], []
+    for stat in stats:
+        if hasattr(stat, "_tag_ids") and u.applicability_test(stat) is False:
+            continue
+        res = stat.to_json2()
+        if not isinstance(res, dict):
+            continue
+        res["approximate"] = approximate
+        path = f"{preview_fs_dir}/{stat.basename_stem}.json"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(ujson.dumps(res))
+        src_paths.append(path)
+        dst_paths.append(f"{tf_project_dir}/{os.path.basename(path)}")
+
+    # re-checked under the lock: an exact run could finish while the sample was calculated
+    with _active_request(team.id, project.id, preview_fs_dir) as acquired:
+        if not acquired:
+            sly.logger.log(g._INFO, "The exact stats are being calculated. Skipping the preview upload.")
+        elif has_exact_stats(team.id, tf_project_dir, project.id):
+            sly.logger.log(g._INFO, "The exact stats are already calculated. Skipping the preview upload.")
+        else:
+            g.api.file.upload_bulk(team.id, src_paths, dst_paths)
+    sly.fs.remove_dir(preview_fs_dir)
+    return sampled
+
+
+def _refine(
+    user_id: int,
+    team: TeamInfo,
+    workspace: WorkspaceInfo,
+    project: ProjectInfo,
+    fraction: float,
+    exact_func: Callable,
+):
+    try:
+        tf_project_dir = f"{g.TF_STATS_DIR}/{project.id}_{project.name}"
+        for _ in range(g.PREVIEW_REFINEMENT_STEPS):
+            fraction *= 4
+            if fraction >= 1 or has_exact_stats(team.id, tf_project_dir, project.id):
+                break
+            calculate_preview(team, project, fraction)
+        exact_func(user_id, team, workspace, project, on_busy="wait")  # never cancels a user run
+    except Exception as e:
+        sly.logger.warning(
+            f"Refinement of the preview stats failed: {e.__class__.__name__}: {e}",
+            extra={"PROJECT_ID": project.id},
+        )
+    finally:
+        with _lock:
+            _in_progress.discard(project.id)
+
+
+def start(
+    user_id: int,
+    team: TeamInfo,
+    workspace: WorkspaceInfo,
+    project: ProjectInfo,
+    fraction: float,
+    exact_func: Callable,
+) -> dict:
+    """Calculates the preview synchronously and refines it in background up to the exact stats."""
+    with _lock:
+        if project.id in _in_progress:
+            return {"message": "The preview stats are being refined", "approximate": True}
+        _in_progress.add(project.id)
+
+    try:
+        sampled = calculate_preview(team, project, fraction)
+    except Exception:
+        with _lock:
+            _in_progress.discard(project.id)
+        raise
+    _executor.submit(_refine, user_id, team, workspace, project, fraction, exact_func)
+    return {
+        "message": f"The approximate statistics were calculated on {sampled} sampled images",
+        "approximate": True,
+        "fraction": fraction,
+    }
@@ -0,0 +1,134 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+
+import supervisely as sly
+import src.globals as g
+
+
+class RunProfiler:
+    """Profiles one run of the calling thread: `cProfile` for the deterministic call
+    stats, a stack sampler for the flame graph and `tracemalloc` for the allocations.
+
+    Artifacts are saved to `{project_fs_dir}/_profile/{timestamp}/`:
+    `run.pstats` (open with `pstats` or snakeviz), `stacks.collapsed` (flamegraph.pl,
+    speedscope), `allocations.txt` and `summary.json`.
+    """
+
+    SAMPLE_INTERVAL = 0.005  # seconds
+    TOP_ALLOCATIONS = 30
+
+    def __init__(self, project_fs_dir: str):
+        self.output_dir = f"{project_fs_dir}/_profile/{time.strftime('%Y%m%d-%H%M%S')}"
+        self._thread_id = None
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._profiler = None
+        self._started_at = None
+        self.paths = []
+
+    def __enter__(self):
+        import cProfile
+        import tracemalloc
+
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+        tracemalloc.start(10)
+        self._profiler = cProfile.Profile()
+        self._started_at = time.perf_counter()
+        self._sampler.start()
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        import tracemalloc
+
+        self._profiler.disable()
+        elapsed = time.perf_counter() - self._started_at
+        self._stop.set()
+        self._sampler.join()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        try:
+            self._save(snapshot, elapsed, current, peak, exc_type)
+        except Exception as e:
+            sly.logger.warning(f"Failed to save the profile: {e.__class__.__name__}: {e}")
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if len(stack) > 0:
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def _save(self, snapshot, elapsed: float, current: int, peak: int, exc_type):
+        import pstats
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        pstats_path = f"{self.output_dir}/run.pstats"
+        self._profiler.dump_stats(pstats_path)
+
+        stacks_path = f"{self.output_dir}/stacks.collapsed"
+        with open(stacks_path, "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        top_allocations = snapshot.statistics("lineno")[: self.TOP_ALLOCATIONS]
+        allocations_path = f"{self.output_dir}/allocations.txt"
+        with open(allocations_path, "w", encoding="utf-8") as f:
+            for stat in top_allocations:
+                f.write(f"{stat}\n")
+
+        functions = pstats.Stats(self._profiler).sort_stats("cumulative")
+        top_functions = []
+        for func in functions.fcn_list[:30]:
+            cc, nc, tt, ct, _ = functions.stats[func]
+            top_functions.append(
+                {"function": pstats.func_std_string(func), "calls": nc, "tottime": tt, "cumtime": ct}
+            )
+        summary_path = f"{self.output_dir}/summary.json"
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "elapsed_seconds": round(elapsed, 3),
+                    "failed": exc_type is not None,
+                    "samples": sum(self._stacks.values()),
+                    "traced_memory_current_bytes": current,
+                    "traced_memory_peak_bytes": peak,
+                    "top_functions": top_functions,
+                    "top_allocations": [str(stat) for stat in top_allocations],
+                },
+                f,
+                indent=2,
+            )
+
+        self.paths = [pstats_path, stacks_path, allocations_path, summary_path]
+        sly.logger.info(
+            f"The run profile was saved to {self.output_dir!r}: {elapsed:.2f}s, "
+            f"peak traced memory {peak / 1024 / 1024:.1f} MB"
+        )
+
+    def upload(self, team_id: int, tf_project_dir: str) -> Optional[List[str]]:
+        if len(self.paths) == 0:
+            return None
+        tf_dir = f"{tf_project_dir}/_profile/{os.path.basename(self.output_dir)}"
+        dst_paths = [f"{tf_dir}/{os.path.basename(path)}" for path in self.paths]
+        try:
+            g.api.file.upload_bulk(team_id, self.paths, dst_paths)
+        except Exception as e:
+            sly.logger.warning(f"Failed to upload the profile: {e.__class__.__name__}: {e}")
+            return None
+        sly.logger.info(f"The run profile was uploaded to team files: {tf_dir!r}")
+        return dst_paths
@@ -0,0 +1,218 @@
+import gc
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Optional
+
+import supervisely as sly
+import src.globals as g
+
+
+def _read_first_line(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def read_memory_limit() -> Optional[int]:
+    """The memory limit of the container (cgroup v2 or v1), the total RAM if there is none."""
+    value = _read_first_line("/sys/fs/cgroup/memory.max")  # v2
+    if value is None:
+        value = _read_first_line("/sys/fs/cgroup/memory/memory.limit_in_bytes")  # v1
+    total = None
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        pass
+    if value is None or value == "max" or not value.isdigit():
+        return total
+    limit = int(value)
+    # v1 reports a huge number (PAGE_COUNTER_MAX) when the limit is not set
+    if total is not None and limit >= total:
+        return total
+    return limit
+
+
+def read_cpu_limit() -> float:
+    """The number of CPUs available to the container (cgroup quota / period)."""
+    cpus = float(len(os.sched_getaffinity(0))) if hasattr(os, "sched_getaffinity") else None
+    cpus = cpus or float(os.cpu_count() or 1)
+    value = _read_first_line("/sys/fs/cgroup/cpu.max")  # v2: "<quota|max> <period>"
+    if value is not None:
+        parts = value.split()
+        if len(parts) == 2 and parts[0] != "max":
+            return min(cpus, int(parts[0]) / int(parts[1]))
+        return cpus
+    quota = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")  # v1
+    period = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota is not None and period is not None and quota.lstrip("-").isdigit() and period.isdigit():
+        if int(quota) > 0 and int(period) > 0:
+            return min(cpus, int(quota) / int(period))
+    return cpus
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.readline().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ResourceGovernor:
+    """Adapts the memory-heavy parts of a run to the memory budget of the container.
+
+    The budget is `MEMORY_BUDGET_SHARE` of the cgroup memory limit. The RSS of the process
+    is sampled on a background thread and on every query. Above `MEMORY_HIGH_SHARE` of the
+    budget the figure batches are halved and the heavy tasks (sewing, heatmaps, archive)
+    run one at a time; above `MEMORY_CRITICAL_SHARE` the batches are smaller still,
+    garbage is collected before the heavy tasks and large stats are streamed to disk.
+
+    Every throttling decision is logged once per change and counted in `get_report`.
+    """
+
+    HISTORY_SIZE = 50
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.memory_limit = read_memory_limit()
+        self.cpu_limit = read_cpu_limit()
+        budget = g.MEMORY_BUDGET_BYTES or self.memory_limit
+        self.memory_budget = int(budget * g.MEMORY_BUDGET_SHARE) if budget else None
+        self.rss = 0
+        self.peak_rss = 0
+        self.level = "ok"
+        self._decisions = Counter()
+        self._history = deque(maxlen=self.HISTORY_SIZE)
+        self._last_decisions = {}
+        self._heavy_running = 0
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="resource-governor", daemon=True)
+        self._thread.start()
+        sly.logger.info(
+            f"Resource governor: memory limit {_mb(self.memory_limit)}, "
+            f"budget {_mb(self.memory_budget)}, {self.cpu_limit:.2f} CPUs"
+        )
+
+    def sample(self) -> str:
+        """Updates the RSS and returns the memory pressure level."""
+        rss = get_rss_bytes()
+        level = self._get_level(rss)
+        with self._lock:
+            self.rss = rss
+            self.peak_rss = max(self.peak_rss, rss)
+            previous, self.level = self.level, level
+        if level != previous:
+            self._decide("level", level, f"memory pressure {previous} -> {level} (RSS {_mb(rss)})")
+            with self._cond:
+                self._cond.notify_all()
+        return level
+
+    def batch_size(self, default: int, name: str = "figures") -> int:
+        level = self.sample()
+        size = default
+        if level == "high":
+            size = max(default // 2, 1)
+        elif level == "critical":
+            size = max(default // 5, 1)
+        self._decide(f"{name}_batch_size", size, f"{name} batch size {size} (default {default})")
+        return size
+
+    def max_heavy_tasks(self) -> int:
+        if self.sample() == "ok":
+            return max(int(self.cpu_limit), 1)
+        return 1
+
+    def should_spill(self) -> bool:
+        """Whether the large results should be streamed to disk instead of built in memory."""
+        return self.sample() == "critical"
+
+    @contextmanager
+    def heavy_task(self, name: str):
+        """Limits the memory-heavy tasks running at once. Under pressure they run one by one,
+        a task waits at most `GOVERNOR_MAX_WAIT` seconds and then runs anyway.
+        """
+        deadline = time.monotonic() + g.GOVERNOR_MAX_WAIT
+        with self._cond:
+            allowed = self.max_heavy_tasks()
+            if self._heavy_running >= allowed:
+                self._decide("heavy_tasks_waits", None, f"{name!r} waits for {self._heavy_running} heavy tasks")
+            while self._heavy_running >= allowed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    sly.logger.warning(f"{name!r} waited too long for memory. Running anyway...")
+                    break
+                self._cond.wait(min(remaining, self.interval))
+                allowed = self.max_heavy_tasks()
+            self._heavy_running += 1
+        if self.level == "critical":
+            gc.collect()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._heavy_running -= 1
+                self._cond.notify_all()
+
+    def get_report(self) -> dict:
+        self.sample()
+        with self._lock:
+            return {
+                "memory_limit_bytes": self.memory_limit,
+                "memory_budget_bytes": self.memory_budget,
+                "cpu_limit": self.cpu_limit,
+                "rss_bytes": self.rss,
+                "peak_rss_bytes": self.peak_rss,
+                "level": self.level,
+                "heavy_tasks_running": self._heavy_running,
+                "decisions": dict(self._decisions),
+                "history": list(self._history),
+            }
+
+    def _get_level(self, rss: int) -> str:
+        if not self.memory_budget:
+            return "ok"
+        share = rss / self.memory_budget
+        if share >= g.MEMORY_CRITICAL_SHARE:
+            return "critical"
+        if share >= g.MEMORY_HIGH_SHARE:
+            return "high"
+        return "ok"
+
+    def _decide(self, key: str, value, message: str):
+        with self._lock:
+            if value is not None and self._last_decisions.get(key) == value:
+                return
+            self._last_decisions[key] = value
+            self._decisions[key] += 1
+            self._history.append({"time": time.time(), "decision": key, "message": message})
+        sly.logger.info(f"Resource governor: {message}")
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                sly.logger.warning(f"Failed to sample the memory: {e.__class__.__name__}: {e}")
+
+
+def _mb(value: Optional[int]) -> str:
+    return "unknown" if value is None else f"{value / 1024 / 1024:.0f} MB"
+
+
+governor = ResourceGovernor(g.GOVERNOR_INTERVAL)
@@ -0,0 +1,163 @@
+import heapq
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+import supervisely as sly
+import src.globals as g
+import src.utils as u
+from src.stats_cache import get_local_images_dt
+
+
+class PrewarmScheduler:
+    """Refreshes stale, frequently viewed projects in the background so that
+    `/get-stats` finds the stats already calculated.
+
+    Every registered project is scored by `stale_images * (1 + views)`, where
+    `stale_images` is the number of images in the datasets with images updated after
+    the latest cached image.
+    Idle workers pop the projects with the highest score while the CPU budget allows.
+    """
+
+    def __init__(
+        self,
+        refresh_func: Callable[[int], None],
+        workers: int,
+        interval: int,
+        cpu_budget: float,
+    ):
+        self.refresh_func = refresh_func
+        self.workers = workers
+        self.interval = interval
+        self.cpu_budget = cpu_budget
+        self._views = defaultdict(float)
+        self._queue = []
+        self._in_progress = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._refilled_at = 0
+
+    def register(self, project_id: int):
+        with self._lock:
+            self._views[project_id] += 1
+
+    def start(self):
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"prewarm-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        sly.logger.info(f"The prewarm scheduler was started with {self.workers} worker(s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(1):
+            if not self._is_within_cpu_budget():
+                continue
+            project_id = self._pop()
+            if project_id is None:
+                continue
+            try:
+                sly.logger.info(f"Prewarming stats for the project ID={project_id}")
+                self.refresh_func(project_id)
+            except Exception as e:
+                sly.logger.warning(
+                    f"Prewarming of the project ID={project_id} failed: {e.__class__.__name__}: {e}"
+                )
+            finally:
+                with self._lock:
+                    self._in_progress.discard(project_id)
+
+    def _pop(self) -> Optional[int]:
+        with self._lock:
+            if len(self._queue) == 0 and time.monotonic() - self._refilled_at > self.interval:
+                self._refilled_at = time.monotonic()
+                project_ids = list(self._views.keys())
+                for project_id in project_ids:
+                    self._views[project_id] /= 2  # decay the old views
+            else:
+                project_ids = None
+
+        if project_ids is not None:
+            self._refill(project_ids)
+
+        with self._lock:
+            while len(self._queue) > 0:
+                _, project_id = heapq.heappop(self._queue)
+                if project_id in self._in_progress or _is_request_active(project_id):
+                    continue
+                self._in_progress.add(project_id)
+                return project_id
+        return None
+
+    def _refill(self, project_ids):
+        scored = []
+        for project_id in project_ids:
+            try:
+                stale = count_stale_images(project_id)
+            except Exception as e:
+                sly.logger.debug(f"Failed to score the project ID={project_id}: {e}")
+                continue
+            if stale == 0:
+                continue
+            scored.append((-stale * (1 + self._views[project_id]), project_id))
+
+        with self._lock:
+            for item in scored:
+                heapq.heappush(self._queue, item)
+        if len(scored) > 0:
+            sly.logger.debug(f"The prewarm queue was refilled with {len(scored)} stale project(s)")
+
+    def _is_within_cpu_budget(self) -> bool:
+        try:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except OSError:
+            return True
+        return load < self.cpu_budget
+
+
+def _is_request_active(project_id: int) -> bool:
+    return os.path.exists(f"{g.ACTIVE_REQUESTS_DIR}/{project_id}")
+
+
+def get_images_dt(project) -> Optional[str]:
+    """The latest `updated_at` of the images seen by the last run, from the project
+    fingerprint (saved locally, or uploaded if the app was restarted) or the cache.
+    """
+    project_fs_dir = f"{g.STORAGE_DIR}/{project.id}_{project.name}"
+    local_path = f"{project_fs_dir}/_cache/{project.id}_fingerprint.json"
+    saved = None
+    if os.path.exists(local_path):
+        try:
+            with open(local_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception:
+            saved = None
+    if saved is None:
+        tf_project_dir = f"{g.TF_STATS_DIR}/{project.id}_{project.name}"
+        saved = u.pull_project_fingerprint(project.team_id, project.id, tf_project_dir, project_fs_dir)
+    if saved is not None and saved.get("images_dt") is not None:
+        return saved["images_dt"]
+    return get_local_images_dt(project.id, project_fs_dir)
+
+
+def count_stale_images(project_id: int) -> int:
+    """Returns the number of images in the datasets with the images updated after the
+    latest cached image. Every dataset is probed with one image at most.
+    """
+    project = g.api.project.get_info_by_id(project_id, raise_error=True)
+    images_dt = get_images_dt(project)
+    if images_dt is None:
+        return project.items_count or 0
+
+    filters = [{"field": "updatedAt", "operator": ">", "value": images_dt}]
+    return sum(
+        dataset.items_count or 0
+        for dataset in g.api.dataset.get_list(project_id)
+        if len(g.api.image.get_list(dataset.id, filters=filters, limit=1)) > 0
+    )
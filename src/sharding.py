@@ -0,0 +1,638 @@
+import fcntl
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import supervisely as sly
+from supervisely import ProjectInfo, ProjectMeta, TeamInfo
+from supervisely.io.fs import get_file_name
+
+import src.globals as g
+import src.utils as u
+from src.cancellation import CancellationToken
+from src.checkpoint import Checkpointer
+from src.image_table import ImageTable
+
+
+class ShardBackend:
+    """Shared state of the sharded jobs: the shards queue and the chunk artifacts.
+
+    A job state is `{"meta": {...}, "shards": {shard_id: {...}}}`. Every change goes
+    through `_transaction`, so the implementations only have to load, lock and save it.
+    A running shard whose lease has expired can be claimed (stolen) by another worker.
+    """
+
+    @contextmanager
+    def _transaction(self, job_id: str) -> Iterator[Optional[dict]]:
+        raise NotImplementedError
+
+    def _create(self, job_id: str, state: dict):
+        raise NotImplementedError
+
+    def list_jobs(self) -> List[str]:
+        raise NotImplementedError
+
+    def remove_job(self, job_id: str):
+        raise NotImplementedError
+
+    def put_artifacts(self, job_id: str, base_dir: str, paths: List[str]) -> List[str]:
+        """Stores the files and returns their references (paths relative to `base_dir`)."""
+        raise NotImplementedError
+
+    def get_artifacts(self, job_id: str, refs: List[str], dst_dir: str):
+        raise NotImplementedError
+
+    def publish(self, job_id: str, meta: dict, shards: Dict[str, dict]):
+        state = {"meta": meta, "shards": {}}
+        for shard_id, shard in shards.items():
+            state["shards"][shard_id] = {
+                **shard,
+                "status": "pending",
+                "worker": None,
+                "attempts": 0,
+                "lease_until": 0,
+                "error": None,
+                "result": None,
+            }
+        self._create(job_id, state)
+
+    def get_state(self, job_id: str) -> Optional[dict]:
+        with self._transaction(job_id) as state:
+            return state
+
+    def claim(self, job_id: str, worker_id: str, lease: float) -> Optional[Tuple[str, dict, dict]]:
+        """Returns `(shard_id, shard, job meta)` of a pending or abandoned shard."""
+        with self._transaction(job_id) as state:
+            if state is None:
+                return None
+            now = time.time()
+            for shard_id, shard in state["shards"].items():
+                is_abandoned = shard["status"] == "running" and shard["lease_until"] < now
+                if shard["status"] == "pending" or is_abandoned:
+                    if is_abandoned:
+                        sly.logger.info(
+                            f"The shard {shard_id!r} of the worker {shard['worker']!r} is stolen by {worker_id!r}"
+                        )
+                    shard.update(status="running", worker=worker_id, lease_until=now + lease)
+                    shard["attempts"] += 1
+                    return shard_id, dict(shard), state["meta"]
+        return None
+
+    def renew(self, job_id: str, shard_id: str, worker_id: str, lease: float) -> bool:
+        """Extends the lease. Returns False if the shard was stolen or the job was removed."""
+        with self._transaction(job_id) as state:
+            if state is None:
+                return False
+            shard = state["shards"][shard_id]
+            if shard["status"] != "running" or shard["worker"] != worker_id:
+                return False
+            shard["lease_until"] = time.time() + lease
+            return True
+
+    def complete(self, job_id: str, shard_id: str, worker_id: str, result: dict):
+        with self._transaction(job_id) as state:
+            if state is None:
+                return
+            shard = state["shards"][shard_id]
+            if shard["status"] != "done":  # the first result wins, they are identical anyway
+                shard.update(status="done", worker=worker_id, result=result, error=None)
+
+    def fail(self, job_id: str, shard_id: str, worker_id: str, error: str, max_attempts: int):
+        with self._transaction(job_id) as state:
+            if state is None:
+                return
+            shard = state["shards"][shard_id]
+            if shard["status"] != "running" or shard["worker"] != worker_id:
+                return
+            shard["error"] = error
+            shard["status"] = "pending" if shard["attempts"] < max_attempts else "failed"
+
+
+class InMemoryBackend(ShardBackend):
+    """Single-process stand-in for the tests and local debugging."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._files = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self, job_id: str):
+        with self._lock:
+            yield self._jobs.get(job_id)
+
+    def _create(self, job_id: str, state: dict):
+        with self._lock:
+            self._jobs[job_id] = state
+
+    def list_jobs(self) -> List[str]:
+        with self._lock:
+            return list(self._jobs.keys())
+
+    def remove_job(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._files.pop(job_id, None)
+
+    def put_artifacts(self, job_id: str, base_dir: str, paths: List[str]) -> List[str]:
+        refs = []
+        for path in paths:
+            ref = os.path.relpath(path, base_dir)
+            with open(path, "rb") as f:
+                data = f.read()
+            with self._lock:
+                self._files[job_id][ref] = data
+            refs.append(ref)
+        return refs
+
+    def get_artifacts(self, job_id: str, refs: List[str], dst_dir: str):
+        for ref in refs:
+            dst = f"{dst_dir}/{ref}"
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            with open(dst, "wb") as f:
+                f.write(self._files[job_id][ref])
+
+
+class LocalFsBackend(ShardBackend):
+    """Keeps the jobs in a local (or mounted) dir, locked with `flock`. Several app
+    instances on one host, or on the hosts sharing the mount, can work on the same jobs.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _job_dir(self, job_id: str) -> str:
+        return f"{self.root_dir}/{job_id}"
+
+    @contextmanager
+    def _transaction(self, job_id: str):
+        job_dir = self._job_dir(job_id)
+        state_path = f"{job_dir}/state.json"
+        if not os.path.exists(state_path):
+            yield None
+            return
+        with open(f"{job_dir}/.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(state_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                yield state
+                tmp_path = f"{state_path}.{uuid.uuid4().hex}"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, state_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _create(self, job_id: str, state: dict):
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        tmp_path = f"{job_dir}/state.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, f"{job_dir}/state.json")
+
+    def list_jobs(self) -> List[str]:
+        return [
+            name
+            for name in os.listdir(self.root_dir)
+            if os.path.exists(f"{self.root_dir}/{name}/state.json")
+        ]
+
+    def remove_job(self, job_id: str):
+        shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+    def put_artifacts(self, job_id: str, base_dir: str, paths: List[str]) -> List[str]:
+        refs = []
+        for path in paths:
+            ref = os.path.relpath(path, base_dir)
+            dst = f"{self._job_dir(job_id)}/files/{ref}"
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copyfile(path, dst)
+            refs.append(ref)
+        return refs
+
+    def get_artifacts(self, job_id: str, refs: List[str], dst_dir: str):
+        for ref in refs:
+            dst = f"{dst_dir}/{ref}"
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copyfile(f"{self._job_dir(job_id)}/files/{ref}", dst)
+
+
+class TeamFilesBackend(ShardBackend):
+    """Keeps the jobs in team files, so the instances on different agents can share them.
+
+    Team files have no atomic operations, so a transaction is guarded by a lock file
+    with the owner id inside. The lock is taken if it is still ours `LOCK_SETTLE` seconds
+    after the upload: of the workers that saw no lock at the same moment only the last
+    uploaded one wins. A lock older than `LOCK_TIMEOUT` is considered abandoned.
+    """
+
+    LOCK_TIMEOUT = 60  # seconds
+    LOCK_SETTLE = 1  # seconds
+
+    def __init__(self, team_id: int, tf_root_dir: str):
+        self.team_id = team_id
+        self.tf_root_dir = tf_root_dir
+        self.local_dir = f"{g.STORAGE_DIR}/_shards/{team_id}"
+        os.makedirs(self.local_dir, exist_ok=True)
+
+    @contextmanager
+    def _lock(self, job_id: str):
+        tf_lock_path = f"{self.tf_root_dir}/{job_id}.lock"
+        owner = uuid.uuid4().hex
+        local_lock_path = f"{self.local_dir}/{job_id}.lock.{owner}"
+        with open(local_lock_path, "w") as f:
+            f.write(owner)
+        try:
+            started_at = time.monotonic()
+            while not self._try_lock(tf_lock_path, local_lock_path, owner):
+                if time.monotonic() - started_at > self.LOCK_TIMEOUT:
+                    sly.logger.warning(f"The lock {tf_lock_path!r} is abandoned. Removing...")
+                    g.api.file.remove(self.team_id, tf_lock_path)
+                    started_at = time.monotonic()
+                time.sleep(0.5 + random.random())
+            try:
+                yield
+            finally:
+                if self._read_lock_owner(tf_lock_path) == owner:
+                    g.api.file.remove(self.team_id, tf_lock_path)
+        finally:
+            sly.fs.silent_remove(local_lock_path)
+
+    def _try_lock(self, tf_lock_path: str, local_lock_path: str, owner: str) -> bool:
+        if g.api.file.exists(self.team_id, tf_lock_path):
+            return False
+        g.api.file.upload(self.team_id, local_lock_path, tf_lock_path)
+        time.sleep(self.LOCK_SETTLE)
+        return self._read_lock_owner(tf_lock_path) == owner
+
+    def _read_lock_owner(self, tf_lock_path: str) -> Optional[str]:
+        local_path = f"{self.local_dir}/{uuid.uuid4().hex}.lock"
+        try:
+            g.api.file.download(self.team_id, tf_lock_path, local_path)
+            with open(local_path, "r") as f:
+                return f.read().strip()
+        except Exception:
+            return None
+        finally:
+            sly.fs.silent_remove(local_path)
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        tf_state_path = f"{self.tf_root_dir}/{job_id}.json"
+        if not g.api.file.exists(self.team_id, tf_state_path):
+            return None
+        local_path = f"{self.local_dir}/{job_id}.{uuid.uuid4().hex}.json"
+        g.api.file.download(self.team_id, tf_state_path, local_path)
+        with open(local_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        sly.fs.silent_remove(local_path)
+        return state
+
+    def _save(self, job_id: str, state: dict):
+        local_path = f"{self.local_dir}/{job_id}.{uuid.uuid4().hex}.json"
+        with open(local_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        g.api.file.upload(self.team_id, local_path, f"{self.tf_root_dir}/{job_id}.json")
+        sly.fs.silent_remove(local_path)
+
+    @contextmanager
+    def _transaction(self, job_id: str):
+        with self._lock(job_id):
+            state = self._load(job_id)
+            yield state
+            if state is not None:
+                self._save(job_id, state)
+
+    def _create(self, job_id: str, state: dict):
+        self._save(job_id, state)
+
+    def list_jobs(self) -> List[str]:
+        if not g.api.file.dir_exists(self.team_id, self.tf_root_dir):
+            return []
+        infos = g.api.file.list2(self.team_id, self.tf_root_dir, recursive=False)
+        return [get_file_name(info.path) for info in infos if info.path.endswith(".json")]
+
+    def remove_job(self, job_id: str):
+        g.api.file.remove(self.team_id, f"{self.tf_root_dir}/{job_id}.json")
+        g.api.file.remove_dir(self.team_id, f"{self.tf_root_dir}/{job_id}/", silent=True)
+
+    def put_artifacts(self, job_id: str, base_dir: str, paths: List[str]) -> List[str]:
+        refs = [os.path.relpath(path, base_dir) for path in paths]
+        dst_paths = [f"{self.tf_root_dir}/{job_id}/files/{ref}" for ref in refs]
+        g.api.file.upload_bulk(self.team_id, paths, dst_paths)
+        return refs
+
+    def get_artifacts(self, job_id: str, refs: List[str], dst_dir: str):
+        for ref in refs:
+            dst = f"{dst_dir}/{ref}"
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            g.api.file.download(self.team_id, f"{self.tf_root_dir}/{job_id}/files/{ref}", dst)
+
+
+_memory_backend = InMemoryBackend()
+
+
+def get_backend(team_id: int) -> ShardBackend:
+    if g.SHARD_BACKEND == "memory":
+        return _memory_backend
+    if g.SHARD_BACKEND == "local":
+        return LocalFsBackend(g.SHARD_LOCAL_DIR)
+    return TeamFilesBackend(team_id, f"{g.TF_STATS_DIR}/_shards")
+
+
+class ShardWorker:
+    """Claims the shards of the published jobs and calculates their chunks.
+
+    The worker lists the images of a dataset once per job and checks every chunk against
+    the digest of the coordinator, so the chunk boundaries of both sides are the same.
+    """
+
+    def __init__(self, backend_factory: Callable[[], ShardBackend], worker_id: Optional[str] = None):
+        self.backend_factory = backend_factory
+        self.worker_id = worker_id or f"{os.uname().nodename}-{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = None
+        self._tables = {}  # (job_id, dataset_id) -> ImageTable
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="shard-worker", daemon=True)
+        self._thread.start()
+        sly.logger.info(f"The shard worker {self.worker_id!r} was started")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(g.SHARD_POLL_INTERVAL):
+            try:
+                backend = self.backend_factory()
+                for job_id in backend.list_jobs():
+                    while self.process_one(backend, job_id):
+                        pass
+            except Exception as e:
+                sly.logger.warning(f"The shard worker failed: {e.__class__.__name__}: {e}")
+
+    def process_one(self, backend: ShardBackend, job_id: str) -> bool:
+        """Claims and calculates one shard of the job. Returns False if there was none."""
+        claimed = backend.claim(job_id, self.worker_id, g.SHARD_LEASE)
+        if claimed is None:
+            return False
+        shard_id, shard, meta = claimed
+        sly.logger.info(f"The worker {self.worker_id!r} calculates the shard {shard_id!r}")
+        scratch_dir = f"{g.STORAGE_DIR}/_shards/{job_id}_{shard_id}_{uuid.uuid4().hex[:8]}"
+        try:
+            result = self._calculate(backend, job_id, shard_id, shard, meta, scratch_dir)
+            if result is not None:
+                backend.complete(job_id, shard_id, self.worker_id, result)
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+            sly.logger.warning(f"The shard {shard_id!r} failed: {error}")
+            backend.fail(job_id, shard_id, self.worker_id, error, g.SHARD_MAX_ATTEMPTS)
+        finally:
+            sly.fs.remove_dir(scratch_dir)
+            self._tables = {k: v for k, v in self._tables.items() if k[0] == job_id}
+        return True
+
+    def _get_table(self, job_id: str, dataset_id: int) -> ImageTable:
+        key = (job_id, dataset_id)
+        if key not in self._tables:
+            self._tables[key] = u.list_images(dataset_id)
+        return self._tables[key]
+
+    def _calculate(
+        self,
+        backend: ShardBackend,
+        job_id: str,
+        shard_id: str,
+        shard: dict,
+        meta: dict,
+        scratch_dir: str,
+    ) -> Optional[dict]:
+        g.initialize_log_levels(meta["project_id"])
+        if meta["chunk_size"] != g.CHUNK_SIZE:
+            raise RuntimeError(f"The chunk size {meta['chunk_size']} differs from {g.CHUNK_SIZE}")
+        project = g.api.project.get_info_by_id(meta["project_id"], raise_error=True)
+        project_meta = u.get_project_meta(project.id)
+        if u.get_meta_hash(project_meta) != meta["meta_hash"]:
+            raise RuntimeError("The project meta has changed after the job was published")
+        datasets = g.api.dataset.get_list(project.id)
+        project_stats = g.api.project.get_stats(project.id)
+        stats = u.get_applicable_stats(u.create_stats(project_meta, project_stats, datasets))
+
+        os.makedirs(scratch_dir, exist_ok=True)
+        heatmaps_image_ids, heatmaps_figure_ids = defaultdict(set), defaultdict(set)
+        chunk_datetimes, updated_stems = {}, set()
+        for chunk, digest in shard["chunks"].items():
+            dataset_id = int(chunk.split("_")[2])
+            table = self._get_table(job_id, dataset_id)
+            chunk_idx = int(chunk.split("_")[1])
+            images_chunk = table[chunk_idx * g.CHUNK_SIZE : (chunk_idx + 1) * g.CHUNK_SIZE]
+            if images_chunk.digest() != digest:
+                raise RuntimeError(f"The images of the chunk {chunk!r} differ from the coordinator ones")
+
+            image_ids, figure_ids, stems = u.calculate_stats_and_save_chunks(
+                {dataset_id: images_chunk},
+                stats,
+                [],
+                scratch_dir,
+                {chunk: images_chunk},
+                {dataset_id: table.ids},
+                project_stats,
+                project,
+                update_chunks_datetime=False,
+            )
+            updated_stems.update(stems)
+            for ds_id, ids in image_ids.items():
+                heatmaps_image_ids[ds_id].update(ids)
+            for class_id, ids in figure_ids.items():
+                heatmaps_figure_ids[class_id].update(ids)
+            chunk_datetimes[chunk] = u.get_latest_datetime(images_chunk)
+
+            if not backend.renew(job_id, shard_id, self.worker_id, g.SHARD_LEASE):
+                sly.logger.info(f"The shard {shard_id!r} was taken over or cancelled. Stopping...")
+                return None
+
+        paths = sly.fs.list_files_recursively(scratch_dir, [".npy", ".npz"])
+        refs = backend.put_artifacts(job_id, scratch_dir, paths)
+        latest_datetime = max(chunk_datetimes.values(), default=None)
+        return {
+            "files": refs,
+            "chunks": {
+                chunk: {"dt": dt.isoformat(), "files": _get_chunk_refs(refs, chunk)}
+                for chunk, dt in chunk_datetimes.items()
+            },
+            "updated_stems": sorted(updated_stems),
+            "latest_datetime": latest_datetime.isoformat() if latest_datetime else None,
+            "heatmaps_image_ids": {str(k): sorted(v) for k, v in heatmaps_image_ids.items()},
+            "heatmaps_figure_ids": {str(k): sorted(v) for k, v in heatmaps_figure_ids.items()},
+        }
+
+
+def _get_chunk_refs(refs: List[str], chunk: str) -> List[str]:
+    """The files of one chunk: `{chunk}_{chunk size}_...` of the stats and the fingerprints."""
+    return [ref for ref in refs if os.path.basename(ref).startswith(f"{chunk}_")]
+
+
+def split_into_shards(
+    project_id: int,
+    updated_images: Dict[int, ImageTable],
+    chunk_to_images: Dict[str, ImageTable],
+    image_to_chunk: Dict[int, np.ndarray],
+    shard_size: int,
+    checkpointer: Optional[Checkpointer] = None,
+) -> Dict[str, dict]:
+    """Groups the updated chunks into shards of `shard_size` chunks: `{shard_id: {"chunks": {chunk: digest}}}`."""
+    chunks = []
+    for dataset_id, images in updated_images.items():
+        if len(images) == 0:
+            continue
+        for chunk in u.get_chunks_of_images(project_id, dataset_id, image_to_chunk[dataset_id], images.ids):
+            if checkpointer is not None:
+                latest_datetime = checkpointer.get_completed(chunk, chunk_to_images[chunk].digest())
+                if latest_datetime is not None:
+                    if g.CHUNKS_LATEST_DATETIME is None or g.CHUNKS_LATEST_DATETIME < latest_datetime:
+                        g.CHUNKS_LATEST_DATETIME = latest_datetime
+                    continue
+            chunks.append(chunk)
+    shards = {}
+    for idx in range(0, len(chunks), shard_size):
+        shards[f"shard_{idx // shard_size}"] = {
+            "chunks": {chunk: chunk_to_images[chunk].digest() for chunk in chunks[idx : idx + shard_size]}
+        }
+    return shards
+
+
+@sly.timeit
+def calculate_sharded(
+    backend: ShardBackend,
+    team: TeamInfo,
+    project: ProjectInfo,
+    project_meta: ProjectMeta,
+    updated_images: Dict[int, ImageTable],
+    chunk_to_images: Dict[str, ImageTable],
+    image_to_chunk: Dict[int, np.ndarray],
+    project_fs_dir: str,
+    checkpointer: Optional[Checkpointer] = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> Tuple[Dict[int, Set[int]], Dict[int, Set[int]], Set[str]]:
+    """The coordinator side of `calculate_stats_and_save_chunks`: publishes the updated
+    chunks as shards, calculates them together with the workers and puts the chunk
+    files of all shards to the project dir, ready for sewing.
+    """
+    shards = split_into_shards(
+        project.id, updated_images, chunk_to_images, image_to_chunk, g.SHARD_SIZE, checkpointer
+    )
+    heatmaps_image_ids, heatmaps_figure_ids = defaultdict(set), defaultdict(set)
+    updated_stems = set()
+    if len(shards) == 0:
+        return heatmaps_image_ids, heatmaps_figure_ids, updated_stems
+
+    job_id = f"{project.id}_{uuid.uuid4().hex[:8]}"
+    meta = {
+        "project_id": project.id,
+        "team_id": team.id,
+        "chunk_size": g.CHUNK_SIZE,
+        "meta_hash": u.get_meta_hash(project_meta),
+    }
+    backend.publish(job_id, meta, shards)
+    sly.logger.log(g._INFO, f"The job {job_id!r} was published with {len(shards)} shards")
+
+    coordinator = ShardWorker(lambda: backend, worker_id=f"coordinator-{job_id}")
+    merged = set()
+    try:
+        while True:
+            if cancel_token is not None and cancel_token.is_cancelled:
+                if checkpointer is not None:
+                    checkpointer.flush()
+                cancel_token.raise_if_cancelled()
+            if coordinator.process_one(backend, job_id):
+                continue
+
+            state = backend.get_state(job_id)
+            failed = [(k, v["error"]) for k, v in state["shards"].items() if v["status"] == "failed"]
+            if len(failed) > 0:
+                raise RuntimeError(f"The shards failed after {g.SHARD_MAX_ATTEMPTS} attempts: {failed}")
+            # the finished shards are merged (and checkpointed) while the rest is calculated
+            for shard_id, shard in state["shards"].items():
+                if shard["status"] != "done" or shard_id in merged:
+                    continue
+                latest_datetime = _merge_shard_result(
+                    backend,
+                    job_id,
+                    shard,
+                    project_fs_dir,
+                    checkpointer,
+                    heatmaps_image_ids,
+                    heatmaps_figure_ids,
+                    updated_stems,
+                )
+                if latest_datetime is not None:
+                    if g.CHUNKS_LATEST_DATETIME is None or g.CHUNKS_LATEST_DATETIME < latest_datetime:
+                        g.CHUNKS_LATEST_DATETIME = latest_datetime
+                merged.add(shard_id)
+            if len(merged) == len(state["shards"]):
+                break
+            time.sleep(g.SHARD_POLL_INTERVAL)
+
+        workers = set(shard["worker"] for shard in state["shards"].values())
+        sly.logger.log(
+            g._INFO, f"The job {job_id!r} was calculated by {len(workers)} workers: {sorted(workers)}"
+        )
+    finally:
+        backend.remove_job(job_id)
+
+    return heatmaps_image_ids, heatmaps_figure_ids, updated_stems
+
+
+def _merge_shard_result(
+    backend: ShardBackend,
+    job_id: str,
+    shard: dict,
+    project_fs_dir: str,
+    checkpointer: Optional[Checkpointer],
+    heatmaps_image_ids: Dict[int, Set[int]],
+    heatmaps_figure_ids: Dict[int, Set[int]],
+    updated_stems: Set[str],
+) -> Optional[datetime]:
+    """Puts the chunk files of a finished shard to the project dir. Returns its latest datetime."""
+    result = shard["result"]
+    _replace_local_chunks(project_fs_dir, result["files"])
+    backend.get_artifacts(job_id, result["files"], project_fs_dir)
+    updated_stems.update(result["updated_stems"])
+    for ds_id, ids in result["heatmaps_image_ids"].items():
+        heatmaps_image_ids[int(ds_id)].update(ids)
+    for class_id, ids in result["heatmaps_figure_ids"].items():
+        heatmaps_figure_ids[int(class_id)].update(ids)
+    if checkpointer is not None:
+        for chunk, entry in result["chunks"].items():
+            paths = [f"{project_fs_dir}/{ref}" for ref in entry["files"]]
+            checkpointer.add(chunk, shard["chunks"][chunk], datetime.fromisoformat(entry["dt"]), paths)
+    if result["latest_datetime"] is None:
+        return None
+    return datetime.fromisoformat(result["latest_datetime"])
+
+
+def _replace_local_chunks(project_fs_dir: str, refs: List[str]):
+    """Removes the buffered chunk files that are replaced by the shard results."""
+    for ref in refs:
+        if not ref.endswith(".npy"):  # the fingerprints are just overwritten
+            continue
+        stat_dir, filename = os.path.split(ref)
+        chunk_prefix = filename.rsplit("_", 1)[0] + "_"  # chunk_{idx}_{ds}_{proj}_{size}_
+        local_dir = f"{project_fs_dir}/{stat_dir}"
+        if not os.path.isdir(local_dir):
+            continue
+        for name in os.listdir(local_dir):
+            if name.startswith(chunk_prefix):
+                os.remove(f"{local_dir}/{name}")
@@ -0,0 +1,195 @@
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import supervisely as sly
+import src.globals as g
+import src.cancellation as cancellation
+from src.columnar import iter_json_from_columnar
+
+
+STAT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+
+class StatsCache:
+    """Byte-bounded LRU of the sewed stats (.json and .npz).
+
+    A stat is read from the project's local dir, or downloaded from team files if it is
+    not there: the local dir is cleaned at the start of a run, is empty after a restart
+    and holds only the stats recalculated by the latest run.
+
+    The ETag of both is the `chunks_dt` of the project's cache. The stats of a project
+    whose run is in flight are served but not cached: they can change at any moment.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (project_id, stat_name) -> [etag, raw, gzipped]
+        self._size = 0
+        self._generations = {}  # project_id -> the number of the invalidations
+        self._remote_etags = {}  # project_id -> the ETag of the stats in team files
+        self._lock = threading.Lock()
+
+    def get(self, project_id: int, filename: str, gzipped: bool = False) -> Optional[Tuple[str, bytes]]:
+        key = (project_id, filename)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0], self._body(key, entry, gzipped)
+            generation = self._generations.get(project_id, 0)
+
+        loaded = _load_local(project_id, filename)
+        if loaded is None:
+            loaded = self._load_remote(project_id, filename)
+        if loaded is None:
+            return None
+        etag, raw = loaded
+
+        with self._lock:
+            entry = [etag, raw, None]
+            # the stats loaded before an invalidation or during a run may be outdated already
+            if self._generations.get(project_id, 0) != generation or cancellation.is_running(project_id):
+                return etag, gzip.compress(raw) if gzipped else raw
+            self._put(key, entry)
+            return etag, self._body(key, entry, gzipped)
+
+    def invalidate(self, project_id: int):
+        with self._lock:
+            self._generations[project_id] = self._generations.get(project_id, 0) + 1
+            self._remote_etags.pop(project_id, None)
+            for key in [k for k in self._entries if k[0] == project_id]:
+                self._drop(key)
+        sly.logger.debug(f"The stats cache was invalidated for the project ID={project_id}")
+
+    def _load_remote(self, project_id: int, filename: str) -> Optional[Tuple[str, bytes]]:
+        project = g.api.project.get_info_by_id(project_id)
+        if project is None:
+            return None
+        tf_project_dir = f"{g.TF_STATS_DIR}/{project.id}_{project.name}"
+        tf_path = f"{tf_project_dir}/{filename}"
+        info = g.api.file.get_info_by_path(project.team_id, tf_path)
+        if info is None:
+            return None
+        raw = _download(project.team_id, tf_path, filename)
+
+        with self._lock:
+            etag = self._remote_etags.get(project_id)
+        if etag is None:
+            chunks_dt = _get_remote_chunks_dt(project.team_id, project_id, tf_project_dir)
+            etag = f'"{project_id}-{chunks_dt or info.updated_at}"'
+            if chunks_dt is not None:
+                with self._lock:
+                    self._remote_etags[project_id] = etag
+        return etag, raw
+
+    def _body(self, key, entry, gzipped: bool) -> bytes:
+        if not gzipped:
+            return entry[1]
+        if entry[2] is None:
+            entry[2] = gzip.compress(entry[1])
+            if key in self._entries:
+                self._size += len(entry[2])
+                self._evict()
+        return entry[2]
+
+    def _put(self, key, entry):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = entry
+        self._size += len(entry[1])
+        self._evict()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry[1]) + (len(entry[2]) if entry[2] is not None else 0)
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 0:
+            self._drop(next(iter(self._entries)))
+
+
+def _load_local(project_id: int, filename: str) -> Optional[Tuple[str, bytes]]:
+    project_fs_dir = get_project_fs_dir(project_id)
+    if project_fs_dir is None:
+        return None
+    path = f"{project_fs_dir}/{filename}"
+    npz_path = f"{os.path.splitext(path)[0]}.npz"
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            raw = f.read()
+    elif path.endswith(".json") and os.path.exists(npz_path):
+        path = npz_path
+        raw = "".join(iter_json_from_columnar(npz_path)).encode("utf-8")
+    else:
+        return None
+    return get_etag(project_id, project_fs_dir, path), raw
+
+
+def _download(team_id: int, tf_path: str, filename: str) -> bytes:
+    local_path = f"{g.STORAGE_DIR}/_stats_cache/{uuid.uuid4().hex}_{filename}"
+    try:
+        g.api.file.download(team_id, tf_path, local_path)
+        with open(local_path, "rb") as f:
+            return f.read()
+    finally:
+        sly.fs.silent_remove(local_path)
+
+
+def _get_remote_chunks_dt(team_id: int, project_id: int, tf_project_dir: str) -> Optional[str]:
+    """The `chunks_dt` of the cache in team files: the same source as `get_etag`."""
+    filename = f"{project_id}_cache.json"
+    tf_cache_path = f"{tf_project_dir}/_cache/{filename}"
+    if not g.api.file.exists(team_id, tf_cache_path):
+        return None
+    try:
+        return json.loads(_download(team_id, tf_cache_path, filename)).get("stats_meta", {}).get("chunks_dt")
+    except Exception:
+        return None
+
+
+def get_project_fs_dir(project_id: int) -> Optional[str]:
+    dirs = [p for p in glob.glob(f"{g.STORAGE_DIR}/{project_id}_*") if os.path.isdir(p)]
+    if len(dirs) == 0:
+        return None
+    return max(dirs, key=os.path.getmtime)
+
+
+def get_local_chunks_dt(project_id: int, project_fs_dir: str) -> Optional[str]:
+    local_cache_path = f"{project_fs_dir}/_cache/{project_id}_cache.json"
+    if not os.path.exists(local_cache_path):
+        return None
+    try:
+        with open(local_cache_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("stats_meta", {}).get("chunks_dt")
+    except Exception:
+        return None
+
+
+def get_local_images_dt(project_id: int, project_fs_dir: str) -> Optional[str]:
+    """The latest `updated_at` of the cached images, falls back to the chunks datetime."""
+    local_cache_path = f"{project_fs_dir}/_cache/{project_id}_cache.json"
+    if not os.path.exists(local_cache_path):
+        return None
+    try:
+        with open(local_cache_path, "r", encoding="utf-8") as f:
+            smeta = json.load(f).get("stats_meta", {})
+        return smeta.get("images_dt") or smeta.get("chunks_dt")
+    except Exception:
+        return None
+
+
+def get_etag(project_id: int, project_fs_dir: str, path: str) -> str:
+    chunks_dt = get_local_chunks_dt(project_id, project_fs_dir)
+    if chunks_dt is None:
+        chunks_dt = str(os.stat(path).st_mtime_ns)
+    return f'"{project_id}-{chunks_dt}"'
+
+
+stats_cache = StatsCache(g.STATS_CACHE_MAX_BYTES)
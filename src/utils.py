@@ -1,20 +1,26 @@
 from pathlib import Path
 
 import json, time
+import gc
+import hashlib
+import heapq
 from packaging.version import Version
 import tarfile
 import os
 import math
-from typing import List, Literal, Optional, Dict, Tuple, Union, Set
-import dataset_tools as dtools
-from dataset_tools.image.stats.basestats import BaseStats
+from typing import Iterable, List, Literal, Optional, Dict, Tuple, Union, Set, NamedTuple, TYPE_CHECKING
 from datetime import datetime
-import humanize
 from supervisely import ImageInfo, ProjectMeta, ProjectInfo, DatasetInfo, FigureInfo, TeamInfo
 from itertools import groupby
-from tqdm import tqdm
 import supervisely as sly
 import src.globals as g
+from src.image_table import ImageTable, infos_by_ids
+from src.checkpoint import Checkpointer
+from src.cancellation import CancellationToken
+from src.features import has_verified_internals, update_stats_with_batch
+import src.columnar as columnar
+from src.garbage_collector import garbage_collector
+from src.resources import governor
 import numpy as np
 import ujson
 from collections import defaultdict
@@ -26,8 +32,13 @@ from supervisely.io.fs import (
     get_file_size,
     list_files_recursively,
 )
+from supervisely._utils import camel_to_snake
 from supervisely.imaging.color import _validate_hex_color, hex2rgb, random_rgb, rgb2hex
 
+if TYPE_CHECKING:
+    import dataset_tools as dtools
+    from dataset_tools.image.stats.basestats import BaseStats
+
 
 def pull_cache(
     team_id: int, project_id: int, tf_project_dir: str, project_fs_dir: str
@@ -52,6 +63,10 @@ def pull_cache(
     if os.path.exists(local_cache_path):
         with open(local_cache_path, "r", encoding="utf-8") as f:
             _cache = json.load(f)
+        if _cache.get("images") is not None:
+            _cache["images"] = ImageTable.from_updated_at_dict(_cache["images"])
+        if _cache.get("annotations") is not None:
+            _cache["annotations"] = {int(k): v for k, v in _cache["annotations"].items()}
 
     images = _cache.get("images")
     meta = _cache.get("meta")
@@ -103,10 +118,15 @@ def pull_cache(
 
     _cache["stats_meta"] = smeta
     _cache["meta"] = meta
-    _cache["images"] = {int(k): v for k, v in images.items()}
+    _cache["images"] = images
+    _cache["annotations"] = _cache.get("annotations") or {}
     return False, _cache
 
 
+def get_meta_hash(project_meta: ProjectMeta) -> str:
+    return hashlib.md5(json.dumps(project_meta.to_json(), sort_keys=True).encode()).hexdigest()
+
+
 def get_iso_timestamp():
     now = datetime.now()
     ts = datetime.timestamp(now)
@@ -115,7 +135,12 @@ def get_iso_timestamp():
 
 
 def push_cache(
-    team_id: int, project_id: int, tf_project_dir: str, project_fs_dir: str, _cache: dict
+    team_id: int,
+    project_id: int,
+    tf_project_dir: str,
+    project_fs_dir: str,
+    _cache: dict,
+    chunks_datetime: Optional[datetime] = None,
 ) -> dict:
     filename = f"{project_id}_cache.json"
     tf_cache_path = f"{tf_project_dir}/_cache/{filename}"
@@ -124,12 +149,10 @@ def push_cache(
     local_cache_path = f"{local_cache_dir}/{filename}"
 
     ts_utc = get_iso_timestamp()
-    chunks_dt = str(g.CHUNKS_LATEST_DATETIME.isoformat()) + "Z"
+    chunks_datetime = chunks_datetime or g.CHUNKS_LATEST_DATETIME
+    chunks_dt = str(chunks_datetime.isoformat()) + "Z"
 
-    try:
-        actual_version = dtools.__version__
-    except:
-        actual_version = None
+    actual_version = get_dtools_version()
 
     smeta = _cache.get("stats_meta")
     if smeta is None:
@@ -145,23 +168,199 @@ def push_cache(
         _cache["stats_meta"]["chunk_size"] = g.CHUNK_SIZE
         _cache["stats_meta"]["chunks_dt"] = chunks_dt
         _cache["stats_meta"]["dataset-tools"] = actual_version
+    if isinstance(_cache.get("images"), ImageTable) and len(_cache["images"]) > 0:
+        # newer than chunks_dt if the images with metadata-only changes were skipped
+        _cache["stats_meta"]["images_dt"] = str(_cache["images"].latest_updated_at().isoformat()) + "Z"
 
     os.makedirs(local_cache_dir, exist_ok=True)
     with open(local_cache_path, "w", encoding="utf-8") as f:
-        json.dump(_cache, f)
+        images = _cache.get("images")
+        if isinstance(images, ImageTable):
+            json.dump({**_cache, "images": images.to_updated_at_dict()}, f)
+        else:
+            json.dump(_cache, f)
 
     g.api.file.upload(team_id, local_cache_path, tf_cache_path)
     sly.logger.log(g._INFO, f"The cache file {filename!r} was pushed to team files")
 
     # remove old junk
-    g.api.file.remove_dir(team_id, f"{os.path.dirname(tf_project_dir)}/_cache/", silent=True)
+    garbage_collector.collect_remote_dir(team_id, f"{os.path.dirname(tf_project_dir)}/_cache/")
 
     return _cache
 
 
+# a missing file of these stats forces the full recalculation
+MANDATORY_STATS = (
+    "ClassBalance",
+    "ClassCooccurrence",
+    "ClassesPerImage",
+    "ObjectsDistribution",
+    "ObjectSizes",
+    "ClassSizes",
+    "ClassesTreemap",
+)
+
+
+def get_mandatory_paths(tf_project_dir: str) -> List[str]:
+    paths = [f"{tf_project_dir}/{camel_to_snake(name)}.json" for name in MANDATORY_STATS]
+    return paths + [f"{tf_project_dir}/{camel_to_snake('ClassesHeatmaps')}.png"]
+
+
+def get_project_fingerprint(
+    project: ProjectInfo,
+    datasets: List[DatasetInfo],
+    project_stats: dict,
+    project_meta: ProjectMeta,
+) -> dict:
+    """The cheap summary of the project state the stats were calculated from."""
+    return {
+        "updated_at": project.updated_at,
+        "items_count": project.items_count,
+        "datasets": sorted([d.id, d.items_count, d.updated_at] for d in datasets),
+        "images_total": project_stats["images"]["total"],
+        "objects_total": project_stats["objects"]["total"],
+        "meta": get_meta_hash(project_meta),
+        "chunk_size": g.CHUNK_SIZE,
+        "dataset-tools": get_dtools_version(),
+    }
+
+
+def get_dtools_version() -> Optional[str]:
+    """The installed version: an upgrade can change the stats output."""
+    try:
+        import dataset_tools as dtools
+
+        return dtools.__version__
+    except Exception:
+        return None
+
+
+def get_fingerprint_hash(fingerprint: dict) -> str:
+    return hashlib.md5(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def pull_project_fingerprint(
+    team_id: int, project_id: int, tf_project_dir: str, project_fs_dir: str
+) -> Optional[dict]:
+    filename = f"{project_id}_fingerprint.json"
+    local_path = f"{project_fs_dir}/_cache/{filename}"
+    try:
+        g.api.file.download(team_id, f"{tf_project_dir}/_cache/{filename}", local_path)
+        with open(local_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def push_project_fingerprint(
+    team_id: int,
+    project_id: int,
+    tf_project_dir: str,
+    project_fs_dir: str,
+    fingerprint: dict,
+    images: Optional[ImageTable],
+):
+    """Saves the fingerprint with the latest `updated_at` of the listed images. It can be
+    newer than the chunks datetime when the images with metadata-only changes are skipped.
+    """
+    filename = f"{project_id}_fingerprint.json"
+    local_path = f"{project_fs_dir}/_cache/{filename}"
+    images_dt = None
+    if isinstance(images, ImageTable) and len(images) > 0:
+        images_dt = str(images.latest_updated_at().isoformat()) + "Z"
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    with open(local_path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "images_dt": images_dt}, f)
+    g.api.file.upload(team_id, local_path, f"{tf_project_dir}/_cache/{filename}")
+
+
+def is_project_unchanged(
+    team_id: int,
+    project: ProjectInfo,
+    tf_project_dir: str,
+    project_fs_dir: str,
+    datasets: List[DatasetInfo],
+    fingerprint: dict,
+) -> bool:
+    """Compares the fingerprint with the one saved by the last run. The image annotations
+    do not touch the counters, so the images updated after the latest listed image are
+    probed too (one image per dataset at most). The mandatory stats and the heatmaps
+    status (removed by a failed heatmaps task) must be in team files.
+    """
+    saved = pull_project_fingerprint(team_id, project.id, tf_project_dir, project_fs_dir)
+    if saved is None or saved.get("images_dt") is None:
+        return False
+    if saved["fingerprint"] != json.loads(json.dumps(fingerprint)):
+        return False
+
+    tf_paths = set(info.path for info in g.api.file.list2(team_id, tf_project_dir, recursive=False))
+    missing = [path for path in get_mandatory_paths(tf_project_dir) if path not in tf_paths]
+    if len(missing) > 0:
+        sly.logger.log(g._INFO, f"The stats are missing in team files: {missing}")
+        return False
+    if not g.api.file.exists(team_id, f"{tf_project_dir}/_cache/heatmaps/status_ok"):
+        sly.logger.log(g._INFO, "The heatmaps status is missing in team files")
+        return False
+
+    filters = [{"field": "updatedAt", "operator": ">", "value": saved["images_dt"]}]
+    for dataset in datasets:
+        if len(g.api.image.get_list(dataset.id, filters=filters, limit=1)) > 0:
+            return False
+    return True
+
+
+def list_images(dataset_id: int) -> ImageTable:
+    pages = g.api.image.get_list_generator(dataset_id, force_metadata_for_links=True)
+    return ImageTable.from_pages(pages)
+
+
 @sly.timeit
-def get_project_images_all(datasets: List[DatasetInfo]) -> Dict[int, ImageInfo]:
-    return {d.id: g.api.image.get_list(d.id) for d in datasets}
+def get_project_images_all(datasets: List[DatasetInfo]) -> Dict[int, ImageTable]:
+    return {d.id: list_images(d.id) for d in datasets}
+
+
+@sly.timeit
+def get_dirty_images_all(
+    datasets: List[DatasetInfo], dirty_image_ids: Set[int], _cache: dict
+) -> Optional[Dict[int, ImageTable]]:
+    """Lists only the datasets containing the notified images.
+
+    Returns None when the partial listing can not be trusted (deleted or added images,
+    unknown datasets, missing cache) and the full listing is required.
+    """
+    cached_counts = _cache.get("datasets")
+    if cached_counts is None or len(dirty_image_ids) == 0:
+        return None
+
+    dirty_infos = g.api.image.get_info_by_id_batch(list(dirty_image_ids))
+    if len(dirty_infos) != len(dirty_image_ids) or any(x is None for x in dirty_infos):
+        sly.logger.log(g._INFO, "Some of the notified images were deleted. Listing all images...")
+        return None
+
+    datasets_dct = {d.id: d for d in datasets}
+    affected_ids = set(x.dataset_id for x in dirty_infos)
+    if not affected_ids.issubset(datasets_dct.keys()):
+        return None
+
+    for dataset in datasets:
+        if dataset.items_count != cached_counts.get(str(dataset.id)):
+            sly.logger.log(
+                g._INFO,
+                f"The number of images in the dataset ID={dataset.id} has changed. Listing all images...",
+            )
+            return None
+
+    images_all_dct = {
+        ds_id: list_images(ds_id) for ds_id in affected_ids
+    }
+    if any(len(images_all_dct[ds_id]) != datasets_dct[ds_id].items_count for ds_id in affected_ids):
+        return None
+
+    sly.logger.log(
+        g._INFO,
+        f"{len(dirty_image_ids)} notified images from {len(affected_ids)} datasets will be checked",
+    )
+    return images_all_dct
 
 
 @sly.timeit
@@ -172,105 +371,167 @@ def get_updated_images_and_classes(
     images_all_dct,
     force_stats_recalc: bool,
     _cache: dict,
-) -> Tuple[List[ImageInfo], List[str]]:
-    _images_cached = _cache.get("images", {})
+    partial: bool = False,
+) -> Tuple[Dict[int, ImageTable], Dict[int, str], dict, "MetaDiff"]:
+    _images_cached = _cache.get("images")
+    if not isinstance(_images_cached, ImageTable):
+        _images_cached = ImageTable.empty()
     _meta_cached_json = _cache.get("meta")
     _project_meta_cached = ProjectMeta.from_json(_meta_cached_json) if _meta_cached_json else None
-    is_meta_changed = compare_metas(project_meta, _project_meta_cached)
+    meta_diff = diff_metas(project_meta, _project_meta_cached)
 
-    updated_images, updated_classes = {d.id: [] for d in datasets}, {}
+    updated_images, updated_classes = {d.id: ImageTable.empty() for d in datasets}, {}
     if len(project_meta.obj_classes.items()) == 0:
         sly.logger.log(g._INFO, "The project is fully unlabeled")
-        return {}, {}, {}, is_meta_changed
-
-    images_all_flat = []
-    for value in images_all_dct.values():
-        images_all_flat.extend(value)
-
-    images_updated_at = {}
-    for image in images_all_flat:
-        images_updated_at[image.id] = image.updated_at
-
-    _cache["images"] = images_updated_at
+        return {}, {}, {}, meta_diff
+
+    images_all = ImageTable.concat(images_all_dct.values())
+    _cache["images"] = _images_cached.merge(images_all) if partial else images_all
+    annotations = _cache.get("annotations") or {}
+    if not partial and len(annotations) > 0:
+        cached_ids = np.fromiter(annotations.keys(), dtype=np.int64, count=len(annotations))
+        _, found = images_all.lookup(cached_ids)
+        annotations = {k: annotations[k] for k in cached_ids[found].tolist()}
+    _cache["annotations"] = annotations
+    _cache["last_run"] = {"annotations_checked": 0, "metadata_only_skipped": 0}
     _cache["meta"] = project_meta.to_json()
+    _cache["datasets"] = {str(d.id): d.items_count for d in datasets}
 
     if force_stats_recalc is True:
-        return images_all_dct, {}, _cache, is_meta_changed
-
-    if _project_meta_cached is not None:
-        cached_classes = _project_meta_cached.obj_classes
-        if len(cached_classes) != len(project_meta.obj_classes):
-            cached = {x.sly_id: x.name for x in cached_classes}
-            actual = {x.sly_id: x.name for x in project_meta.obj_classes}
-            cached_ids = set(cached.keys())
-            actual_ids = set(actual.keys())
+        return images_all_dct, {}, _cache, meta_diff
 
-            updated_ids = actual_ids.symmetric_difference(cached_ids)
-
-            def _func(pair):
-                id, name = pair
-                return True if id in updated_ids else False
-
-            for dct in [cached, actual]:
-                updated_classes.update(dict(filter(_func, dct.items())))
+    if len(meta_diff.classes_added) > 0 or len(meta_diff.classes_removed) > 0:
+        updated_classes.update(meta_diff.classes_removed)
+        updated_classes.update(meta_diff.classes_added)
+        sly.logger.log(
+            g._INFO,
+            f"Changes in the number of classes detected: {list(updated_classes.values())}",
+        )
 
-            sly.logger.log(
-                g._INFO,
-                f"Changes in the number of classes detected: {list(updated_classes.values())}",
-            )
+    for dataset_id, images in images_all_dct.items():
+        updated_images[dataset_id] = images[images.changed_mask(_images_cached)]
 
-    set_A, set_B = set(_images_cached), set([i.id for i in images_all_flat])
+    if partial:
+        added = deleted = np.array([], dtype=np.int64)
+    else:
+        added = np.setdiff1d(images_all.ids, _images_cached.ids, assume_unique=True)
+        deleted = np.setdiff1d(_images_cached.ids, images_all.ids, assume_unique=True)
 
-    for image in images_all_flat:
-        try:
-            image: ImageInfo
-            cached_updated_at = _images_cached[image.id]
-            if image.updated_at != cached_updated_at:
-                updated_images[image.dataset_id].append(image)
-        except KeyError:
-            updated_images[image.dataset_id].append(image)
-
-    if set_A != set_B:
-        if set_A.issubset(set_B):
+    if len(added) > 0 or len(deleted) > 0:
+        if len(deleted) == 0:
             sly.logger.log(
-                g._INFO, f"The images with the following ids were added: {set_B - set_A}"
+                g._INFO, f"The images with the following ids were added: {added.tolist()}"
             )
-        elif set_B.issubset(set_A):
+        elif len(added) == 0:
             sly.logger.log(
-                g._INFO, f"The images with the following ids were deleted: {set_A - set_B}"
+                g._INFO, f"The images with the following ids were deleted: {deleted.tolist()}"
             )
 
         sly.logger.log(g._INFO, "Recalculate full statistics")
-        return images_all_dct, {}, _cache, is_meta_changed
+        return images_all_dct, {}, _cache, meta_diff
 
     num_updated = sum(len(lst) for lst in updated_images.values())
+    if 0 < num_updated <= len(images_all) * g.ANNOTATIONS_CHECK_MAX_SHARE and len(annotations) > 0:
+        updated_images, checked, skipped = skip_metadata_only_changes(updated_images, annotations)
+        _cache["last_run"] = {"annotations_checked": checked, "metadata_only_skipped": skipped}
+        if skipped > 0:
+            sly.logger.log(
+                g._INFO,
+                f"{skipped} of {checked} checked images have only metadata changes and will not be recalculated",
+            )
+        num_updated = sum(len(lst) for lst in updated_images.values())
+
     if num_updated == getattr(project, "items_count", 0):
         sly.logger.log(g._INFO, f"Full dataset statistics will be calculated.")
     elif num_updated > 0:
         sly.logger.log(g._INFO, f"The changes in {num_updated} images detected")
 
-    return updated_images, updated_classes, _cache, is_meta_changed
+    return updated_images, updated_classes, _cache, meta_diff
+
+
+def get_annotation_fingerprint(image: ImageInfo, figs: List[FigureInfo]) -> int:
+    """One hash of everything the stats read from the image, see `get_image_fingerprint`."""
+    return _hash(get_image_fingerprint(image, figs))
+
+
+@sly.timeit
+def skip_metadata_only_changes(
+    updated_images: Dict[int, ImageTable], annotations: Dict[int, int]
+) -> Tuple[Dict[int, ImageTable], int, int]:
+    """Drops the updated images whose annotation fingerprint is the same as the cached one
+    (f.e. only the description was edited). Returns the rest, the checked and skipped counts.
+    """
+    result, checked, skipped = {}, 0, 0
+    for dataset_id, images in updated_images.items():
+        keep = np.ones(len(images), dtype=bool)
+        known_idxs = np.array(
+            [idx for idx, image_id in enumerate(images.ids.tolist()) if image_id in annotations],
+            dtype=np.int64,
+        )
+        batch_size = governor.batch_size(100)
+        for group_start in range(0, len(known_idxs), g.CHUNK_SIZE):
+            group_idxs = known_idxs[group_start : group_start + g.CHUNK_SIZE]
+            group_infos = infos_by_ids(g.api, dataset_id, images.ids[group_idxs].tolist())
+            unchanged = set()
+            for start in range(0, len(group_infos), batch_size):
+                batch_infos = group_infos[start : start + batch_size]
+                labeled_ids = [x.id for x in batch_infos if x.labels_count > 0]
+                figures = {}
+                if len(labeled_ids) > 0:
+                    figures = g.api.image.figure.download(dataset_id, labeled_ids, skip_geometry=True)
+                unchanged.update(
+                    image.id
+                    for image in batch_infos
+                    if get_annotation_fingerprint(image, figures.get(image.id, [])) == annotations[image.id]
+                )
+            keep[group_idxs] = [image_id not in unchanged for image_id in images.ids[group_idxs].tolist()]
+            checked += len(group_idxs)
+        skipped += int((~keep).sum())
+        result[dataset_id] = images[keep]
+    return result, checked, skipped
+
+
+def collect_annotation_fingerprints(project_fs_dir: str, chunks: Iterable[str]) -> Dict[int, int]:
+    """Reads the annotation fingerprints of the images from the saved chunk fingerprints."""
+    annotations = {}
+    for chunk in chunks:
+        path = get_fingerprints_path(project_fs_dir, chunk)
+        if not os.path.exists(path):
+            continue
+        with np.load(path) as npz:
+            rows = npz["fingerprints"].tolist()
+        for row in rows:
+            annotations[row[0]] = _hash(row[1:])
+    return annotations
 
 
 @sly.timeit
 def get_indexes_dct(
-    project_id: id, datasets: List[DatasetInfo], images_all_dct
-) -> Tuple[dict, dict]:
+    project_id: id, datasets: List[DatasetInfo], images_all_dct: Dict[int, ImageTable]
+) -> Tuple[Dict[str, ImageTable], Dict[int, np.ndarray]]:
+    """Returns the chunks (contiguous slices of the sorted dataset tables) and the sorted
+    image ids per dataset, which locate the chunk of an image with `get_chunks_of_images`.
+    """
     chunk_to_images, image_to_chunk = {}, {}
 
     for dataset in datasets:
         images_all = images_all_dct[dataset.id]
-        images_all = sorted(images_all, key=lambda x: x.id)
+        image_to_chunk[dataset.id] = images_all.ids
 
-        for idx, image_batch in enumerate(sly.batched(images_all, g.CHUNK_SIZE)):
+        for idx, image_batch in enumerate(images_all.batched(g.CHUNK_SIZE)):
             identifier = f"chunk_{idx}_{dataset.id}_{project_id}"
-            for image in image_batch:
-                image_to_chunk[image.id] = identifier
             chunk_to_images[identifier] = image_batch
 
     return chunk_to_images, image_to_chunk
 
 
+def get_chunks_of_images(
+    project_id: int, dataset_id: int, dataset_sorted_ids: np.ndarray, image_ids: np.ndarray
+) -> List[str]:
+    chunk_idxs = np.unique(np.searchsorted(dataset_sorted_ids, image_ids) // g.CHUNK_SIZE)
+    return [f"chunk_{idx}_{dataset_id}_{project_id}" for idx in chunk_idxs]
+
+
 @sly.timeit
 def check_idxs_integrity(
     project: ProjectInfo,
@@ -281,10 +542,16 @@ def check_idxs_integrity(
     updated_images,
     images_all_dct,
     force_stats_recalc,
+    partial: bool = False,
 ) -> list:
     if force_stats_recalc is True:
         return images_all_dct
 
+    if partial:
+        num_chunks = sum(math.ceil(d.items_count / g.CHUNK_SIZE) for d in datasets)
+    else:
+        num_chunks = len(idx_to_infos.keys())
+
     if sly.fs.dir_empty(projectfs_dir):
         sly.logger.log(g._WARNING, "The buffer is empty. Calculate full stats")
         if any(len(x) != d.items_count for x, d in zip(updated_images.values(), datasets)):
@@ -302,7 +569,7 @@ def check_idxs_integrity(
                     [".npy"],
                 )
 
-                if len(files) != len(idx_to_infos.keys()):
+                if len(files) != num_chunks:
                     msg = f"The number of images in the project has changed. Check chunks in Team Files: {projectfs_dir}/{stat.basename_stem}. Forcing recalculation..."
                     sly.logger.log(g._WARNING, msg)
                     return images_all_dct
@@ -329,8 +596,15 @@ def check_datasets_consistency(project_info, datasets, npy_paths, num_stats):
 
 @sly.timeit
 def remove_junk(team_id, tf_project_dir, project, datasets, project_fs_dir):
-    files_fs = list_files_recursively(project_fs_dir, valid_extensions=[".npy"])
-    ds_ids, rm_cnt = [str(dataset.id) for dataset in datasets], 0
+    """Moves the old or junk chunk files out of the buffer. The files themselves and the old
+    chunks archives in team files are removed in background by the garbage collector.
+    """
+    files_fs = [
+        path
+        for path in list_files_recursively(project_fs_dir, valid_extensions=[".npy"])
+        if "/_trash/" not in path and "/_checkpoint/" not in path
+    ]
+    ds_ids = [str(dataset.id) for dataset in datasets]
 
     grouped_paths = defaultdict(list)
     old_paths = []
@@ -346,34 +620,18 @@ def remove_junk(team_id, tf_project_dir, project, datasets, project_fs_dir):
             old_paths += [p for p in paths_list if newest_path != p]
             grouped_paths[constant_part] = [newest_path]
 
-    for path in old_paths:
-        os.remove(path)
-        rm_cnt += 1
-
+    junk_paths = set(old_paths)
     for path in files_fs:
         if (path.split("_")[-4] not in ds_ids) or (f"_{project.id}_{g.CHUNK_SIZE}_" not in path):
-            os.remove(path)
-            rm_cnt += 1
+            junk_paths.add(path)
 
+    rm_cnt = garbage_collector.discard_local(junk_paths, f"{project_fs_dir}/_trash")
     if rm_cnt > 0:
         sly.logger.log(
             g._INFO,
             f"The {rm_cnt} old or junk chunk files were detected and removed from the buffer",
         )
 
-    chunks_archive = [
-        f for f in g.api.file.listdir(team_id, tf_project_dir) if f.endswith(".tar.gz")
-    ]
-    if len(chunks_archive) > 1:
-        for chunks in chunks_archive:
-            tf_chunks_dt = ".".join(sly.fs.get_file_name(chunks).split(".")[:-1]).split("_")[-1]
-            if tf_chunks_dt != g.CHUNKS_LATEST_DATETIME.isoformat():
-                g.api.file.remove_file(team_id, chunks)
-                sly.logger.log(
-                    g._INFO,
-                    f"The {chunks} old or junk chunks archive was detected and removed from the team files.",
-                )
-
 
 @sly.timeit
 def download_stats_chunks_to_buffer(
@@ -412,6 +670,8 @@ def download_stats_chunks_to_buffer(
         )
         return True
 
+    from tqdm import tqdm
+
     with tqdm(
         desc="Downloading stats chunks to buffer",
         total=file.sizeb,
@@ -419,7 +679,8 @@ def download_stats_chunks_to_buffer(
         unit_scale=True,
     ) as pbar:
         try:
-            g.api.file.download(team_id, src_path, dst_path, progress_cb=pbar)
+            with garbage_collector.pinned(src_path):
+                g.api.file.download(team_id, src_path, dst_path, progress_cb=pbar)
         except:
             sly.logger.log(
                 g._WARNING, "The integrity of the team files is broken. Recalculating full stats."
@@ -442,58 +703,289 @@ def calculate_stats_and_save_chunks(
     image_to_chunk,
     project_stats: dict,
     project,
-) -> Dict[int, Set[ImageInfo]]:
+    checkpointer: Optional[Checkpointer] = None,
+    cancel_token: Optional[CancellationToken] = None,
+    update_chunks_datetime: bool = True,
+) -> Tuple[Dict[int, Set[int]], Dict[int, Set[int]], Set[str]]:
+    """Updates the stats with the images of every touched chunk and saves the chunks.
+
+    Only the stats depending on the changed inputs of a chunk are updated and saved (see
+    `get_dirty_kinds`). Returns the heatmaps sample and the names of the updated stats.
+    The shard workers do not update `g.CHUNKS_LATEST_DATETIME` (it belongs to the run
+    of this instance), they return the datetimes with the shard result instead.
+    """
     heatmaps_image_ids = defaultdict(set)
     heatmaps_figure_ids = defaultdict(set)
+    updated_stems = set()
+    skipped_downloads = 0
     total_updated = sum(len(lst) for lst in updated_images.values())
-    total_updated_figures = sum(x.labels_count for lst in updated_images.values() for x in lst)
+    total_updated_figures = int(sum(t.labels_count.sum() for t in updated_images.values()))
     sly.logger.log(g._INFO, f"Start calculating stats for {total_updated} images.")
+    from tqdm import tqdm
+
     with tqdm(desc="Calculating stats", total=total_updated) as pbar:
 
         for dataset_id, images in updated_images.items():
-            updated_chunks = list(set([image_to_chunk[image.id] for image in images]))
+            if len(images) == 0:
+                continue
+            updated_chunks = get_chunks_of_images(
+                project.id, dataset_id, image_to_chunk[dataset_id], images.ids
+            )
 
             for chunk in updated_chunks:
                 images_chunk = chunk_to_images[chunk]
+                digest = images_chunk.digest()
+
+                if checkpointer is not None:
+                    latest_datetime = checkpointer.get_completed(chunk, digest)
+                    if latest_datetime is not None:
+                        if g.CHUNKS_LATEST_DATETIME is None or g.CHUNKS_LATEST_DATETIME < latest_datetime:
+                            g.CHUNKS_LATEST_DATETIME = latest_datetime
+                        pbar.update(len(images_chunk))
+                        continue
+
+                batches = []
+                chunk_infos = infos_by_ids(g.api, dataset_id, images_chunk.ids.tolist())
+                batch_size = governor.batch_size(100)
+                for start in range(0, len(chunk_infos), batch_size):
+                    if cancel_token is not None and cancel_token.is_cancelled:
+                        if checkpointer is not None:
+                            checkpointer.flush()
+                        cancel_token.raise_if_cancelled()
+                    batch_infos = chunk_infos[start : start + batch_size]
+                    labeled_ids = [x.id for x in batch_infos if x.labels_count > 0]
+                    figures = {}
+                    if len(labeled_ids) > 0:
+                        figures = g.api.image.figure.download(
+                            dataset_id, labeled_ids, skip_geometry=True
+                        )
+                    skipped_downloads += len(batch_infos) - len(labeled_ids)
+                    batches.append((batch_infos, figures))
+                    pbar.update(len(batch_infos))
 
-                for batch_infos in sly.batched(images_chunk, 100):
-                    batch_ids = [x.id for x in batch_infos]
-                    figures = g.api.image.figure.download(dataset_id, batch_ids, skip_geometry=True)
+                fingerprints = get_chunk_fingerprints(batches)
+                dirty_kinds = get_dirty_kinds(project_fs_dir, chunk, fingerprints)
+                chunk_stats = [
+                    stat
+                    for stat in stats
+                    if is_stat_dirty(stat, project_fs_dir, chunk, dirty_kinds)
+                ]
+                is_heatmaps_dirty = len(HEATMAPS_DEPENDENCIES & dirty_kinds) > 0
+                sly.logger.log(
+                    g._DEBUG,
+                    f"Chunk {chunk!r}: changed inputs {sorted(dirty_kinds)}, {len(chunk_stats)} stats to update",
+                )
+
+                # without the verified internals every image goes through `update2` in id order
+                split_unlabeled = has_verified_internals()
+                unlabeled = []
+                for batch_infos, figures in batches:
+                    labeled = []
                     for image in batch_infos:
                         figs = figures.get(image.id, [])
-                        for stat in stats:
-                            stat.update2(image, figs)
-                        _update_heatmaps_sample(
-                            heatmaps_figure_ids,
-                            heatmaps_image_ids,
-                            figs,
-                            total_updated_figures,
-                            project_stats["objects"]["total"]["objectsInDataset"],
-                            project.size,
-                        )
-
-                    pbar.update(len(batch_infos))
+                        if len(figs) == 0 and split_unlabeled:
+                            unlabeled.append(image)
+                            continue
+                        labeled.append(image)
+                        if is_heatmaps_dirty and len(figs) > 0:
+                            _update_heatmaps_sample(
+                                heatmaps_figure_ids,
+                                heatmaps_image_ids,
+                                figs,
+                                total_updated_figures,
+                                project_stats["objects"]["total"]["objectsInDataset"],
+                                project.size,
+                            )
+                    update_stats_with_batch(chunk_stats, labeled, figures)
+                update_stats_with_unlabeled(chunk_stats, unlabeled)
 
                 latest_datetime = get_latest_datetime(images_chunk)
-                if g.CHUNKS_LATEST_DATETIME is None or g.CHUNKS_LATEST_DATETIME < latest_datetime:
+                if update_chunks_datetime and (
+                    g.CHUNKS_LATEST_DATETIME is None or g.CHUNKS_LATEST_DATETIME < latest_datetime
+                ):
                     g.CHUNKS_LATEST_DATETIME = latest_datetime
-                for stat in stats:
-                    save_chunks(stat, chunk, project_fs_dir, tf_all_paths, latest_datetime)
+                saved_paths = [save_fingerprints(project_fs_dir, chunk, fingerprints)]
+                for stat in chunk_stats:
+                    path = save_chunks(stat, chunk, project_fs_dir, tf_all_paths, latest_datetime)
+                    saved_paths.append(path)
+                    updated_stems.add(stat.basename_stem)
                     stat.clean()
+                if checkpointer is not None:
+                    checkpointer.add(chunk, digest, latest_datetime, saved_paths)
 
         # if pbar.last_print_n < pbar.total:  # unlabeled images
         #     pbar.update(pbar.total - pbar.n)
 
-    return heatmaps_image_ids, heatmaps_figure_ids
+    if skipped_downloads > 0:
+        sly.logger.log(g._INFO, f"Figures of {skipped_downloads} unlabeled images were not requested")
+    skipped = [stat.basename_stem for stat in stats if stat.basename_stem not in updated_stems]
+    if len(skipped) > 0:
+        sly.logger.log(g._INFO, f"The inputs of {len(skipped)} stats were not changed: {skipped}")
+    return heatmaps_image_ids, heatmaps_figure_ids, updated_stems
+
+
+# these stats ignore the images without figures (`update2` returns immediately)
+FIGURES_ONLY_STATS = {
+    "ClassBalance",
+    "ClassCooccurrence",
+    "ObjectSizes",
+    "ClassSizes",
+    "ClassesTreemap",
+    "TagsObjectsCooccurrence",
+    "ClassToTagCooccurrence",
+    "TagsObjectsOneOfDistribution",
+}
+
+
+def update_stats_with_unlabeled(stats: List["BaseStats"], images: List[ImageInfo]):
+    """Adds the images without figures of a chunk (sorted by id) to the stats at once, the
+    same way as `stat.update2(image, [])` for every image would do. Writes the private
+    state of the stats, so it requires `has_verified_internals`.
+    """
+    if len(images) == 0:
+        return
+    image_ids = [image.id for image in images]
+    for stat in stats:
+        name = type(stat).__name__
+        if name in FIGURES_ONLY_STATS:
+            continue
+        if name == "ObjectsDistribution":
+            for class_id in stat._class_ids:
+                stat._distribution_dict[class_id][0].update(image_ids)
+        elif name == "ClassesPerImage":
+            class_ids = list(stat._class_ids)
+            rows = [
+                (
+                    image.id,
+                    {
+                        "image": image.name,
+                        "dataset": stat._splits[image.dataset_id],
+                        "height": image.height,
+                        "width": image.width,
+                        "classes": {class_id: [0, 0] for class_id in class_ids},
+                    },
+                )
+                for image in images
+            ]
+            # the rows of the labeled images of the chunk are already there (in id order),
+            # merge them to keep the id order of `update2`
+            merged = heapq.merge(stat._data_dict.items(), rows, key=lambda row: row[0])
+            stat._data_dict = dict(merged)
+        elif name in ("TagsImagesCooccurrence", "TagsImagesOneOfDistribution"):
+            for image in images:
+                if len(image.tags) > 0:  # the untagged images are skipped by `update2`
+                    stat.update2(image, [])
+        else:
+            for image in images:
+                stat.update2(image, [])
+
+
+INPUT_KINDS = ("image", "classes", "geometry", "image_tags", "object_tags")
+
+# the inputs read by `update2` of every stat: "image" is the name, size and dataset of
+# the image, "classes" and "geometry" are the class and the area/bbox of its figures
+STAT_DEPENDENCIES = {
+    "ClassBalance": {"image", "classes", "geometry"},
+    "ClassCooccurrence": {"classes"},
+    "ClassesPerImage": {"image", "classes", "geometry"},
+    "ObjectsDistribution": {"classes"},
+    "ObjectSizes": {"image", "classes", "geometry"},
+    "ClassSizes": {"image", "classes", "geometry"},
+    "ClassesTreemap": {"image", "classes", "geometry"},
+    "TagsImagesCooccurrence": {"image_tags"},
+    "TagsObjectsCooccurrence": {"object_tags"},
+    "ClassToTagCooccurrence": {"classes", "object_tags"},
+    "TagsImagesOneOfDistribution": {"image_tags"},
+    "TagsObjectsOneOfDistribution": {"object_tags"},
+}
+HEATMAPS_DEPENDENCIES = {"image", "classes", "geometry"}
+
+
+def _hash(value) -> int:
+    digest = hashlib.blake2b(ujson.dumps(value).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def get_image_fingerprint(image: ImageInfo, figs: List[FigureInfo]) -> List[int]:
+    """Hashes of every input kind of the image, in the order of `INPUT_KINDS`."""
+    figs = sorted(figs, key=lambda x: x.id)
+    image_tags = sorted([tag["tagId"], str(tag.get("value"))] for tag in image.tags)
+    object_tags = [
+        [fig.id, sorted([tag["tagId"], str(tag.get("value"))] for tag in fig.tags)] for fig in figs
+    ]
+    return [
+        _hash([image.name, image.width, image.height, image.dataset_id]),
+        _hash([[fig.id, fig.class_id] for fig in figs]),
+        _hash([[fig.id, fig.geometry_type, fig.area, fig.geometry_meta] for fig in figs]),
+        _hash(image_tags),
+        _hash(object_tags),
+    ]
+
+
+def get_chunk_fingerprints(batches: List[Tuple[List[ImageInfo], Dict]]) -> np.ndarray:
+    """Returns the `(images, 1 + len(INPUT_KINDS))` array: the image id and its fingerprint."""
+    rows = []
+    for batch_infos, figures in batches:
+        for image in batch_infos:
+            rows.append([image.id] + get_image_fingerprint(image, figures.get(image.id, [])))
+    return np.array(rows, dtype=np.int64).reshape(len(rows), 1 + len(INPUT_KINDS))
+
+
+def get_fingerprints_path(project_fs_dir: str, chunk: str) -> str:
+    return f"{project_fs_dir}/_fingerprints/{chunk}_{g.CHUNK_SIZE}.npz"
+
+
+def save_fingerprints(project_fs_dir: str, chunk: str, fingerprints: np.ndarray) -> str:
+    path = get_fingerprints_path(project_fs_dir, chunk)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, fingerprints=fingerprints)
+    return path
+
+
+def get_dirty_kinds(project_fs_dir: str, chunk: str, fingerprints: np.ndarray) -> Set[str]:
+    """Compares the fingerprints with the ones saved with the previous chunk. All inputs are
+    dirty when the previous fingerprints are missing or the chunk consists of other images.
+    """
+    path = get_fingerprints_path(project_fs_dir, chunk)
+    if not os.path.exists(path):
+        return set(INPUT_KINDS)
+    with np.load(path) as npz:
+        previous = npz["fingerprints"]
+    if previous.shape != fingerprints.shape or not np.array_equal(previous[:, 0], fingerprints[:, 0]):
+        return set(INPUT_KINDS)
+    changed = (previous[:, 1:] != fingerprints[:, 1:]).any(axis=0)
+    return set(kind for kind, is_changed in zip(INPUT_KINDS, changed) if is_changed)
+
+
+def is_stat_dirty(stat: "BaseStats", project_fs_dir: str, chunk: str, dirty_kinds: Set[str]) -> bool:
+    if len(glob_chunk_files(project_fs_dir, stat.basename_stem, chunk)) == 0:
+        return True
+    dependencies = STAT_DEPENDENCIES.get(type(stat).__name__, set(INPUT_KINDS))
+    return len(dependencies & dirty_kinds) > 0
+
+
+def glob_chunk_files(project_fs_dir: str, stem: str, chunk: str) -> List[str]:
+    stat_dir = f"{project_fs_dir}/{stem}"
+    if not os.path.isdir(stat_dir):
+        return []
+    prefix = f"{chunk}_{g.CHUNK_SIZE}_"
+    return [f"{stat_dir}/{name}" for name in os.listdir(stat_dir) if name.startswith(prefix)]
+
+
+def get_applicable_stats(stats: List["BaseStats"]) -> List["BaseStats"]:
+    """Drops the tag stats that are not applicable to the project (f.e. it has no tags)."""
+    applicable = []
+    for stat in stats:
+        if hasattr(stat, "_tag_ids") and applicability_test(stat) is False:
+            sly.logger.log(g._DEBUG, f"The stat {stat.basename_stem!r} is not applicable. Skipping...")
+            continue
+        applicable.append(stat)
+    return applicable
 
 
 # @sly.timeit
-def get_latest_datetime(images_chunk):
-    datetime_objects = [
-        datetime.fromisoformat(timestamp[:-1])
-        for timestamp in [image.updated_at for image in images_chunk]
-    ]
-    return sorted(datetime_objects, reverse=True)[0]
+def get_latest_datetime(images_chunk: ImageTable):
+    return images_chunk.latest_updated_at()
 
 
 # @sly.timeit
@@ -513,15 +1005,14 @@ def save_chunks(stat, chunk, project_fs_dir, tf_all_paths, latest_datetime):
                 if chunk in path:
                     os.remove(path)
 
-    np.save(
-        f"{savedir}/{chunk}_{g.CHUNK_SIZE}_{latest_datetime.isoformat()}.npy",
-        stat.to_numpy_raw(),
-    )
+    path = f"{savedir}/{chunk}_{g.CHUNK_SIZE}_{latest_datetime.isoformat()}.npy"
+    np.save(path, stat.to_numpy_raw())
+    return path
 
 
 @sly.timeit
 def sew_chunks_to_json(
-    stats: List[BaseStats], project_fs_dir, updated_classes, is_meta_changed: bool
+    stats: List["BaseStats"], project_fs_dir, updated_classes, is_meta_changed: bool
 ):
     # @sly.timeit
     def _save_to_json(res, dst_path):
@@ -530,14 +1021,41 @@ def sew_chunks_to_json(
         with open(dst_path, "wb") as f:  # Use binary mode
             f.write(json_bytes)
 
+    def _save_to_json_streamed(res, dst_path):
+        rows_per_chunk = governor.batch_size(1000, "json_rows")
+        with open(dst_path, "w", encoding="utf-8") as f:
+            for piece in columnar.iter_json(res, rows_per_chunk):
+                f.write(piece)
+
     for stat in stats:
         stat.sew_chunks(chunks_dir=f"{project_fs_dir}/{stat.basename_stem}/")
         if sly.is_development():
             stat.to_image(f"{project_fs_dir}/{stat.basename_stem}.png", version2=True)
 
+        if hasattr(stat, "_tag_ids") and applicability_test(stat) is False:
+            sly.logger.log(g._DEBUG, f"The stat {stat.basename_stem!r} is not applicable. Skipping...")
+            continue
+
         res = stat.to_json2()
-        if res is not None:
-            _save_to_json(res, f"{project_fs_dir}/{stat.basename_stem}.json")
+        if res is None:
+            continue
+
+        dst_path = f"{project_fs_dir}/{stat.basename_stem}.json"
+        label_columns = columnar.get_label_columns_count(res)
+        cells = len(res["data"]) * len(res["columns"]) if label_columns is not None else 0
+        if cells >= g.COLUMNAR_MIN_CELLS:
+            columnar.save_columnar(res, f"{project_fs_dir}/{stat.basename_stem}.npz", label_columns)
+            _save_to_json_streamed(res, dst_path)
+        elif governor.should_spill() and isinstance(res.get("data"), list):
+            _save_to_json_streamed(res, dst_path)
+        else:
+            _save_to_json(res, dst_path)
+
+        if governor.sample() != "ok":
+            # release the sewed data before sewing the next stat
+            del res
+            stat.clean()
+            gc.collect()
 
 
 def _update_heatmaps_sample(
@@ -564,20 +1082,24 @@ def calculate_and_upload_heatmaps(
     team: TeamInfo,
     tf_project_dir: str,
     project_fs_dir: str,
-    heatmaps: dtools.ClassesHeatmaps,
+    heatmaps: "dtools.ClassesHeatmaps",
     heatmaps_image_ids: Dict[int, Set[int]],
     heatmaps_figure_ids: Dict[int, Set[int]],
 ):
     if len(heatmaps_image_ids) == 0:
+        # no figures changed, the uploaded heatmaps are up to date
+        add_heatmaps_status_ok(team, tf_project_dir, project_fs_dir)
         return
 
     sample_total = sum(len(lst) for lst in heatmaps_image_ids.values())
+    from tqdm import tqdm
+
     with tqdm(desc="Calculating heatmaps from sample", total=sample_total) as pbar:
 
         for dataset_id, image_ids in heatmaps_image_ids.items():
             image_infos = g.api.image.get_info_by_id_batch(list(image_ids))
 
-            for batch_infos in sly.batched(image_infos, 100):
+            for batch_infos in sly.batched(image_infos, governor.batch_size(100, "heatmaps")):
                 batch_ids = [x.id for x in batch_infos]
                 figures = g.api.image.figure.download(dataset_id, batch_ids)
 
@@ -611,10 +1133,11 @@ def add_heatmaps_status_ok(team, tf_project_dir, project_fs_dir):
 def archive_chunks_and_upload(
     team: TeamInfo,
     project: ProjectInfo,
-    stats: List[BaseStats],
+    stats: List["BaseStats"],
     tf_project_dir,
     project_fs_dir,
     datasets,
+    chunks_datetime: datetime,
 ):
     def _compress_folders(folders, archive_path) -> int:
         with tarfile.open(archive_path, "w:gz") as tar:
@@ -623,35 +1146,41 @@ def archive_chunks_and_upload(
         return sly.fs.get_file_size(archive_path)
 
     folders_to_compress = [f"{project_fs_dir}/{stat.basename_stem}" for stat in stats]
+    if os.path.isdir(f"{project_fs_dir}/_fingerprints"):
+        folders_to_compress.append(f"{project_fs_dir}/_fingerprints")
 
-    dt_identifier = g.CHUNKS_LATEST_DATETIME
-    archive_name = f"{project.id}_{project.name}_chunks_{dt_identifier.isoformat()}.tar.gz"
+    archive_name = f"{project.id}_{project.name}_chunks_{chunks_datetime.isoformat()}.tar.gz"
     src_path = f"{project_fs_dir}/{archive_name}"
     archive_sizeb = _compress_folders(folders_to_compress, src_path)
 
     dst_path = f"{tf_project_dir}/{archive_name}"
+    from tqdm import tqdm
+
     with tqdm(
         desc=f"Uploading '{archive_name}'",
         total=archive_sizeb,
         unit="B",
         unit_scale=True,
     ) as pbar:
-        g.api.file.upload(team.id, src_path, dst_path, progress_cb=pbar)
+        with garbage_collector.pinned(dst_path):
+            g.api.file.upload(team.id, src_path, dst_path, progress_cb=pbar)
 
-    remove_junk(team.id, tf_project_dir, project, datasets, project_fs_dir)
+    garbage_collector.sweep_archives(team.id, tf_project_dir, keep=archive_name)
+    garbage_collector.discard_local([src_path], f"{project_fs_dir}/_trash")
     sly.logger.log(g._INFO, f"The '{archive_name}' file was succesfully uploaded.")
 
 
 @sly.timeit
 def upload_sewed_stats(team_id, curr_projectfs_dir, curr_tf_project_dir):
-    remove_files_with_null(curr_projectfs_dir)
-    stats_paths = list_files(curr_projectfs_dir, valid_extensions=[".json"])
+    stats_paths = list_files(curr_projectfs_dir, valid_extensions=[".json", ".npz"])
     dst_json_paths = [
         f"{curr_tf_project_dir}/{get_file_name_with_ext(path)}" for path in stats_paths
     ]
 
+    from tqdm import tqdm
+
     with tqdm(
-        desc="Uploading .json stats",
+        desc="Uploading .json and .npz stats",
         total=sum([get_file_size(path) for path in stats_paths]),
         unit="B",
         unit_scale=True,
@@ -662,31 +1191,46 @@ def upload_sewed_stats(team_id, curr_projectfs_dir, curr_tf_project_dir):
             pass
 
     sly.logger.log(
-        g._INFO, f"{len(stats_paths)} updated .json and .png stats succesfully updated and uploaded"
+        g._INFO, f"{len(stats_paths)} updated .json and .npz stats succesfully updated and uploaded"
     )
 
 
-def remove_files_with_null(directory_path: str):
-    for filename in os.listdir(directory_path):
-        if filename.endswith(".json"):
-            file_path = os.path.join(directory_path, filename)
-
-            with open(file_path, "r") as file:
-                try:
-                    json_data = json.load(file)
-                    if json_data is None:
-                        os.remove(file_path)
-                        print(f"Removed {filename} as it contains null values.")
-                except json.JSONDecodeError:
-                    print(f"Error decoding JSON in {filename}.")
-
-
 def applicability_test(stat):
     if len(stat._tag_ids) == 0:
         return False
     return True
 
 
+def get_project_meta(project_id: int) -> ProjectMeta:
+    json_project_meta = g.api.project.get_meta(project_id)
+    try:
+        return ProjectMeta.from_json(json_project_meta)
+    except Exception:
+        json_project_meta = handle_broken_project_meta(json_project_meta)
+        return ProjectMeta.from_json(json_project_meta)
+
+
+def create_stats(
+    project_meta: ProjectMeta, project_stats: dict, datasets: List[DatasetInfo]
+) -> List["BaseStats"]:
+    import dataset_tools as dtools
+
+    return [
+        dtools.ClassBalance(project_meta, project_stats),
+        dtools.ClassCooccurrence(project_meta),
+        dtools.ClassesPerImage(project_meta, project_stats, datasets),
+        dtools.ObjectsDistribution(project_meta),
+        dtools.ObjectSizes(project_meta, project_stats),
+        dtools.ClassSizes(project_meta),
+        dtools.ClassesTreemap(project_meta),
+        dtools.TagsImagesCooccurrence(project_meta),
+        dtools.TagsObjectsCooccurrence(project_meta),
+        dtools.ClassToTagCooccurrence(project_meta),
+        dtools.TagsImagesOneOfDistribution(project_meta),
+        dtools.TagsObjectsOneOfDistribution(project_meta),
+    ]
+
+
 def handle_broken_project_meta(json_project_meta: dict) -> dict:
     for idx, cls in enumerate(json_project_meta["classes"]):
         # if _validate_hex_color(cls["color"]) is False:
@@ -706,21 +1250,145 @@ def handle_broken_project_meta(json_project_meta: dict) -> dict:
     return json_project_meta
 
 
+class MetaDiff(NamedTuple):
+    """Differences between the cached and the actual project meta, keyed by sly ids."""
+
+    classes_added: Dict[int, str]
+    classes_removed: Dict[int, str]
+    classes_renamed: Dict[int, Tuple[str, str]]  # id -> (old name, new name)
+    classes_modified: Set[int]  # any other change (color, shape, etc.)
+    tags_added: Dict[int, str]
+    tags_removed: Dict[int, str]
+    tags_values_changed: Dict[int, Optional[List[str]]]  # id -> actual possible values
+    tags_modified: Set[int]
+
+    def __bool__(self) -> bool:
+        return any(len(field) > 0 for field in self)
+
+
+def get_meta_fingerprints(project_meta: ProjectMeta) -> Tuple[Dict, Dict]:
+    """Returns stable fingerprints `{id: (name, hash)}` for every class and tag meta."""
+
+    def _fingerprint(item) -> Tuple[str, str]:
+        dump = json.dumps(item.to_json(), sort_keys=True)
+        return item.name, hashlib.md5(dump.encode()).hexdigest()
+
+    classes = {(x.sly_id or x.name): _fingerprint(x) for x in project_meta.obj_classes}
+    tags = {(x.sly_id or x.name): _fingerprint(x) for x in project_meta.tag_metas}
+    return classes, tags
+
+
+def diff_metas(
+    project_meta: ProjectMeta, _project_meta_cached: Optional[ProjectMeta]
+) -> MetaDiff:
+    diff = MetaDiff({}, {}, {}, set(), {}, {}, {}, set())
+    if _project_meta_cached is None:
+        return diff
+
+    actual_classes, actual_tags = get_meta_fingerprints(project_meta)
+    cached_classes, cached_tags = get_meta_fingerprints(_project_meta_cached)
+
+    for key, (name, fingerprint) in actual_classes.items():
+        cached = cached_classes.get(key)
+        if cached is None:
+            diff.classes_added[key] = name
+        elif cached[1] != fingerprint:
+            if cached[0] != name:
+                diff.classes_renamed[key] = (cached[0], name)
+            diff.classes_modified.add(key)
+    for key, (name, _) in cached_classes.items():
+        if key not in actual_classes:
+            diff.classes_removed[key] = name
+
+    for key, (name, fingerprint) in actual_tags.items():
+        cached = cached_tags.get(key)
+        if cached is None:
+            diff.tags_added[key] = name
+        elif cached[1] != fingerprint:
+            diff.tags_modified.add(key)
+            new_values = project_meta.get_tag_meta(name).possible_values
+            old_values = _project_meta_cached.get_tag_meta(cached[0]).possible_values
+            if new_values != old_values:
+                diff.tags_values_changed[key] = new_values
+    for key, (name, _) in cached_tags.items():
+        if key not in actual_tags:
+            diff.tags_removed[key] = name
+
+    if diff:
+        sly.logger.log(
+            g._INFO,
+            f"Project meta changes: classes added={len(diff.classes_added)}, "
+            f"removed={len(diff.classes_removed)}, modified={len(diff.classes_modified)}; "
+            f"tags added={len(diff.tags_added)}, removed={len(diff.tags_removed)}, "
+            f"modified={len(diff.tags_modified)}",
+        )
+    return diff
+
+
+@sly.timeit
+def remap_chunks_by_meta_diff(stats: List["BaseStats"], project_fs_dir: str, meta_diff: MetaDiff):
+    """Applies class renames/removals and tag values changes to the chunks of the stats
+    keyed by names or values. The stats keyed by ids are remapped by `sew_chunks` itself.
+    """
+    import dataset_tools as dtools
+    from dataset_tools.image.stats.object_and_class_sizes import LiteAnnotation, LiteLabel
+
+    renamed = {old: new for old, new in meta_diff.classes_renamed.values()}
+    removed = set(meta_diff.classes_removed.values())
+
+    def _remap_objects(data):
+        rows, refs = data["data"], data["refs"]
+        keep = [idx for idx, row in enumerate(rows) if row[1] not in removed]
+        data["data"] = [rows[idx] for idx in keep]
+        if len(refs) == len(rows):
+            data["refs"] = [refs[idx] for idx in keep]
+        for row in data["data"]:
+            row[1] = renamed.get(row[1], row[1])
+        return data
+
+    def _remap_anns(data):
+        anns = []
+        for labels, img_size in data:
+            labels = [
+                LiteLabel(renamed.get(label[0], label[0]), *label[1:])
+                for label in labels
+                if label[0] not in removed
+            ]
+            anns.append(LiteAnnotation(labels, img_size))
+        return anns
+
+    def _remap_tag_values(data):
+        for tag_id, values in meta_diff.tags_values_changed.items():
+            if tag_id in data and values is not None:
+                data[tag_id] = {v: x for v, x in data[tag_id].items() if v in values}
+        return data
+
+    remap_funcs = {}
+    if len(renamed) > 0 or len(removed) > 0:
+        remap_funcs[dtools.ObjectSizes] = _remap_objects
+        remap_funcs[dtools.ClassSizes] = _remap_anns
+        remap_funcs[dtools.ClassesTreemap] = _remap_anns
+    if len(meta_diff.tags_values_changed) > 0:
+        remap_funcs[dtools.TagsImagesOneOfDistribution] = _remap_tag_values
+        remap_funcs[dtools.TagsObjectsOneOfDistribution] = _remap_tag_values
+
+    remapped = 0
+    for stat in stats:
+        func = remap_funcs.get(type(stat))
+        if func is None:
+            continue
+        for path in list_files(f"{project_fs_dir}/{stat.basename_stem}", [".npy"]):
+            data = np.load(path, allow_pickle=True).tolist()
+            if data is None:
+                continue
+            np.save(path, np.array(func(data), dtype=object))
+            remapped += 1
+
+    if remapped > 0:
+        sly.logger.log(g._INFO, f"{remapped} chunk files were remapped to the actual project meta.")
+
+
 def compare_metas(
     project_meta: ProjectMeta, _project_meta_cached: Union[ProjectMeta, dict]
 ) -> bool:
-    if _project_meta_cached is None:
-        return False
-    for tag_meta in project_meta.tag_metas:
-        if tag_meta not in _project_meta_cached.tag_metas:
-            return True
-    for tag_meta in _project_meta_cached.tag_metas:
-        if tag_meta not in project_meta.tag_metas:
-            return True
-    for class_meta in project_meta.obj_classes:
-        if class_meta not in _project_meta_cached.obj_classes:
-            return True
-    for class_meta in _project_meta_cached.obj_classes:
-        if class_meta not in project_meta.obj_classes:
-            return True
-    return False
+    return bool(diff_metas(project_meta, _project_meta_cached))
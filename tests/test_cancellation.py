@@ -0,0 +1,76 @@
+import threading
+
+from src import cancellation
+from src.cancellation import finish_run, start_run
+
+
+def test_finished_run_is_forgotten():
+    token = start_run(1)
+    finish_run(token)
+
+    assert 1 not in cancellation._tokens
+    assert not token.is_cancelled
+
+
+def test_newer_request_cancels_the_run():
+    first = start_run(2)
+    second = start_run(2)
+    finish_run(first)
+
+    assert first.is_cancelled
+    assert cancellation._tokens[2] is second  # the cancelled run does not drop the newer token
+    finish_run(second)
+    assert 2 not in cancellation._tokens
+
+
+def test_background_run_skips_the_run_in_flight():
+    token = start_run(3)
+
+    assert start_run(3, on_busy="skip") is None
+    assert not token.is_cancelled
+    finish_run(token)
+
+
+def test_background_run_waits_for_the_run_in_flight():
+    token = start_run(4)
+    started = []
+    thread = threading.Thread(target=lambda: started.append(start_run(4, on_busy="wait")))
+    thread.start()
+
+    thread.join(0.1)
+    assert started == [] and not token.is_cancelled
+
+    finish_run(token)
+    thread.join(1)
+    assert len(started) == 1 and cancellation._tokens[4] is started[0]
+    finish_run(started[0])
+
+
+def test_request_for_the_same_state_does_not_cancel_the_run():
+    token = start_run(5, state="a")
+
+    assert start_run(5, state="a") is None
+    assert not token.is_cancelled
+
+    newer = start_run(5, state="b")
+    assert token.is_cancelled
+    finish_run(token)
+    finish_run(newer)
+    assert 5 not in cancellation._tokens
+
+
+def test_contention_is_counted():
+    before = cancellation.get_report()
+    first = start_run(6, state="a")
+    assert start_run(6, state="a") is None
+    assert start_run(6, on_busy="skip") is None
+    second = start_run(6, state="b")
+    finish_run(first)
+    finish_run(second)
+    cancellation.record("lock_wait_seconds", 0.5)
+
+    after = cancellation.get_report()
+    assert after["cancelled"] - before["cancelled"] == 1
+    assert after["same_state"] - before["same_state"] == 1
+    assert after["skipped"] - before["skipped"] == 1
+    assert after["lock_wait_seconds"] - before["lock_wait_seconds"] == 0.5
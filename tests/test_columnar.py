@@ -0,0 +1,39 @@
+import ujson
+
+from src import columnar
+
+
+def _round_trip(res, tmp_path, rows_per_chunk=2):
+    label_columns = columnar.get_label_columns_count(res)
+    assert label_columns is not None
+    path = str(tmp_path / "stat.npz")
+    columnar.save_columnar(res, path, label_columns)
+    return "".join(columnar.iter_json_from_columnar(path, rows_per_chunk))
+
+
+def test_mixed_table_is_rendered_to_the_same_json(tmp_path):
+    res = {
+        "options": {"sort": None, "decimals": 2},
+        "columns": ["Image", "Dataset", "Size", "Area %", "Objects"],
+        "data": [
+            [{"name": "a.jpg", "id": 1}, "ds", 10, 1.5, None],
+            [{"name": "b.jpg", "id": 2}, None, 2**62, 0.0, 3],
+            ["c.jpg", "ds", -1, 1e-300, 0],
+        ],
+        "referencesRow": {"1": [1]},
+    }
+
+    assert _round_trip(res, tmp_path) == ujson.dumps(res)
+
+
+def test_int_table_is_rendered_to_the_same_json(tmp_path):
+    res = {"columns": ["Class", "cat", "dog"], "data": [["cat", 1, 0], ["dog", 0, 2], [None, 5, 6]]}
+
+    assert _round_trip(res, tmp_path, rows_per_chunk=1) == ujson.dumps(res)
+
+
+def test_bool_values_are_labels():
+    res = {"columns": ["Class", "Count", "Visible"], "data": [["cat", 1, True]]}
+
+    assert columnar.get_label_columns_count(res) is None
+    assert columnar.get_label_columns_count({"columns": ["Visible", "Count"], "data": [[True, 1]]}) == 1
@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import pytest
+
+import src.features as features
+import src.globals as g
+import src.utils as u
+from src.features import update_stats_with_batch
+from src.load_test import FakeApi
+from src.utils import update_stats_with_unlabeled
+
+
+class ClassesPerImage:
+    def __init__(self):
+        self._class_ids = [10, 20]
+        self._splits = {1: "train"}
+        self._data_dict = {}
+
+    def update2(self, image, figures):
+        raise AssertionError("the vectorized updater is expected")
+
+
+def _image(image_id):
+    return SimpleNamespace(id=image_id, name=f"{image_id}.jpg", dataset_id=1, width=10, height=10, tags=[])
+
+
+def test_classes_per_image_rows_keep_the_id_order(monkeypatch):
+    monkeypatch.setattr(features, "has_verified_internals", lambda: True)
+    stat = ClassesPerImage()
+    labeled = [_image(1), _image(4)]
+    figures = {
+        1: [SimpleNamespace(id=100, class_id=10, area=50)],
+        4: [SimpleNamespace(id=101, class_id=20, area=10), SimpleNamespace(id=102, class_id=20, area=10)],
+    }
+
+    update_stats_with_batch([stat], labeled, figures)
+    update_stats_with_unlabeled([stat], [_image(2), _image(3), _image(5)])
+
+    assert list(stat._data_dict.keys()) == [1, 2, 3, 4, 5]
+    assert stat._data_dict[1]["classes"] == {10: [1, 50.0], 20: [0, 0]}
+    assert stat._data_dict[3]["classes"] == {10: [0, 0], 20: [0, 0]}
+    assert stat._data_dict[4]["classes"] == {10: [0, 0], 20: [2, 20.0]}
+
+
+def test_unverified_dataset_tools_falls_back_to_update2(monkeypatch):
+    monkeypatch.setattr(features, "has_verified_internals", lambda: False)
+    calls = []
+    stat = ClassesPerImage()
+    stat.update2 = lambda image, figures: calls.append(image.id)
+
+    update_stats_with_batch([stat], [_image(1), _image(2)], {})
+
+    assert calls == [1, 2]
+
+
+def test_figures_of_unknown_classes_go_to_update2(monkeypatch):
+    monkeypatch.setattr(features, "has_verified_internals", lambda: True)
+    stat = ClassesPerImage()
+    stat.update2 = lambda image, figures: (_ for _ in ()).throw(KeyError(figures[0].class_id))
+
+    with pytest.raises(KeyError):
+        update_stats_with_batch([stat], [_image(1)], {1: [SimpleNamespace(id=100, class_id=30, area=5)]})
+
+
+def test_vectorized_stats_are_equal_to_update2(monkeypatch, tmp_path):
+    dtools = pytest.importorskip("dataset_tools")
+    if dtools.__version__ not in features.VERIFIED_DTOOLS_VERSIONS:
+        pytest.skip(f"dataset-tools {dtools.__version__} is not verified")
+    api = FakeApi(str(tmp_path), projects=1, images=300, classes=3, latency=0)
+    # not setattr: reading the current value would create the real API client
+    monkeypatch.setitem(vars(g), "api", api)
+    project_id = api.project_ids[0]
+    project_meta = u.get_project_meta(project_id)
+    project_stats = api.project.get_stats(project_id)
+    datasets = api.dataset.get_list(project_id)
+
+    def calculate(verified: bool):
+        monkeypatch.setattr(features, "has_verified_internals", lambda: verified)
+        stats = [
+            stat
+            for stat in u.create_stats(project_meta, project_stats, datasets)
+            if type(stat).__name__ in features.VECTORIZED_UPDATERS
+        ]
+        for dataset in datasets:
+            infos = api.image.get_list(dataset.id)
+            figures = api.image.figure.download(dataset.id, [x.id for x in infos])
+            labeled = [x for x in infos if len(figures.get(x.id, [])) > 0 or not verified]
+            update_stats_with_batch(stats, labeled, figures)
+            if verified:
+                update_stats_with_unlabeled(stats, [x for x in infos if len(figures.get(x.id, [])) == 0])
+        return [stat.to_json2() for stat in stats]
+
+    assert _normalize(calculate(True)) == _normalize(calculate(False))
+
+
+def _normalize(value, references=False):
+    # the image references are built from sets, their order is arbitrary
+    if isinstance(value, dict):
+        return {k: _normalize(v, references or k.startswith("references")) for k, v in value.items()}
+    if isinstance(value, list):
+        if references and all(isinstance(v, int) for v in value):
+            return sorted(value)
+        return [_normalize(v, references) for v in value]
+    return value
@@ -0,0 +1,52 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import src.globals as g
+import src.utils as u
+from src.load_test import FakeFileApi
+
+
+PROJECT = SimpleNamespace(id=5, name="cats", team_id=1)
+TF_PROJECT_DIR = f"{g.TF_STATS_DIR}/5_cats"
+FINGERPRINT = {"updated_at": "2024-01-01T00:00:00Z", "dataset-tools": "0.1.4"}
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    api = SimpleNamespace(
+        file=FakeFileApi(str(tmp_path / "tf"), 0),
+        image=SimpleNamespace(get_list=lambda dataset_id, filters=None, limit=None: []),
+    )
+    # not setattr: reading the current value would create the real API client
+    monkeypatch.setitem(vars(g), "api", api)
+
+    src = tmp_path / "src"
+    src.write_text(json.dumps({"fingerprint": FINGERPRINT, "images_dt": "2024-01-01T00:00:00Z"}))
+    api.file.upload(1, str(src), f"{TF_PROJECT_DIR}/_cache/5_fingerprint.json")
+    for path in u.get_mandatory_paths(TF_PROJECT_DIR) + [f"{TF_PROJECT_DIR}/_cache/heatmaps/status_ok"]:
+        api.file.upload(1, str(src), path)
+    return api
+
+
+def _is_unchanged(tmp_path, fingerprint=FINGERPRINT):
+    datasets = [SimpleNamespace(id=1)]
+    return u.is_project_unchanged(1, PROJECT, TF_PROJECT_DIR, str(tmp_path / "fs"), datasets, fingerprint)
+
+
+def test_unchanged_project(api, tmp_path):
+    assert _is_unchanged(tmp_path)
+    assert not _is_unchanged(tmp_path, {**FINGERPRINT, "dataset-tools": "0.2.0"})
+
+
+def test_missing_heatmaps_status_is_a_change(api, tmp_path):
+    api.file.remove(1, f"{TF_PROJECT_DIR}/_cache/heatmaps/status_ok")
+
+    assert not _is_unchanged(tmp_path)
+
+
+def test_missing_mandatory_stat_is_a_change(api, tmp_path):
+    api.file.remove(1, u.get_mandatory_paths(TF_PROJECT_DIR)[0])
+
+    assert not _is_unchanged(tmp_path)
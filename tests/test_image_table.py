@@ -0,0 +1,39 @@
+from supervisely import ImageInfo
+
+from src.image_table import ImageTable, infos_by_ids
+from src.load_test import FakeApi
+
+
+def _info(image_id, updated_at="2024-01-01T00:00:00.000Z"):
+    fields = dict.fromkeys(ImageInfo._fields)
+    fields.update(id=image_id, dataset_id=1, labels_count=2, updated_at=updated_at)
+    return ImageInfo(**fields)
+
+
+def test_pages_build_a_sorted_numeric_table():
+    table = ImageTable.from_pages([[_info(3)], [_info(2), _info(1)]])
+
+    assert table.ids.tolist() == [1, 2, 3]
+    assert table.labels_count.tolist() == [2, 2, 2]
+    assert ImageTable.__slots__ == ("ids", "dataset_ids", "updated_at", "labels_count")
+
+
+def test_slices_and_cached_tables():
+    table = ImageTable.from_infos([_info(i) for i in range(5)])
+    cached = ImageTable.from_updated_at_dict({"1": "2024-01-01T00:00:00.000Z"})
+
+    assert table[1:3].ids.tolist() == [1, 2]
+    assert list(table.changed_mask(cached)) == [True, False, True, True, True]
+    assert cached.merge(table[3:]).ids.tolist() == [1, 3, 4]
+
+
+def test_infos_are_fetched_once_per_call(tmp_path):
+    api = FakeApi(str(tmp_path), projects=1, images=300, classes=2, latency=0)
+    dataset = api.dataset.get_list(api.project_ids[0])[0]
+    table = ImageTable.from_pages(api.image.get_list_generator(dataset.id))
+    api.calls.clear()
+
+    infos = infos_by_ids(api, dataset.id, table.ids[:50].tolist())
+
+    assert [x.id for x in infos] == table.ids[:50].tolist()
+    assert dict(api.calls) == {"image.get_list": 1}
@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+
+from src.postprocessing import PostProcessor
+
+
+def _fail():
+    raise RuntimeError("no space left")
+
+
+def test_failures_are_returned_once():
+    processor = PostProcessor(2, 10)
+    processor.submit(1, "heatmaps", _fail)
+    processor.submit(1, "chunks", lambda: None)
+
+    [failed] = processor.wait(1, timeout=5)
+    assert failed.name == "heatmaps"
+    assert processor.wait(1, timeout=5) == []
+
+    processor.submit(1, "heatmaps", _fail)
+    assert [task.name for task in processor.wait(1, timeout=5)] == ["heatmaps"]
+    assert len(processor.get_status(1)) == 3
+
+
+def test_timed_out_tasks_are_waited_again():
+    processor = PostProcessor(1, 10)
+    release = threading.Event()
+    processor.submit(1, "heatmaps", release.wait)
+
+    with pytest.raises(TimeoutError):
+        processor.wait(1, timeout=0.05)
+    release.set()
+    assert processor.wait(1, timeout=5) == []
+    assert processor._unwaited == {}
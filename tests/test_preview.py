@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+import src.globals as g
+import src.preview as preview
+from src.load_test import FakeApi
+
+
+class CountStat:
+    basename_stem = "images_count"
+
+    def __init__(self):
+        self.count = 0
+
+    def update2(self, image, figures):
+        self.count += 1
+
+    def to_json2(self):
+        return {"columns": ["Images"], "data": [[self.count]]}
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    monkeypatch.setattr(g, "STORAGE_DIR", str(tmp_path / "storage"))
+    monkeypatch.setattr(g, "CHUNK_SIZE", 10)
+    monkeypatch.setattr(preview.u, "create_stats", lambda *args: [CountStat()])
+    api = FakeApi(str(tmp_path / "tf"), projects=1, images=40, classes=2, latency=0)
+    # not setattr: reading the current value would create the real API client
+    monkeypatch.setitem(vars(g), "api", api)
+    return api
+
+
+def _project(api):
+    project = api.project.get_info_by_id(api.project_ids[0])
+    return project, api.team.get_info_by_id(project.team_id)
+
+
+def _read(api, project, tmp_path):
+    path = f"{g.TF_STATS_DIR}/{project.id}_{project.name}/images_count.json"
+    if not api.file.exists(project.team_id, path):
+        return None
+    api.file.download(project.team_id, path, str(tmp_path / "res.json"))
+    return json.loads((tmp_path / "res.json").read_text())
+
+
+def test_preview_marks_the_sample_counts(api, tmp_path):
+    project, team = _project(api)
+
+    sampled = preview.calculate_preview(team, project, 0.25)
+
+    res = _read(api, project, tmp_path)
+    assert res["data"] == [[sampled]]
+    assert res["approximate"]["counts"] == "sampled"
+    assert res["approximate"]["count_scale"] * sampled == pytest.approx(res["approximate"]["total_images"])
+    assert not api.file.exists(team.id, f"{g.TF_ACTIVE_REQUESTS_DIR}/{project.id}")
+
+
+def test_preview_is_not_uploaded_during_an_exact_run(api, tmp_path):
+    project, team = _project(api)
+    lock = tmp_path / "lock"
+    lock.write_text("")
+    api.file.upload(team.id, str(lock), f"{g.TF_ACTIVE_REQUESTS_DIR}/{project.id}")
+
+    preview.calculate_preview(team, project, 0.25)
+
+    assert _read(api, project, tmp_path) is None
+    assert api.file.exists(team.id, f"{g.TF_ACTIVE_REQUESTS_DIR}/{project.id}")
+    assert not os.path.exists(f"{g.STORAGE_DIR}/{project.id}_{project.name}_preview")
+
+
+def test_refinement_does_not_cancel_the_exact_run(api, monkeypatch):
+    project, team = _project(api)
+    monkeypatch.setattr(g, "PREVIEW_REFINEMENT_STEPS", 0)
+    calls = []
+
+    preview._refine(None, team, None, project, 0.25, lambda *args, **kwargs: calls.append(kwargs))
+
+    assert calls == [{"on_busy": "wait"}]
@@ -0,0 +1,59 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import src.globals as g
+from src.load_test import FakeFileApi
+from src.scheduler import count_stale_images
+
+
+PROJECT = SimpleNamespace(id=5, name="cats", team_id=1, items_count=30)
+DATASETS = [SimpleNamespace(id=1, items_count=10), SimpleNamespace(id=2, items_count=20)]
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    monkeypatch.setattr(g, "STORAGE_DIR", str(tmp_path / "storage"))
+    probes = []
+
+    def get_list(dataset_id, filters=None, limit=None):
+        probes.append((dataset_id, filters[0]["value"], limit))
+        return [SimpleNamespace(id=100)] if dataset_id == 2 else []
+
+    api = SimpleNamespace(
+        file=FakeFileApi(str(tmp_path / "tf"), 0),
+        project=SimpleNamespace(get_info_by_id=lambda project_id, raise_error=False: PROJECT),
+        dataset=SimpleNamespace(get_list=lambda project_id: DATASETS),
+        image=SimpleNamespace(get_list=get_list),
+        probes=probes,
+    )
+    # not setattr: reading the current value would create the real API client
+    monkeypatch.setitem(vars(g), "api", api)
+    return api
+
+
+def test_uploaded_fingerprint_is_used_after_restart(api, tmp_path):
+    src = tmp_path / "fingerprint.json"
+    src.write_text(json.dumps({"fingerprint": {}, "images_dt": "2024-01-01T00:00:00Z"}))
+    api.file.upload(1, str(src), f"{g.TF_STATS_DIR}/5_cats/_cache/5_fingerprint.json")
+
+    assert count_stale_images(PROJECT.id) == 20
+    assert api.probes == [(1, "2024-01-01T00:00:00Z", 1), (2, "2024-01-01T00:00:00Z", 1)]
+
+
+def test_local_fingerprint_is_preferred(api):
+    local_dir = f"{g.STORAGE_DIR}/5_cats/_cache"
+    os.makedirs(local_dir)
+    with open(f"{local_dir}/5_fingerprint.json", "w") as f:
+        json.dump({"fingerprint": {}, "images_dt": "2024-02-02T00:00:00Z"}, f)
+
+    assert count_stale_images(PROJECT.id) == 20
+    assert api.file.calls["download"] == 0
+    assert api.probes[0][1] == "2024-02-02T00:00:00Z"
+
+
+def test_never_calculated_project_is_fully_stale(api):
+    assert count_stale_images(PROJECT.id) == PROJECT.items_count
+    assert api.probes == []
@@ -0,0 +1,247 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import src.globals as g
+import src.sharding as sharding
+from src.image_table import ImageTable
+from src.load_test import FakeFileApi
+
+
+PROJECT_ID = 7
+DATASET_ID = 3
+
+
+def _table(ids, updated_at_us=None):
+    updated_at = updated_at_us or [1_700_000_000_000_000 + i for i in ids]
+    return ImageTable(ids, [DATASET_ID] * len(ids), updated_at, [1] * len(ids))
+
+
+def _publish(backend, shards=2):
+    backend.publish(
+        "job", {"project_id": PROJECT_ID}, {f"shard_{i}": {"chunks": {}} for i in range(shards)}
+    )
+
+
+def test_claim_returns_every_shard_once():
+    backend = sharding.InMemoryBackend()
+    _publish(backend)
+
+    first = backend.claim("job", "w1", lease=60)
+    second = backend.claim("job", "w2", lease=60)
+
+    assert {first[0], second[0]} == {"shard_0", "shard_1"}
+    assert first[2] == {"project_id": PROJECT_ID}
+    assert backend.claim("job", "w3", lease=60) is None
+    assert backend.claim("missing", "w3", lease=60) is None
+
+
+def test_expired_lease_is_stolen():
+    backend = sharding.InMemoryBackend()
+    _publish(backend, shards=1)
+
+    shard_id, _, _ = backend.claim("job", "w1", lease=-1)
+    stolen = backend.claim("job", "w2", lease=60)
+
+    assert stolen[0] == shard_id
+    assert stolen[1]["attempts"] == 2
+    assert backend.renew("job", shard_id, "w1", lease=60) is False
+    assert backend.renew("job", shard_id, "w2", lease=60) is True
+
+
+def test_failed_shard_is_retried_until_max_attempts():
+    backend = sharding.InMemoryBackend()
+    _publish(backend, shards=1)
+
+    shard_id, _, _ = backend.claim("job", "w1", lease=60)
+    backend.fail("job", shard_id, "w2", "not the owner", max_attempts=2)
+    assert backend.get_state("job")["shards"][shard_id]["status"] == "running"
+
+    backend.fail("job", shard_id, "w1", "boom", max_attempts=2)
+    assert backend.get_state("job")["shards"][shard_id]["status"] == "pending"
+
+    backend.claim("job", "w2", lease=60)
+    backend.fail("job", shard_id, "w2", "boom again", max_attempts=2)
+    shard = backend.get_state("job")["shards"][shard_id]
+    assert shard["status"] == "failed"
+    assert shard["error"] == "boom again"
+    assert backend.claim("job", "w3", lease=60) is None
+
+
+def test_first_result_wins():
+    backend = sharding.InMemoryBackend()
+    _publish(backend, shards=1)
+
+    shard_id, _, _ = backend.claim("job", "w1", lease=-1)
+    backend.claim("job", "w2", lease=60)
+    backend.complete("job", shard_id, "w2", {"files": ["a"]})
+    backend.complete("job", shard_id, "w1", {"files": ["b"]})
+
+    shard = backend.get_state("job")["shards"][shard_id]
+    assert shard["status"] == "done"
+    assert shard["result"] == {"files": ["a"]}
+
+
+def test_split_into_shards_groups_updated_chunks(monkeypatch):
+    monkeypatch.setattr(g, "CHUNK_SIZE", 2)
+    table = _table(list(range(1, 10)))
+    chunk_to_images = {
+        f"chunk_{idx}_{DATASET_ID}_{PROJECT_ID}": batch for idx, batch in enumerate(table.batched(2))
+    }
+    updated = {DATASET_ID: table[np.array([0, 2, 4, 8])]}  # chunks 0, 1, 2, 4
+
+    shards = sharding.split_into_shards(
+        PROJECT_ID, updated, chunk_to_images, {DATASET_ID: table.ids}, shard_size=3
+    )
+
+    assert list(shards.keys()) == ["shard_0", "shard_1"]
+    assert list(shards["shard_0"]["chunks"].keys()) == [
+        f"chunk_{idx}_{DATASET_ID}_{PROJECT_ID}" for idx in (0, 1, 2)
+    ]
+    chunk = f"chunk_4_{DATASET_ID}_{PROJECT_ID}"
+    assert shards["shard_1"]["chunks"] == {chunk: chunk_to_images[chunk].digest()}
+
+
+def test_calculate_sharded_merges_shard_results(monkeypatch, tmp_path):
+    monkeypatch.setattr(g, "CHUNK_SIZE", 2)
+    monkeypatch.setattr(g, "SHARD_SIZE", 1)
+    monkeypatch.setattr(g, "STORAGE_DIR", str(tmp_path / "storage"))
+    monkeypatch.setattr(g, "CHUNKS_LATEST_DATETIME", None)
+    table = _table([1, 2, 3, 4])
+    chunk_to_images = {
+        f"chunk_{idx}_{DATASET_ID}_{PROJECT_ID}": batch for idx, batch in enumerate(table.batched(2))
+    }
+
+    project_fs_dir = tmp_path / "project"
+    stale = project_fs_dir / "stat_a" / f"chunk_0_{DATASET_ID}_{PROJECT_ID}_2_2020-01-01T00:00:00.npy"
+    stale.parent.mkdir(parents=True)
+    np.save(stale, np.array([0]))
+
+    def fake_calculate(self, backend, job_id, shard_id, shard, meta, scratch_dir):
+        [(chunk, digest)] = shard["chunks"].items()
+        assert chunk_to_images[chunk].digest() == digest
+        latest = chunk_to_images[chunk].latest_updated_at()
+        path = f"{scratch_dir}/stat_a/{chunk}_2_{latest.isoformat()}.npy"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, np.array([int(chunk.split("_")[1])]))
+        refs = backend.put_artifacts(job_id, scratch_dir, [path])
+        return {
+            "files": refs,
+            "chunks": {chunk: {"dt": latest.isoformat(), "files": sharding._get_chunk_refs(refs, chunk)}},
+            "updated_stems": ["stat_a", f"stat_{shard_id}"],
+            "latest_datetime": latest.isoformat(),
+            "heatmaps_image_ids": {str(DATASET_ID): chunk_to_images[chunk].ids.tolist()},
+            "heatmaps_figure_ids": {"10": [int(chunk.split("_")[1])]},
+        }
+
+    monkeypatch.setattr(sharding.ShardWorker, "_calculate", fake_calculate)
+    monkeypatch.setattr(sharding.u, "get_meta_hash", lambda meta: "hash")
+    backend = sharding.InMemoryBackend()
+    checkpointed = {}
+    checkpointer = SimpleNamespace(
+        get_completed=lambda chunk, digest: None,
+        add=lambda chunk, digest, dt, paths: checkpointed.update({chunk: (digest, dt, paths)}),
+        flush=lambda: None,
+    )
+
+    image_ids, figure_ids, stems = sharding.calculate_sharded(
+        backend,
+        SimpleNamespace(id=1),
+        SimpleNamespace(id=PROJECT_ID),
+        None,
+        {DATASET_ID: table},
+        chunk_to_images,
+        {DATASET_ID: table.ids},
+        str(project_fs_dir),
+        checkpointer,
+    )
+
+    assert stems == {"stat_a", "stat_shard_0", "stat_shard_1"}
+    assert image_ids == {DATASET_ID: {1, 2, 3, 4}}
+    assert figure_ids == {10: {0, 1}}
+    assert g.CHUNKS_LATEST_DATETIME == table.latest_updated_at()
+    files = sorted(os.listdir(project_fs_dir / "stat_a"))
+    assert not stale.exists()
+    assert len(files) == 2
+    assert [int(np.load(project_fs_dir / "stat_a" / name)[0]) for name in files] == [0, 1]
+    assert backend.list_jobs() == []
+    assert sorted(checkpointed) == sorted(chunk_to_images)
+    for chunk, (digest, dt, paths) in checkpointed.items():
+        assert digest == chunk_to_images[chunk].digest()
+        assert dt == chunk_to_images[chunk].latest_updated_at()
+        assert [os.path.basename(path) for path in paths] == [f"{chunk}_2_{dt.isoformat()}.npy"]
+        assert all(os.path.exists(path) for path in paths)
+
+
+def test_chunk_refs_do_not_match_the_other_chunks():
+    refs = [
+        "stat_a/chunk_1_3_7_2_2024-01-01T00:00:00.npy",
+        "stat_a/chunk_11_3_7_2_2024-01-01T00:00:00.npy",
+        "_fingerprints/chunk_1_3_7_2.npz",
+        "_fingerprints/chunk_1_3_77_2.npz",
+    ]
+
+    assert sharding._get_chunk_refs(refs, "chunk_1_3_7") == [refs[0], refs[2]]
+
+
+def test_calculate_sharded_raises_on_failed_shards(monkeypatch, tmp_path):
+    monkeypatch.setattr(g, "CHUNK_SIZE", 2)
+    monkeypatch.setattr(g, "SHARD_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(g, "STORAGE_DIR", str(tmp_path / "storage"))
+    table = _table([1, 2])
+    chunk_to_images = {f"chunk_0_{DATASET_ID}_{PROJECT_ID}": table}
+    calls = []
+
+    def failing_calculate(self, *args):
+        calls.append(self.worker_id)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(sharding.ShardWorker, "_calculate", failing_calculate)
+    monkeypatch.setattr(sharding.u, "get_meta_hash", lambda meta: "hash")
+    backend = sharding.InMemoryBackend()
+
+    with pytest.raises(RuntimeError, match="boom"):
+        sharding.calculate_sharded(
+            backend,
+            SimpleNamespace(id=1),
+            SimpleNamespace(id=PROJECT_ID),
+            None,
+            {DATASET_ID: table},
+            chunk_to_images,
+            {DATASET_ID: table.ids},
+            str(tmp_path / "project"),
+        )
+    assert len(calls) == 2
+    assert backend.list_jobs() == []
+
+
+def test_team_files_lock_is_exclusive(monkeypatch, tmp_path):
+    monkeypatch.setattr(g, "STORAGE_DIR", str(tmp_path / "storage"))
+    # not setattr: reading the current value would create the real API client
+    monkeypatch.setitem(vars(g), "api", SimpleNamespace(file=FakeFileApi(str(tmp_path / "tf"), 0)))
+    monkeypatch.setattr(sharding.TeamFilesBackend, "LOCK_SETTLE", 0.05)
+    backend = sharding.TeamFilesBackend(1, "/stats/_shards")
+    inside, overlaps = [], []
+    guard = threading.Lock()
+
+    def worker():
+        with backend._lock("job"):
+            with guard:
+                inside.append(1)
+                if len(inside) > 1:
+                    overlaps.append(len(inside))
+            threading.Event().wait(0.05)
+            with guard:
+                inside.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == []
+    assert not g.api.file.exists(1, "/stats/_shards/job.lock")
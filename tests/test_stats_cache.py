@@ -0,0 +1,102 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import src.cancellation as cancellation
+import src.globals as g
+from src.load_test import FakeFileApi
+from src.stats_cache import StatsCache
+
+
+PROJECT = SimpleNamespace(id=5, name="cats", team_id=1)
+
+
+@pytest.fixture
+def file_api(monkeypatch, tmp_path):
+    monkeypatch.setattr(g, "STORAGE_DIR", str(tmp_path / "storage"))
+    file_api = FakeFileApi(str(tmp_path / "tf"), 0)
+    project_api = SimpleNamespace(get_info_by_id=lambda project_id: PROJECT if project_id == PROJECT.id else None)
+    # not setattr: reading the current value would create the real API client
+    monkeypatch.setitem(vars(g), "api", SimpleNamespace(file=file_api, project=project_api))
+    return file_api
+
+
+def _upload(file_api, tmp_path, filename, body: bytes):
+    src = tmp_path / filename
+    src.write_bytes(body)
+    file_api.upload(PROJECT.team_id, str(src), f"{g.TF_STATS_DIR}/5_cats/{filename}")
+
+
+def test_local_miss_is_downloaded_from_team_files(file_api, tmp_path):
+    _upload(file_api, tmp_path, "classes_balance.json", b'{"data": []}')
+    os.makedirs(f"{g.STORAGE_DIR}/5_cats")  # cleaned by the run, the stat is not there
+
+    cache = StatsCache(1024)
+    etag, body = cache.get(PROJECT.id, "classes_balance.json")
+
+    assert body == b'{"data": []}'
+    assert etag.startswith('"5-')
+    assert cache.get(PROJECT.id, "classes_balance.json") == (etag, body)
+    assert file_api.calls["download"] == 1
+    assert os.listdir(f"{g.STORAGE_DIR}/_stats_cache") == []
+
+
+def test_local_copy_is_preferred(file_api, tmp_path):
+    _upload(file_api, tmp_path, "classes_balance.json", b'{"remote": 1}')
+    os.makedirs(f"{g.STORAGE_DIR}/5_cats")
+    with open(f"{g.STORAGE_DIR}/5_cats/classes_balance.json", "wb") as f:
+        f.write(b'{"local": 1}')
+
+    _, body = StatsCache(1024).get(PROJECT.id, "classes_balance.json")
+
+    assert body == b'{"local": 1}'
+    assert file_api.calls["download"] == 0
+
+
+def test_missing_stat(file_api):
+    cache = StatsCache(1024)
+
+    assert cache.get(PROJECT.id, "classes_balance.json") is None
+    assert cache.get(404, "classes_balance.json") is None
+
+
+def _upload_cache(file_api, tmp_path, chunks_dt):
+    src = tmp_path / "5_cache.json"
+    src.write_text(json.dumps({"stats_meta": {"chunks_dt": chunks_dt}}))
+    file_api.upload(PROJECT.team_id, str(src), f"{g.TF_STATS_DIR}/5_cats/_cache/5_cache.json")
+
+
+def test_local_and_remote_etags_match(file_api, tmp_path):
+    _upload(file_api, tmp_path, "classes_balance.json", b'{"data": []}')
+    _upload_cache(file_api, tmp_path, "2024-01-02T03:04:05Z")
+    os.makedirs(f"{g.STORAGE_DIR}/5_cats/_cache")
+
+    remote_etag, _ = StatsCache(1024).get(PROJECT.id, "classes_balance.json")
+
+    with open(f"{g.STORAGE_DIR}/5_cats/classes_balance.json", "wb") as f:
+        f.write(b'{"data": []}')
+    with open(f"{g.STORAGE_DIR}/5_cats/_cache/5_cache.json", "w") as f:
+        json.dump({"stats_meta": {"chunks_dt": "2024-01-02T03:04:05Z"}}, f)
+    local_etag, _ = StatsCache(1024).get(PROJECT.id, "classes_balance.json")
+
+    assert remote_etag == local_etag == '"5-2024-01-02T03:04:05Z"'
+
+
+def test_stats_of_a_running_project_are_not_cached(file_api, tmp_path):
+    _upload(file_api, tmp_path, "classes_balance.json", b'{"data": []}')
+    os.makedirs(f"{g.STORAGE_DIR}/5_cats")
+    cache = StatsCache(1024)
+
+    token = cancellation.start_run(PROJECT.id)
+    try:
+        assert cache.get(PROJECT.id, "classes_balance.json")[1] == b'{"data": []}'
+        assert cache.get(PROJECT.id, "classes_balance.json")[1] == b'{"data": []}'
+        assert file_api.calls["download"] == 2
+    finally:
+        cancellation.finish_run(token)
+
+    cache.get(PROJECT.id, "classes_balance.json")
+    cache.get(PROJECT.id, "classes_balance.json")
+    assert file_api.calls["download"] == 3